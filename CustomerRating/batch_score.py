@@ -0,0 +1,187 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from serving import TopKRecommender
+
+
+# users scored per chunk, memory is about chunk_users x candidates x 4 bytes per worker
+CHUNK_USERS = 256
+
+# model and parameters the part files of an output directory were scored with,
+# the leading underscore keeps Parquet readers from taking it for data
+RUN_MANIFEST = '_run.json'
+
+SCORE_SCHEMA = pa.schema([('user_id', pa.int32()), ('item_id', pa.int32()), ('score', pa.float32())])
+TOP_K_SCHEMA = SCORE_SCHEMA.append(pa.field('rank', pa.int16()))
+
+# state of a scoring process, set once by _init_worker
+_worker = {}
+
+
+def _load_ids(path):
+    """ ids from a .npy file, or from a text file of one id per line """
+    if path.endswith('.npy'):
+        return np.load(path).astype(np.int64)
+    return np.loadtxt(path, dtype=np.int64, ndmin=1)
+
+
+def _init_worker(recommender, candidates, output_dir, top_k):
+    _worker.update(recommender=recommender, candidates=candidates, output_dir=output_dir, top_k=top_k)
+
+
+def _scores_table(user_ids, candidates, scores, top_k):
+    """ long format table of a chunk's scores, or of its top_k scores per user with their rank """
+    if top_k is None or top_k >= len(candidates):
+        return pa.table({
+            'user_id': np.repeat(user_ids, len(candidates)).astype(np.int32),
+            'item_id': np.tile(candidates, len(user_ids)).astype(np.int32),
+            'score': scores.astype(np.float32).ravel(),
+        }, schema=SCORE_SCHEMA)
+
+    top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+    return pa.table({
+        'user_id': np.repeat(user_ids, top_k).astype(np.int32),
+        'item_id': candidates[top].astype(np.int32).ravel(),
+        'score': np.take_along_axis(scores, top, axis=1).astype(np.float32).ravel(),
+        'rank': np.tile(np.arange(1, top_k + 1), len(user_ids)).astype(np.int16),
+    }, schema=TOP_K_SCHEMA)
+
+
+def _run_manifest(recommender, user_ids, candidates, top_k, chunk_users):
+    """ what decides the contents of every part file of a run """
+    return {
+        'model': recommender.fingerprint(),
+        'user_ids': hashlib.sha256(np.ascontiguousarray(user_ids, dtype=np.int64).data).hexdigest(),
+        'candidates': hashlib.sha256(np.ascontiguousarray(candidates, dtype=np.int64).data).hexdigest(),
+        'top_k': top_k,
+        'chunk_users': chunk_users,
+    }
+
+
+def _start_run(output_dir, manifest):
+    """ keep the part files of an earlier run with the same manifest, remove those of any other """
+    path = os.path.join(output_dir, RUN_MANIFEST)
+    try:
+        with open(path) as f:
+            if json.load(f) == manifest:
+                return
+    except (OSError, ValueError):
+        pass
+
+    stale = [name for name in os.listdir(output_dir) if name.startswith('part-')]
+    if stale:
+        print('removing {} part files of another model or parameters from {}'.format(len(stale), output_dir))
+    for name in stale:
+        os.remove(os.path.join(output_dir, name))
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def score_chunk(chunk, user_ids):
+    """ score a chunk of users against the candidates and write them as part-<chunk>.parquet """
+    path = os.path.join(_worker['output_dir'], 'part-{:05d}.parquet'.format(chunk))
+    if os.path.exists(path):
+        # written by an earlier run of the job with the same model and parameters
+        return path, 0
+
+    scores = _worker['recommender'].score_users(user_ids, _worker['candidates'])
+    table = _scores_table(user_ids, _worker['candidates'], scores, _worker['top_k'])
+
+    # renamed once complete, a part file is never seen half written
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+    return path, table.num_rows
+
+
+def score_all(recommender, output_dir, user_ids=None, candidates=None, top_k=None, chunk_users=CHUNK_USERS,
+              workers=1):
+    """ score users x candidates chunk by chunk across worker processes, a parquet part file per chunk
+
+    Part files already in output_dir are kept and skipped when RUN_MANIFEST shows they were scored with the
+    same model, users, candidates, top_k and chunk_users, and removed otherwise.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    user_ids = np.arange(recommender.user_gmf.shape[0]) if user_ids is None else np.asarray(user_ids)
+    candidates = np.arange(recommender.n_item) if candidates is None else np.asarray(candidates)
+    _start_run(output_dir, _run_manifest(recommender, user_ids, candidates, top_k, chunk_users))
+    chunks = [(chunk, user_ids[start:start + chunk_users])
+              for chunk, start in enumerate(range(0, len(user_ids), chunk_users))]
+
+    initargs = (recommender, candidates, output_dir, top_k)
+    if workers == 1:
+        _init_worker(*initargs)
+        return [score_chunk(*chunk) for chunk in chunks]
+
+    # workers only need numpy, spawned rather than forked from a process running tensorflow
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        return pool.starmap(score_chunk, chunks, chunksize=1)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='score every user against candidate items with a trained ncf model')
+
+    parser.add_argument('--model_dir', type=str, required=True,
+                        help='saved one-hot or embedding model, a SavedModel directory or an .h5 file')
+    parser.add_argument('--output_dir', type=str, required=True,
+                        help='directory of part-<chunk>.parquet files, the parts of an earlier run with the same '
+                             'model and parameters are kept and skipped, those of any other are removed')
+    parser.add_argument('--user_ids', type=str, default=None,
+                        help='.npy or text file of the users to score, all users by default')
+    parser.add_argument('--candidates', type=str, default=None,
+                        help='.npy or text file of the candidate items, all items by default')
+    parser.add_argument('--top_k', type=int, default=None,
+                        help='write only the k best candidates of each user, with their rank')
+    parser.add_argument('--chunk_users', type=int, default=CHUNK_USERS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import tensorflow as tf
+    from ncf import model_weights
+
+    args = _parse_args()
+
+    ncf_model = tf.keras.models.load_model(args.model_dir, compile=False)
+    recommender = TopKRecommender(model_weights(ncf_model))
+
+    start = time.perf_counter()
+    parts = score_all(
+        recommender, args.output_dir,
+        user_ids=None if args.user_ids is None else _load_ids(args.user_ids),
+        candidates=None if args.candidates is None else _load_ids(args.candidates),
+        top_k=args.top_k, chunk_users=args.chunk_users, workers=args.workers)
+    print('wrote {} rows in {} parts to {} in {:.1f}s'.format(
+        sum(rows for _, rows in parts), len(parts), args.output_dir, time.perf_counter() - start))
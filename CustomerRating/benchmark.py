@@ -0,0 +1,455 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+"""
+Benchmarks for ncf.py
+
+Trains on synthetic ids and prints the timings as JSON, so that they can be
+compared across changes.
+
+    python benchmark.py embedding --n_user 100000 --n_item 20000
+    python benchmark.py pipeline --n_user 100000 --n_item 20000
+    python benchmark.py loading --n_rows 5000000
+    python benchmark.py serving --n_item 200000
+    python benchmark.py batch_scoring --n_user 5000 --n_item 20000
+    python benchmark.py distributed --workers 1 2 4
+    python benchmark.py negatives --n_rows 1000000 --k 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+# pairs per model.predict batch when scoring a whole catalog
+SERVING_PREDICT_BATCH = 1 << 16
+
+
+def synthetic_ratings(n, n_user, n_item, seed=42):
+    """ random (user, item, label) triples """
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, n_user, n)
+    items = rng.integers(0, n_item, n)
+    labels = rng.integers(0, 2, n).astype(np.float32)
+    return users, items, labels
+
+
+def _batches(pipeline, users, items, labels, batch_size, n_user, n_item, one_hot):
+    """ training batches from ncf.batch_generator or ncf.make_dataset """
+    import ncf
+
+    if pipeline == "generator":
+        n_batch = int(np.ceil(len(users) / batch_size))
+        return ncf.batch_generator(x=[users, items], y=labels, batch_size=batch_size, n_batch=n_batch,
+                                   shuffle=True, user_dim=n_user, item_dim=n_item, one_hot=one_hot)
+    return ncf.make_dataset(x=[users, items], y=labels, batch_size=batch_size, shuffle=True,
+                            user_dim=n_user, item_dim=n_item, one_hot=one_hot)
+
+
+def _train_steps(embedding, pipeline, n_user, n_item, batch_size, steps, warmup, results):
+    """ fits a fresh model for warmup then steps batches, reporting to results (runs in its own process) """
+    import tensorflow as tf
+    import ncf
+
+    users, items, labels = synthetic_ratings(batch_size * (warmup + steps), n_user, n_item)
+    model = ncf.build_embedding_graph(n_user, n_item) if embedding else ncf.build_graph(n_user, n_item)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+                  loss=tf.keras.losses.BinaryCrossentropy())
+
+    def fit(n_steps):
+        model.fit(
+            _batches(pipeline, users, items, labels, batch_size, n_user, n_item, one_hot=not embedding),
+            epochs=1, steps_per_epoch=n_steps, verbose=0
+        )
+
+    fit(warmup)
+    start = time.perf_counter()
+    fit(steps)
+    seconds = time.perf_counter() - start
+
+    results.put({
+        "input": "embedding" if embedding else "one-hot",
+        "pipeline": pipeline,
+        "n_user": n_user,
+        "n_item": n_item,
+        "batch_size": batch_size,
+        "parameters": model.count_params(),
+        # bytes of one batch of model inputs
+        "inputBytesPerBatch": batch_size * (2 * 4 if embedding else (n_user + n_item) * 4),
+        "stepsPerSecond": steps / seconds,
+        "peakRssMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+
+
+def _in_process(function, *args):
+    # a fresh process per run, so that peak memory is that run's own
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=function, args=args + (results,))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def _read_epoch(source, data_dir, n_user, n_item, batch_size, results):
+    """ loads train.npy or shards and reads one epoch of id batches (runs in its own process) """
+    import ncf
+
+    start = time.perf_counter()
+    if source == "train.npy":
+        users, items, labels = ncf._load_training_data(data_dir)
+        dataset = ncf.make_dataset(x=[users, items], y=labels, batch_size=batch_size, shuffle=True,
+                                   user_dim=n_user, item_dim=n_item, one_hot=False)
+    else:
+        dataset = ncf.make_sharded_dataset(data_dir, batch_size=batch_size, shuffle=True,
+                                           user_dim=n_user, item_dim=n_item, one_hot=False)
+    batches = iter(dataset)
+    next(batches)
+    first_batch = time.perf_counter() - start
+
+    rows = 0
+    for _, y_batch in batches:
+        rows += len(y_batch)
+    seconds = time.perf_counter() - start
+
+    results.put({
+        "source": source,
+        "firstBatchSeconds": first_batch,
+        "epochSeconds": seconds,
+        "rowsPerSecond": (rows + batch_size) / seconds,
+        "peakRssMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    })
+
+
+def _write_data(data_dir, n_rows, n_user, n_item, shard_rows, results):
+    """ writes the same synthetic ratings as train.npy and as shards (runs in its own process) """
+    import ncf
+
+    users, items, labels = synthetic_ratings(n_rows, n_user, n_item)
+    # as the data preparation notebook saves it, a table of Python objects
+    train = np.stack([users, items, labels.astype(np.int64)], 1).astype(object)
+    np.save(os.path.join(data_dir, "train.npy"), train)
+    ncf.write_shards([users, items], labels, os.path.join(data_dir, "shards"), shard_rows)
+    results.put(None)
+
+
+def benchmark_embedding(args):
+    """ one-hot Dense inputs against integer id Embedding inputs """
+    rows = [
+        _in_process(_train_steps, embedding, "generator", args.n_user, args.n_item, args.batch_size, args.steps,
+                    args.warmup)
+        for embedding in [False, True]
+    ]
+    rows[1]["speedup"] = rows[1]["stepsPerSecond"] / rows[0]["stepsPerSecond"]
+    rows[1]["memoryRatio"] = rows[0]["peakRssMB"] / rows[1]["peakRssMB"]
+    return rows
+
+
+def benchmark_pipeline(args):
+    """ ncf.batch_generator against the ncf.make_dataset tf.data pipeline feeding training """
+    rows = []
+    for embedding in [False, True]:
+        pair = [
+            _in_process(_train_steps, embedding, pipeline, args.n_user, args.n_item, args.batch_size, args.steps,
+                        args.warmup)
+            for pipeline in ["generator", "dataset"]
+        ]
+        pair[1]["speedup"] = pair[1]["stepsPerSecond"] / pair[0]["stepsPerSecond"]
+        rows.extend(pair)
+    return rows
+
+
+def benchmark_loading(args):
+    """ train.npy loaded into memory against memory-mapped shards written by convert_training_data.py """
+    with tempfile.TemporaryDirectory() as data_dir:
+        # peak memory is inherited by child processes, the data is made in one too
+        _in_process(_write_data, data_dir, args.n_rows, args.n_user, args.n_item, args.shard_rows)
+
+        rows = [
+            _in_process(_read_epoch, "train.npy", data_dir, args.n_user, args.n_item, args.batch_size),
+            _in_process(_read_epoch, "shards", os.path.join(data_dir, "shards"), args.n_user, args.n_item,
+                        args.batch_size),
+        ]
+        rows[0]["fileMB"] = os.path.getsize(os.path.join(data_dir, "train.npy")) / 1e6
+        rows[1]["fileMB"] = sum(os.path.getsize(os.path.join(path, name))
+                                for path, _, names in os.walk(os.path.join(data_dir, "shards")) for name in names) / 1e6
+
+    rows[1]["memoryRatio"] = rows[0]["peakRssMB"] / rows[1]["peakRssMB"]
+    return rows
+
+
+def benchmark_serving(args):
+    """ serving.TopKRecommender against model.predict over every user x item pair """
+    import tensorflow as tf
+    import ncf
+    import serving
+
+    if args.model_dir:
+        one_hot_model = tf.keras.models.load_model(args.model_dir, compile=False)
+    else:
+        tf.random.set_seed(42)
+        one_hot_model = ncf.build_graph(args.n_user, args.n_item)
+    # the same predictions as the one-hot model, which is too large to feed the whole catalog
+    embedding_model = ncf.convert_to_embedding_model(one_hot_model)
+
+    start = time.perf_counter()
+    recommender = serving.TopKRecommender(ncf.model_weights(one_hot_model))
+    setup = time.perf_counter() - start
+    n_user, n_item = recommender.user_gmf.shape[0], recommender.n_item
+    users = np.random.default_rng(0).integers(0, n_user, args.requests)
+
+    def timed(recommend):
+        start = time.perf_counter()
+        results = [recommend(user) for user in users]
+        return (time.perf_counter() - start) / len(users), results
+
+    def predict(user):
+        scores = embedding_model.predict([np.full(n_item, user, dtype=np.int32), np.arange(n_item, dtype=np.int32)],
+                                         batch_size=SERVING_PREDICT_BATCH, verbose=0)[:, 0]
+        top = np.argpartition(-scores, args.k - 1)[:args.k]
+        return top[np.argsort(-scores[top])], scores[top[np.argsort(-scores[top])]]
+
+    predict(users[0])
+    predict_seconds, expected = timed(predict)
+    exact_seconds, exact = timed(lambda user: recommender.recommend(user, args.k))
+
+    rows = [
+        {"method": "model.predict", "n_item": n_item, "k": args.k, "secondsPerRequest": predict_seconds},
+        {"method": "exact", "n_item": n_item, "k": args.k, "secondsPerRequest": exact_seconds,
+         "speedup": predict_seconds / exact_seconds, "setupSeconds": setup,
+         "sameItems": all(set(a[0]) == set(b[0]) for a, b in zip(expected, exact)),
+         "maxScoreError": max(float(np.abs(a[1] - b[1]).max()) for a, b in zip(expected, exact))},
+    ]
+
+    start = time.perf_counter()
+    recommender.build_index(args.n_clusters)
+    index_seconds = time.perf_counter() - start
+    for nprobe in args.nprobe:
+        seconds, approximate = timed(lambda user: recommender.recommend(user, args.k, nprobe=nprobe))
+        rows.append({
+            "method": "index", "n_item": n_item, "k": args.k, "n_clusters": args.n_clusters, "nprobe": nprobe,
+            "secondsPerRequest": seconds, "speedup": predict_seconds / seconds, "setupSeconds": index_seconds,
+            "recall": float(np.mean([len(set(a[0]) & set(b[0])) / args.k for a, b in zip(exact, approximate)])),
+        })
+    return rows
+
+
+def benchmark_batch_scoring(args):
+    """ batch_score.score_all against model.predict over user x item pairs, chunk by chunk """
+    import tensorflow as tf
+    import batch_score
+    import ncf
+    import serving
+
+    tf.random.set_seed(42)
+    one_hot_model = ncf.build_graph(args.n_user, args.n_item)
+    embedding_model = ncf.convert_to_embedding_model(one_hot_model)
+    recommender = serving.TopKRecommender(ncf.model_weights(one_hot_model))
+    items = np.arange(args.n_item, dtype=np.int32)
+
+    # model.predict on a few chunks only, it is too slow for every user
+    users = np.arange(min(args.n_user, args.predict_users), dtype=np.int32)
+    start = time.perf_counter()
+    for chunk in range(0, len(users), args.chunk_users):
+        chunk_users = users[chunk:chunk + args.chunk_users]
+        embedding_model.predict([np.repeat(chunk_users, args.n_item), np.tile(items, len(chunk_users))],
+                                batch_size=SERVING_PREDICT_BATCH, verbose=0)
+    seconds = time.perf_counter() - start
+    rows = [{"method": "model.predict", "users": len(users), "rowsPerSecond": len(users) * args.n_item / seconds}]
+
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter()
+            parts = batch_score.score_all(recommender, output_dir, top_k=args.top_k, chunk_users=args.chunk_users,
+                                          workers=workers)
+            seconds = time.perf_counter() - start
+            rows.append({
+                "method": "score_all", "users": args.n_user, "workers": workers, "top_k": args.top_k,
+                "rowsWritten": sum(n for _, n in parts), "seconds": seconds,
+                "rowsPerSecond": args.n_user * args.n_item / seconds,
+                "speedup": args.n_user * args.n_item / seconds / rows[0]["rowsPerSecond"],
+            })
+    return rows
+
+
+def benchmark_distributed(args):
+    """ ncf.py training throughput across 1..n local worker processes launched by launch_local.py """
+    import launch_local
+
+    users, items, labels = synthetic_ratings(args.n_rows, args.n_user, args.n_item)
+    rows = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        np.save(os.path.join(data_dir, "train.npy"), np.stack([users, items, labels.astype(np.int64)], 1))
+
+        def train(workers, epochs):
+            script_args = ["--train", data_dir, "--sm-model-dir", os.path.join(data_dir, "model"),
+                           "--n_user", str(args.n_user), "--n_item", str(args.n_item), "--epochs", str(epochs),
+                           "--batch_size", str(args.batch_size)] + (["--embedding"] if args.embedding else [])
+            start = time.perf_counter()
+            exit_codes = launch_local.launch(workers, script_args, args.base_port, stdout=subprocess.DEVNULL)
+            if any(exit_codes):
+                raise Exception("training with {} workers failed: {}".format(workers, exit_codes))
+            return time.perf_counter() - start
+
+        for workers in args.workers:
+            # the second epoch alone, without process start, graph building and the first epoch's tracing
+            epoch_seconds = train(workers, 2) - train(workers, 1)
+            rows.append({
+                "workers": workers,
+                "globalBatchSize": args.batch_size * workers,
+                "epochSeconds": epoch_seconds,
+                "examplesPerSecond": args.n_rows / epoch_seconds,
+            })
+
+    for row in rows:
+        row["speedup"] = row["examplesPerSecond"] / rows[0]["examplesPerSecond"]
+        row["cpus"] = os.cpu_count()
+    return rows
+
+
+def _notebook_negative_sampling(customer_ids, product_ids, items, n_neg):
+    """ negative_sampling of data-preparation-notebook.ipynb, without the final DataFrame """
+    neg = []
+    records = set(zip(customer_ids, product_ids))
+    for (u, i) in records:
+        for _ in range(n_neg):
+            j = np.random.choice(items)
+            while (u, j) in records:
+                j = np.random.choice(items)
+            neg.append([u, j, 0])
+    return neg
+
+
+def benchmark_negatives(args):
+    """ the notebook's Python loop against ncf.sample_negatives, and a pass of make_dataset drawing them """
+    import ncf
+    import tensorflow as tf
+
+    users, items, _ = synthetic_ratings(args.n_rows, args.n_user, args.n_item)
+    labels = np.ones(args.n_rows, np.float32)
+    rows = []
+
+    start = time.perf_counter()
+    _notebook_negative_sampling(users[:args.loop_rows].tolist(), items[:args.loop_rows].tolist(),
+                                np.arange(args.n_item), args.k)
+    seconds = time.perf_counter() - start
+    rows.append({"sampler": "notebook loop", "positives": args.loop_rows,
+                 "negativesPerSecond": args.loop_rows * args.k / seconds})
+
+    start = time.perf_counter()
+    positive_keys = ncf.positive_index(users, items, args.n_item)
+    index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    negative_users, negative_items = ncf.sample_negatives(users, positive_keys, args.n_item, args.k,
+                                                          np.random.default_rng(0))
+    seconds = time.perf_counter() - start
+    hits = np.isin(negative_users.astype(np.int64) * args.n_item + negative_items, positive_keys)
+    rows.append({"sampler": "sample_negatives", "positives": args.n_rows, "indexSeconds": index_seconds,
+                 "negativesPerSecond": len(negative_users) / seconds, "positivesSampled": int(hits.sum())})
+
+    dataset = ncf.make_dataset((users, items), labels, args.batch_size, shuffle=True, user_dim=args.n_user,
+                               item_dim=args.n_item, one_hot=False, seed=0, negatives=args.k)
+    start = time.perf_counter()
+    examples = sum(int(tf.shape(y)[0]) for _, y in dataset)
+    seconds = time.perf_counter() - start
+    rows.append({"sampler": "make_dataset negatives", "positives": args.n_rows, "epochSeconds": seconds,
+                 "examplesPerSecond": examples / seconds})
+
+    rows[1]["speedup"] = rows[1]["negativesPerSecond"] / rows[0]["negativesPerSecond"]
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    embedding_parser = subparsers.add_parser("embedding", help=benchmark_embedding.__doc__)
+    embedding_parser.add_argument("--n_user", type=int, default=100000)
+    embedding_parser.add_argument("--n_item", type=int, default=20000)
+    embedding_parser.add_argument("--batch_size", type=int, default=256)
+    embedding_parser.add_argument("--steps", type=int, default=50)
+    embedding_parser.add_argument("--warmup", type=int, default=5)
+    embedding_parser.set_defaults(run=benchmark_embedding)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help=benchmark_pipeline.__doc__)
+    pipeline_parser.add_argument("--n_user", type=int, default=100000)
+    pipeline_parser.add_argument("--n_item", type=int, default=20000)
+    pipeline_parser.add_argument("--batch_size", type=int, default=256)
+    pipeline_parser.add_argument("--steps", type=int, default=50)
+    pipeline_parser.add_argument("--warmup", type=int, default=5)
+    pipeline_parser.set_defaults(run=benchmark_pipeline)
+
+    loading_parser = subparsers.add_parser("loading", help=benchmark_loading.__doc__)
+    loading_parser.add_argument("--n_rows", type=int, default=5000000)
+    loading_parser.add_argument("--n_user", type=int, default=100000)
+    loading_parser.add_argument("--n_item", type=int, default=20000)
+    loading_parser.add_argument("--batch_size", type=int, default=1024)
+    loading_parser.add_argument("--shard_rows", type=int, default=1 << 20)
+    loading_parser.set_defaults(run=benchmark_loading)
+
+    serving_parser = subparsers.add_parser("serving", help=benchmark_serving.__doc__)
+    serving_parser.add_argument("--model_dir", type=str, default=None,
+                                help="trained model to serve, a randomly initialized one by default")
+    serving_parser.add_argument("--n_user", type=int, default=10000)
+    serving_parser.add_argument("--n_item", type=int, default=200000)
+    serving_parser.add_argument("--k", type=int, default=10)
+    serving_parser.add_argument("--requests", type=int, default=20)
+    serving_parser.add_argument("--n_clusters", type=int, default=1024)
+    serving_parser.add_argument("--nprobe", type=int, nargs="+", default=[16, 64, 256])
+    serving_parser.set_defaults(run=benchmark_serving)
+
+    batch_scoring_parser = subparsers.add_parser("batch_scoring", help=benchmark_batch_scoring.__doc__)
+    batch_scoring_parser.add_argument("--n_user", type=int, default=5000)
+    batch_scoring_parser.add_argument("--n_item", type=int, default=20000)
+    batch_scoring_parser.add_argument("--chunk_users", type=int, default=256)
+    batch_scoring_parser.add_argument("--predict_users", type=int, default=512)
+    batch_scoring_parser.add_argument("--top_k", type=int, default=None)
+    batch_scoring_parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    batch_scoring_parser.set_defaults(run=benchmark_batch_scoring)
+
+    distributed_parser = subparsers.add_parser("distributed", help=benchmark_distributed.__doc__)
+    distributed_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    distributed_parser.add_argument("--n_rows", type=int, default=500000)
+    distributed_parser.add_argument("--n_user", type=int, default=10000)
+    distributed_parser.add_argument("--n_item", type=int, default=5000)
+    distributed_parser.add_argument("--batch_size", type=int, default=256)
+    distributed_parser.add_argument("--embedding", action="store_true")
+    distributed_parser.add_argument("--base_port", type=int, default=23456)
+    distributed_parser.set_defaults(run=benchmark_distributed)
+
+    negatives_parser = subparsers.add_parser("negatives", help=benchmark_negatives.__doc__)
+    negatives_parser.add_argument("--n_rows", type=int, default=1000000)
+    negatives_parser.add_argument("--n_user", type=int, default=100000)
+    negatives_parser.add_argument("--n_item", type=int, default=20000)
+    negatives_parser.add_argument("--k", type=int, default=5)
+    negatives_parser.add_argument("--loop_rows", type=int, default=50000,
+                                  help="positives given to the notebook loop, it takes too long for all of them")
+    negatives_parser.add_argument("--batch_size", type=int, default=1024)
+    negatives_parser.set_defaults(run=benchmark_negatives)
+
+    args = parser.parse_args()
+    print(json.dumps(args.run(args), indent=2))
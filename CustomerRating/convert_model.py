@@ -0,0 +1,44 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+
+import tensorflow as tf
+import argparse
+
+from ncf import convert_to_embedding_model
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='convert a one-hot input ncf model to the equivalent integer id Embedding model')
+
+    parser.add_argument('--model_dir', type=str, required=True,
+                        help='saved one-hot model, a SavedModel directory or an .h5 file')
+    parser.add_argument('--output_dir', type=str, required=True)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+
+    one_hot_model = tf.keras.models.load_model(args.model_dir, compile=False)
+    embedding_model = convert_to_embedding_model(one_hot_model)
+    embedding_model.save(args.output_dir)
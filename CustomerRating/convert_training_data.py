@@ -0,0 +1,54 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import argparse
+import numpy as np
+
+from ncf import SHARD_ROWS, write_shards
+
+
+def _load_columns(path):
+    """ user, item and label columns of a train.npy, memory-mapped unless it holds Python objects """
+    try:
+        df_train = np.load(path, mmap_mode='r')
+    except ValueError:
+        df_train = np.load(path, allow_pickle=True)
+
+    return df_train[:, 0], df_train[:, 1], df_train[:, 2]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='convert train.npy to sharded int32/int32/float32 columns read memory-mapped by ncf.py')
+
+    parser.add_argument('--input', type=str, required=True,
+                        help='train.npy as saved by the data preparation notebook')
+    parser.add_argument('--output_dir', type=str, required=True,
+                        help='upload this directory as the training channel in place of train.npy')
+    parser.add_argument('--shard_rows', type=int, default=SHARD_ROWS)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+
+    user_train, item_train, train_labels = _load_columns(args.input)
+    manifest = write_shards([user_train, item_train], train_labels, args.output_dir, args.shard_rows)
+    print('wrote {} rows in {} shards to {}'.format(manifest['rows'], len(manifest['shards']), args.output_dir))
@@ -0,0 +1,62 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+NCF_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ncf.py')
+
+# port of the first local worker, the others take the next ones
+BASE_PORT = 23456
+
+
+def launch(num_workers, script_args, base_port=BASE_PORT, script=NCF_SCRIPT, stdout=None):
+    """ run num_workers ncf.py processes as the hosts of one SageMaker training job, returns their exit codes """
+    hosts = ['localhost:{}'.format(base_port + k) for k in range(num_workers)]
+
+    processes = [
+        subprocess.Popen([sys.executable, script] + list(script_args),
+                         env=dict(os.environ, SM_HOSTS=json.dumps(hosts), SM_CURRENT_HOST=host),
+                         stdout=stdout, stderr=stdout)
+        for host in hosts
+    ]
+    return [process.wait() for process in processes]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='train ncf.py data parallel across several local processes, arguments after -- go to ncf.py')
+
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--base_port', type=int, default=BASE_PORT)
+
+    return parser.parse_known_args()
+
+
+if __name__ == "__main__":
+    args, script_args = _parse_args()
+    if script_args[:1] == ['--']:
+        script_args = script_args[1:]
+
+    exit_codes = launch(args.workers, script_args, args.base_port)
+    sys.exit(max(exit_codes))
@@ -22,20 +22,153 @@
 import tensorflow as tf
 import argparse
 import os
+import shutil
+import tempfile
 import numpy as np
 import json
 
 
+# sharded training data: a directory per shard of user.npy, item.npy and label.npy columns,
+# listed with their row counts in the manifest and read memory-mapped
+SHARD_MANIFEST = 'manifest.json'
+SHARD_ROWS = 1 << 22
+SHARD_COLUMNS = [('user', np.int32), ('item', np.int32), ('label', np.float32)]
+
+# memory-mapped columns of the shards opened by this process, by shard directory
+_open_shards = {}
+
+# smallest share of the largest worker's rows every worker must get for shards to be split whole across workers
+SHARD_BALANCE = 0.9
+
+# port the MultiWorkerMirroredStrategy workers listen on, for hosts given without one
+WORKER_PORT = 2222
+
+# redraws of negatives that hit a positive, users with nearly every item positive get fewer negatives
+NEGATIVE_SAMPLING_ROUNDS = 32
+
+
 # for data processing
 def _load_training_data(base_dir):
     """ load training data """
     df_train = np.load(os.path.join(base_dir, 'train.npy'), allow_pickle=True)
-    user_train, item_train, y_train = np.split(np.transpose(df_train).flatten(), 3)
+    # column views, no copies of the table
+    user_train, item_train, y_train = df_train[:, 0], df_train[:, 1], df_train[:, 2]
     return user_train, item_train, y_train
 
 
-def batch_generator(x, y, batch_size, n_batch, shuffle, user_dim, item_dim):
-    """ batch generator to supply data for training and testing """
+def write_shards(x, y, output_dir, shard_rows=SHARD_ROWS):
+    """ write training data as typed, memory-mappable shards, one shard of columns in memory at a time """
+    user_df, item_df = x
+    n = len(y)
+
+    shards = []
+    for k, start in enumerate(range(0, n, shard_rows)):
+        stop = min(start + shard_rows, n)
+        shard = 'shard-{:05d}'.format(k)
+        os.makedirs(os.path.join(output_dir, shard), exist_ok=True)
+
+        for (name, dtype), column in zip(SHARD_COLUMNS, [user_df, item_df, y]):
+            np.save(os.path.join(output_dir, shard, name + '.npy'), np.asarray(column[start:stop]).astype(dtype))
+        shards.append({'path': shard, 'rows': stop - start})
+
+    # written last, a directory without a manifest is an incomplete conversion
+    manifest = {'rows': n, 'shards': shards}
+    with open(os.path.join(output_dir, SHARD_MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+    return manifest
+
+
+def read_manifest(data_dir):
+    """ read the manifest of a sharded training data directory """
+    with open(os.path.join(data_dir, SHARD_MANIFEST)) as f:
+        return json.load(f)
+
+
+def open_shard(path):
+    """ memory-mapped user, item and label columns of a shard, opened once per process """
+    if path not in _open_shards:
+        _open_shards[path] = tuple(
+            np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name, _ in SHARD_COLUMNS)
+    return _open_shards[path]
+
+
+def _worker_shards(shards, num_shards, shard_index):
+    """ (shard, first row, row step, rows) a worker reads, whole shards or every num_shards-th row of every shard """
+    # whole shards only when that leaves every worker about as many rows, with fewer shards than workers or a
+    # short last shard some would run out of steps first, or have no rows at all
+    by_shard = [shards[k::num_shards] for k in range(num_shards)]
+    worker_rows = [sum(shard['rows'] for shard in worker) for worker in by_shard]
+    if min(worker_rows) >= SHARD_BALANCE * max(worker_rows):
+        return [(shard, 0, 1, shard['rows']) for shard in by_shard[shard_index]]
+    return [(shard, shard_index, num_shards, (shard['rows'] - shard_index + num_shards - 1) // num_shards)
+            for shard in shards if shard['rows'] > shard_index]
+
+
+def _read_shard_rows(path, batch_index):
+    """ read a batch of rows of a shard, in file order """
+    batch_index = np.sort(batch_index)
+    return tuple(column[batch_index] for column in open_shard(path.decode()))
+
+
+def shard_positive_index(data_dir, n_item):
+    """ positive_index of the rows labelled positive in every shard of a sharded training data directory """
+    keys = []
+    for shard in read_manifest(data_dir)['shards']:
+        user_shard, item_shard, y_shard = open_shard(os.path.join(data_dir, shard['path']))
+        positive = np.asarray(y_shard) > 0
+        keys.append(positive_index(user_shard[positive], item_shard[positive], n_item))
+    return np.unique(np.concatenate(keys))
+
+
+def _positive_rows(data_dir, worker_shards):
+    """ indices of the rows labelled positive among those a worker reads, per _worker_shards shard """
+    positive_rows = []
+    for shard, first, step, _ in worker_shards:
+        y_shard = open_shard(os.path.join(data_dir, shard['path']))[2]
+        positive_rows.append(first + step * np.flatnonzero(np.asarray(y_shard[first::step]) > 0))
+    return positive_rows
+
+
+def positive_index(user_df, item_df, n_item):
+    """ sorted unique user * n_item + item keys of the positive interactions """
+    return np.unique(np.asarray(user_df).astype(np.int64) * n_item + np.asarray(item_df).astype(np.int64))
+
+
+def sample_negatives(user_df, positive_keys, n_item, k, rng):
+    """ k uniformly drawn items per user that are not among its positives, looked up in positive_keys """
+    users = np.repeat(np.asarray(user_df).astype(np.int64), k)
+    items = rng.integers(0, n_item, len(users))
+
+    # redraw only the draws that hit a positive, until none does, with no positives there is nothing to redraw
+    pending = np.arange(len(users) if len(positive_keys) else 0)
+    for _ in range(NEGATIVE_SAMPLING_ROUNDS):
+        keys = users[pending] * n_item + items[pending]
+        found = np.minimum(np.searchsorted(positive_keys, keys), len(positive_keys) - 1)
+        pending = pending[positive_keys[found] == keys]
+        if not len(pending):
+            break
+        items[pending] = rng.integers(0, n_item, len(pending))
+    else:
+        keep = np.ones(len(users), dtype=bool)
+        keep[pending] = False
+        users, items = users[keep], items[keep]
+
+    return users.astype(np.int32), items.astype(np.int32)
+
+
+def _with_negatives(user_df, item_df, positive_keys, n_item, k, rng):
+    """ positives labelled 1 followed by k fresh negatives each labelled 0 """
+    negative_users, negative_items = sample_negatives(user_df, positive_keys, n_item, k, rng)
+    return (
+        np.concatenate([user_df, negative_users]).astype(np.int32),
+        np.concatenate([item_df, negative_items]).astype(np.int32),
+        np.concatenate([np.ones(len(user_df), np.float32), np.zeros(len(negative_users), np.float32)]),
+    )
+
+
+def batch_generator(x, y, batch_size, n_batch, shuffle, user_dim, item_dim, one_hot=True):
+    """ batch generator to supply data for training and testing, one-hot vectors or integer ids """
 
     user_df, item_df = x
     counter = 0
@@ -46,8 +179,12 @@ def batch_generator(x, y, batch_size, n_batch, shuffle, user_dim, item_dim):
         
     while True:
         batch_index = training_index[batch_size*counter:batch_size*(counter+1)]
-        user_batch = tf.one_hot(user_df[batch_index], depth=user_dim)
-        item_batch = tf.one_hot(item_df[batch_index], depth=item_dim)
+        if one_hot:
+            user_batch = tf.one_hot(user_df[batch_index], depth=user_dim)
+            item_batch = tf.one_hot(item_df[batch_index], depth=item_dim)
+        else:
+            user_batch = np.asarray(user_df[batch_index]).astype(np.int32)
+            item_batch = np.asarray(item_df[batch_index]).astype(np.int32)
 
         y_batch = y[batch_index]
         counter += 1
@@ -59,6 +196,153 @@ def batch_generator(x, y, batch_size, n_batch, shuffle, user_dim, item_dim):
                 np.random.shuffle(training_index)
             counter = 0
                 
+
+def _permuted_batches(n, batch_size, shuffle, pass_seed):
+    """ index vectors covering range(n) batch by batch, in an order drawn from pass_seed when shuffling """
+    n = tf.cast(n, tf.int64)
+    n_batch = (n + batch_size - 1) // batch_size
+
+    # one permutation per pass, sliced into batches, instead of shuffling example by example
+    if shuffle:
+        order = tf.random.experimental.stateless_shuffle(tf.range(n), seed=tf.stack([pass_seed, 0]))
+    else:
+        order = tf.range(n)
+
+    return tf.data.Dataset.range(n_batch).map(lambda k: order[k*batch_size:(k+1)*batch_size])
+
+
+def _index_batches(n, batch_size, shuffle, seed=None):
+    """ index vectors covering range(n) batch by batch, in a new random order on every pass when shuffling """
+    return tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).take(1).flat_map(
+        lambda pass_seed: _permuted_batches(n, batch_size, shuffle, pass_seed))
+
+
+def _encode_batch(user_dim, item_dim, one_hot):
+    """ map function turning a batch of ids into model inputs, one-hot vectors or integer ids """
+    def encode(user_batch, item_batch, y_batch):
+        if one_hot:
+            user_batch = tf.one_hot(user_batch, depth=user_dim)
+            item_batch = tf.one_hot(item_batch, depth=item_dim)
+        return (user_batch, item_batch), y_batch
+
+    return encode
+
+
+def make_dataset(x, y, batch_size, shuffle, user_dim, item_dim, one_hot=True, seed=None, num_shards=1, shard_index=0,
+                 negatives=0):
+    """ tf.data pipeline over in-memory arrays, batches gathered, encoded and prefetched in parallel
+
+    With negatives, only the rows labelled positive are used, and every pass adds that many freshly sampled
+    negatives per positive, excluding all the positives of their user.
+    """
+    user_df, item_df = x
+    if negatives:
+        positive = np.asarray(y) > 0
+        user_df, item_df = np.asarray(user_df)[positive], np.asarray(item_df)[positive]
+        positive_keys = positive_index(user_df, item_df, item_dim)
+
+    # every num_shards-th row from shard_index, only this worker's rows become tensors
+    user_df = np.asarray(user_df[shard_index::num_shards]).astype(np.int32)
+    item_df = np.asarray(item_df[shard_index::num_shards]).astype(np.int32)
+
+    if negatives:
+        def sample(pass_seed):
+            return _with_negatives(user_df, item_df, positive_keys, item_dim, negatives,
+                                   np.random.default_rng(abs(int(pass_seed))))
+
+        def batches(pass_seed):
+            # the pass's positives and negatives, permuted and sliced into batches as they are without negatives
+            columns = tf.numpy_function(sample, [pass_seed], [tf.int32, tf.int32, tf.float32])
+            for column in columns:
+                column.set_shape([None])
+            return _permuted_batches(tf.shape(columns[0])[0], batch_size, shuffle, pass_seed).map(
+                lambda batch_index: tuple(tf.gather(column, batch_index) for column in columns))
+
+        dataset = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).take(1).flat_map(batches)
+    else:
+        columns = (
+            tf.constant(user_df),
+            tf.constant(item_df),
+            tf.constant(np.asarray(y[shard_index::num_shards]).astype(np.float32)),
+        )
+        dataset = _index_batches(columns[0].shape[0], batch_size, shuffle, seed).map(
+            lambda batch_index: tuple(tf.gather(column, batch_index) for column in columns),
+            num_parallel_calls=tf.data.AUTOTUNE)
+
+    dataset = dataset.map(_encode_batch(user_dim, item_dim, one_hot), num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def make_sharded_dataset(data_dir, batch_size, shuffle, user_dim, item_dim, one_hot=True, seed=None,
+                         cycle_length=4, num_shards=1, shard_index=0, negatives=0):
+    """ tf.data pipeline reading batches straight from memory-mapped shards, cycle_length shards interleaved
+
+    With negatives, batches are drawn from the rows labelled positive alone, and every batch of
+    batch_size / (1 + negatives) of them gets that many freshly sampled negatives per positive, excluding all the
+    positives of their user.
+    """
+    shards = _worker_shards(read_manifest(data_dir)['shards'], num_shards, shard_index)
+    if not shards:
+        raise ValueError('no rows in {} for worker {} of {}'.format(data_dir, shard_index, num_shards))
+
+    firsts = [first for _, first, _, _ in shards]
+    rows = [rows for _, _, _, rows in shards]
+    if negatives:
+        # the positive rows of all shards in one tensor, the k-th of a shard at its first + k
+        positive_rows = _positive_rows(data_dir, shards)
+        positions = tf.constant(np.concatenate(positive_rows).astype(np.int64))
+        rows = [len(shard_rows) for shard_rows in positive_rows]
+        firsts = np.cumsum([0] + rows[:-1])
+
+        def row_index(shard, batch_index):
+            return tf.gather(positions, shard[1] + batch_index)
+    else:
+        def row_index(shard, batch_index):
+            return shard[1] + batch_index * shard[2]
+
+    # (path, first, row step, rows) of this worker's shards
+    dataset = tf.data.Dataset.from_tensor_slices((
+        [os.path.join(data_dir, shard['path']) for shard, _, _, _ in shards],
+        np.array(firsts, dtype=np.int64),
+        np.array([step for _, _, step, _ in shards], dtype=np.int64),
+        np.array(rows, dtype=np.int64),
+    ))
+    if shuffle:
+        dataset = dataset.shuffle(len(shards), seed=seed)
+
+    # a seed per shard and pass, drawn here since the per shard datasets are recreated on every pass
+    dataset = tf.data.Dataset.zip((dataset, tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True)))
+
+    # (shard, batch of row indices, batch seed) triples, the rows themselves are only read by the next map
+    rows_per_batch = max(1, batch_size // (1 + negatives))
+    dataset = dataset.interleave(
+        lambda shard, pass_seed: _permuted_batches(shard[3], rows_per_batch, shuffle, pass_seed).enumerate().map(
+            lambda k, batch_index: (shard[0], row_index(shard, batch_index), tf.stack([pass_seed, k]))),
+        cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+
+    read_batch = _read_shard_rows
+    if negatives:
+        positive_keys = shard_positive_index(data_dir, item_dim)
+
+        def read_batch(path, batch_index, batch_seed):
+            user_batch, item_batch, _ = _read_shard_rows(path, batch_index)
+            return _with_negatives(user_batch, item_batch, positive_keys, item_dim, negatives,
+                                   np.random.default_rng(np.abs(batch_seed)))
+
+    def read_rows(path, batch_index, batch_seed):
+        inputs = [path, batch_index, batch_seed] if negatives else [path, batch_index]
+        columns = tf.numpy_function(read_batch, inputs, [tf.int32, tf.int32, tf.float32])
+        for column in columns:
+            column.set_shape([None])
+        return tuple(columns)
+
+    dataset = dataset.map(read_rows, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.map(_encode_batch(user_dim, item_dim, one_hot), num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
 # network
 def _get_user_embedding_layers(inputs, emb_dim):
     """ create user embeddings """
@@ -76,6 +360,19 @@ def _get_item_embedding_layers(inputs, emb_dim):
     return item_gmf_emb, item_mlp_emb
 
 
+def _get_id_embedding_layers(inputs, input_dim, emb_dim):
+    """ create embeddings from integer ids, relu(E[id]) without a bias, E = W + b when converted from Dense layers """
+    # convert_to_embedding_model folds the one-hot Dense bias into every row of the table, a bias here counts it twice
+    # glorot_uniform over the (input_dim, emb_dim) table, the Dense kernel initialization
+    gmf_emb = tf.keras.layers.Embedding(input_dim, emb_dim, embeddings_initializer='glorot_uniform')(inputs)
+    mlp_emb = tf.keras.layers.Embedding(input_dim, emb_dim, embeddings_initializer='glorot_uniform')(inputs)
+
+    gmf_emb = tf.keras.layers.Activation('relu')(gmf_emb)
+    mlp_emb = tf.keras.layers.Activation('relu')(mlp_emb)
+
+    return gmf_emb, mlp_emb
+
+
 def _gmf(user_emb, item_emb):
     """ general matrix factorization branch """
     gmf_mat = tf.keras.layers.Multiply()([user_emb, item_emb])
@@ -136,25 +433,194 @@ def build_graph(user_dim, item_dim, dropout_rate=0.25):
     return model
 
 
-def model(x_train, y_train, n_user, n_item, num_epoch, batch_size):
-    num_batch = np.ceil(x_train[0].shape[0]/batch_size)
+def build_embedding_graph(user_dim, item_dim, dropout_rate=0.25):
+    """ neural collaborative filtering model on integer user and item ids """
+
+    user_input = tf.keras.Input(shape=(), dtype='int32')
+    item_input = tf.keras.Input(shape=(), dtype='int32')
+
+    # create embedding layers, lookups instead of products with one-hot vectors
+    user_gmf_emb, user_mlp_emb = _get_id_embedding_layers(user_input, user_dim, 32)
+    item_gmf_emb, item_mlp_emb = _get_id_embedding_layers(item_input, item_dim, 32)
+
+    # general matrix factorization
+    gmf = _gmf(user_gmf_emb, item_gmf_emb)
+
+    # multi layer perceptron
+    mlp = _mlp(user_mlp_emb, item_mlp_emb, dropout_rate)
+
+    # output
+    output = _neuCF(gmf, mlp, dropout_rate)
+
+    # create the model
+    model = tf.keras.Model(inputs=[user_input, item_input], outputs=output)
+
+    return model
+
+
+def _layer_graph(model):
+    """ class, inbound layer names and depth of every layer of a functional model, from its config """
+    config = model.get_config()
+    layers = {
+        layer['name']: (layer['class_name'], [node[0] for nodes in layer['inbound_nodes'] for node in nodes])
+        for layer in config['layers']
+    }
+
+    depths = {}
+
+    def depth(name):
+        if name not in depths:
+            depths[name] = 1 + max([depth(inbound) for inbound in layers[name][1]], default=-1)
+        return depths[name]
+
+    return {name: (class_name, inbound, depth(name)) for name, (class_name, inbound) in layers.items()}, config
 
-    # build graph
-    model = build_graph(n_user, n_item)
 
-    # compile and train
-    optimizer = tf.keras.optimizers.Adam(learning_rate=1e-3)
-    model.compile(optimizer=optimizer,
-                  loss=tf.keras.losses.BinaryCrossentropy(),
-                  metrics=['accuracy'])
+def _embedding_layer_names(graph, input_name, class_name):
+    """ the (gmf, mlp) embedding layers fed by an input, told apart by the gmf one feeding Multiply """
+    embeddings = [name for name, (layer_class, inbound, _) in graph.items()
+                  if layer_class == class_name and inbound == [input_name]]
+
+    def feeds_multiply(name):
+        # directly, or through the relu Activation of an Embedding
+        return any(layer_class == 'Multiply' or (layer_class == 'Activation' and feeds_multiply(consumer))
+                   for consumer, (layer_class, inbound, _) in graph.items() if name in inbound)
+
+    gmf = [name for name in embeddings if feeds_multiply(name)]
+    mlp = [name for name in embeddings if not feeds_multiply(name)]
+    if len(gmf) != 1 or len(mlp) != 1:
+        raise ValueError('expected one gmf and one mlp {} layer on {}'.format(class_name, input_name))
+
+    return gmf[0], mlp[0]
+
+
+def _dense_layer_names(graph, skip):
+    """ Dense layers not in skip by depth, the _mlp layers then the _neuCF output """
+    dense = [(depth, name) for name, (layer_class, _, depth) in graph.items()
+             if layer_class == 'Dense' and name not in skip]
+    return [name for _, name in sorted(dense)]
+
+
+def convert_to_embedding_model(one_hot_model, dropout_rate=0.25):
+    """ embedding model computing the same predictions as a model built by build_graph """
+    one_hot_graph, one_hot_config = _layer_graph(one_hot_model)
+    user_input, item_input = [name for name, _, _ in one_hot_config['input_layers']]
+    user_dim, item_dim = [int(model_input.shape[-1]) for model_input in one_hot_model.inputs]
+
+    embedding_model = build_embedding_graph(user_dim, item_dim, dropout_rate)
+    embedding_graph, embedding_config = _layer_graph(embedding_model)
+    user_ids, item_ids = [name for name, _, _ in embedding_config['input_layers']]
+
+    # one-hot Dense layers become tables holding kernel + bias, one row per id
+    converted = []
+    for one_hot_input, ids_input in [(user_input, user_ids), (item_input, item_ids)]:
+        for dense, embedding in zip(_embedding_layer_names(one_hot_graph, one_hot_input, 'Dense'),
+                                    _embedding_layer_names(embedding_graph, ids_input, 'Embedding')):
+            kernel, bias = one_hot_model.get_layer(dense).get_weights()
+            embedding_model.get_layer(embedding).set_weights([kernel + bias])
+            converted.append(dense)
+
+    # the remaining Dense layers come from the same _mlp and _neuCF, one per depth
+    for source, target in zip(_dense_layer_names(one_hot_graph, converted), _dense_layer_names(embedding_graph, [])):
+        embedding_model.get_layer(target).set_weights(one_hot_model.get_layer(source).get_weights())
+
+    return embedding_model
+
+
+def model_weights(ncf_model):
+    """ numpy weights of a model built by build_graph or build_embedding_graph, embeddings as relu'd tables """
+    graph, config = _layer_graph(ncf_model)
+    user_input, item_input = [name for name, _, _ in config['input_layers']]
+    class_name = 'Embedding' if any(layer_class == 'Embedding' for layer_class, _, _ in graph.values()) else 'Dense'
+
+    weights = {}
+    embedding_layers = []
+    for side, input_name in [('user', user_input), ('item', item_input)]:
+        for branch, name in zip(['gmf', 'mlp'], _embedding_layer_names(graph, input_name, class_name)):
+            layer_weights = ncf_model.get_layer(name).get_weights()
+            # one row per id, the kernel + bias of a one-hot Dense layer
+            table = layer_weights[0] + layer_weights[1] if class_name == 'Dense' else layer_weights[0]
+            weights[side + '_' + branch] = np.maximum(table, 0.0)
+            embedding_layers.append(name)
+
+    # [(kernel, bias)] of the _mlp layers, then those of the _neuCF output
+    dense = _dense_layer_names(graph, embedding_layers)
+    weights['mlp'] = [tuple(ncf_model.get_layer(name).get_weights()) for name in dense[:-1]]
+    weights['output'] = tuple(ncf_model.get_layer(dense[-1]).get_weights())
+
+    return weights
+
+
+def _tf_config(hosts, current_host, port=WORKER_PORT):
+    """ TF_CONFIG of a MultiWorkerMirroredStrategy cluster of the hosts, hosts may be given as host:port """
+    workers = [host if ':' in host else '{}:{}'.format(host, port) for host in hosts]
+    return {'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': hosts.index(current_host)}}
+
+
+def _train_dataset(x_train, y_train, train_shards, batch_size, n_user, n_item, embedding, negatives=0, num_shards=1,
+                   shard_index=0):
+    """ input pipeline, from a sharded training data directory when given, else from the loaded arrays """
+    if train_shards:
+        return make_sharded_dataset(
+            train_shards, batch_size=batch_size, shuffle=True, user_dim=n_user, item_dim=n_item,
+            one_hot=not embedding, num_shards=num_shards, shard_index=shard_index, negatives=negatives)
+    return make_dataset(
+        x=x_train, y=y_train, batch_size=batch_size, shuffle=True, user_dim=n_user, item_dim=n_item,
+        one_hot=not embedding, num_shards=num_shards, shard_index=shard_index, negatives=negatives)
+
+
+def _worker_rows(x_train, y_train, train_shards, num_workers, negatives=0):
+    """ training rows of the worker with the fewest, every worker has to run as many steps """
+    if train_shards:
+        shards = read_manifest(train_shards)['shards']
+        if negatives:
+            # the rows labelled positive, which are not in the manifest
+            return min(sum(len(rows) for rows in _positive_rows(train_shards, _worker_shards(shards, num_workers, k)))
+                       for k in range(num_workers)) * (1 + negatives)
+        return min(sum(rows for _, _, _, rows in _worker_shards(shards, num_workers, k)) for k in range(num_workers))
+    if negatives:
+        return int(np.sum(np.asarray(y_train) > 0)) // num_workers * (1 + negatives)
+    return len(x_train[0]) // num_workers
+
+
+def model(x_train, y_train, n_user, n_item, num_epoch, batch_size, embedding=False, train_shards=None,
+          strategy=None, num_workers=1, negatives=0):
+    strategy = strategy or tf.distribute.get_strategy()
+
+    # build graph, its variables mirrored on every replica of the strategy
+    with strategy.scope():
+        model = build_embedding_graph(n_user, n_item) if embedding else build_graph(n_user, n_item)
+
+        # compile and train
+        optimizer = tf.keras.optimizers.Adam(learning_rate=1e-3)
+        model.compile(optimizer=optimizer,
+                      loss=tf.keras.losses.BinaryCrossentropy(),
+                      metrics=['accuracy'])
+
+    if num_workers == 1:
+        model.fit(
+            _train_dataset(x_train, y_train, train_shards, batch_size, n_user, n_item, embedding, negatives),
+            epochs=num_epoch,
+            verbose=2
+        )
+        return model
+
+    # data parallel: every worker reads its own part of the data in batches of batch_size per replica,
+    # and all run the same number of steps, gradients being summed across workers at each one
+    replicas_per_worker = strategy.num_replicas_in_sync // num_workers
+    worker_rows = _worker_rows(x_train, y_train, train_shards, num_workers, negatives)
+    steps_per_epoch = worker_rows // (batch_size * replicas_per_worker)
+
+    def dataset_fn(input_context):
+        dataset = _train_dataset(x_train, y_train, train_shards, batch_size, n_user, n_item, embedding, negatives,
+                                 num_shards=input_context.num_input_pipelines,
+                                 shard_index=input_context.input_pipeline_id)
+        return dataset.repeat()
 
     model.fit(
-            batch_generator(
-            x=x_train, y=y_train,
-            batch_size=batch_size, n_batch=num_batch,
-            shuffle=True, user_dim=n_user, item_dim=n_item),
+        strategy.distribute_datasets_from_function(dataset_fn),
         epochs=num_epoch,
-        steps_per_epoch=num_batch,
+        steps_per_epoch=steps_per_epoch,
         verbose=2
     )
     
@@ -167,12 +633,18 @@ def _parse_args():
     parser.add_argument('--model_dir', type=str)
     parser.add_argument('--sm-model-dir', type=str, default=os.environ.get('SM_MODEL_DIR'))
     parser.add_argument('--train', type=str, default=os.environ.get('SM_CHANNEL_TRAINING'))
-    parser.add_argument('--hosts', type=list, default=json.loads(os.environ.get('SM_HOSTS')))
-    parser.add_argument('--current-host', type=str, default=os.environ.get('SM_CURRENT_HOST'))
+    parser.add_argument('--hosts', type=list, default=json.loads(os.environ.get('SM_HOSTS', '["localhost"]')))
+    parser.add_argument('--current-host', type=str, default=os.environ.get('SM_CURRENT_HOST', 'localhost'))
+    parser.add_argument('--negatives', type=int, default=0,
+                        help='negatives sampled per positive every epoch, rows labelled 0 in the data are then ignored')
+    parser.add_argument('--worker_port', type=int, default=WORKER_PORT,
+                        help='port of the distributed training workers, for hosts given without one')
     parser.add_argument('--epochs', type=int, default=3)
     parser.add_argument('--batch_size', type=int, default=256)
     parser.add_argument('--n_user', type=int)
     parser.add_argument('--n_item', type=int)
+    parser.add_argument('--embedding', action='store_true',
+                        help='feed integer ids to Embedding layers instead of one-hot vectors to Dense layers')
 
     return parser.parse_known_args()
 
@@ -180,8 +652,19 @@ def _parse_args():
 if __name__ == "__main__":
     args, unknown = _parse_args()
 
-    # load data
-    user_train, item_train, train_labels = _load_training_data(args.train)
+    # with several hosts, train data parallel across all of them
+    strategy = None
+    if len(args.hosts) > 1:
+        os.environ['TF_CONFIG'] = json.dumps(_tf_config(args.hosts, args.current_host, args.worker_port))
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+
+    # load data, sharded training data written by convert_training_data.py is streamed instead
+    train_shards = None
+    if os.path.exists(os.path.join(args.train, SHARD_MANIFEST)):
+        train_shards = args.train
+        user_train, item_train, train_labels = None, None, None
+    else:
+        user_train, item_train, train_labels = _load_training_data(args.train)
     
     
     # build model
@@ -191,9 +674,19 @@ if __name__ == "__main__":
         n_user=args.n_user,
         n_item=args.n_item,
         num_epoch=args.epochs,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        embedding=args.embedding,
+        train_shards=train_shards,
+        strategy=strategy,
+        num_workers=len(args.hosts),
+        negatives=args.negatives
     )
 
     if args.current_host == args.hosts[0]:
         # save model to an S3 directory with version number '00000001'
         ncf_model.save(os.path.join(args.sm_model_dir, '000000001'), 'neural_collaborative_filtering.h5')
+    elif strategy is not None:
+        # every worker takes part in saving a multi worker model, the others save to a directory thrown away
+        worker_dir = tempfile.mkdtemp()
+        ncf_model.save(os.path.join(worker_dir, '000000001'), 'neural_collaborative_filtering.h5')
+        shutil.rmtree(worker_dir)
@@ -0,0 +1,250 @@
+"""
+
+ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+ SPDX-License-Identifier: MIT-0
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so.
+
+ THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+ INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+ PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+ HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+import argparse
+import hashlib
+import json
+import numpy as np
+
+
+# items scored per pass, bounds the memory of a request
+SCORE_CHUNK = 1 << 14
+
+# k-means iterations, and items sampled to fit the clusters of the approximate index
+INDEX_ITERATIONS = 10
+INDEX_SAMPLE = 1 << 18
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _top_k(scores, k):
+    """ positions of the k largest scores, best first """
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def _nearest(points, centroids):
+    """ nearest centroid of every point, SCORE_CHUNK points at a time """
+    squared = np.einsum('ij,ij->i', centroids, centroids)
+    nearest = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), SCORE_CHUNK):
+        distances = squared - 2.0 * points[start:start + SCORE_CHUNK] @ centroids.T
+        nearest[start:start + SCORE_CHUNK] = np.argmin(distances, axis=1)
+    return nearest
+
+
+def _kmeans(points, n_clusters, iterations, rng):
+    """ Lloyd's k-means, clusters left empty keep their centroid """
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].astype(np.float64)
+    for _ in range(iterations):
+        assignment = _nearest(points, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        used = np.flatnonzero(counts)
+        # sums of the points of every used cluster, over the points sorted by cluster
+        starts = (np.cumsum(counts) - counts)[used]
+        sums = np.add.reduceat(points[np.argsort(assignment, kind='stable')], starts, axis=0)
+        centroids[used] = sums / counts[used, None]
+    return centroids.astype(points.dtype)
+
+
+class TopKRecommender:
+    """ top-k items for a user from a trained ncf model, without running the model on every user x item pair
+
+    Nothing on the item side depends on the user, so it is computed once for the whole catalog: the item
+    GMF embeddings, and the item MLP embeddings through the item half of the first MLP kernel. A request
+    looks up its user's embeddings once. The GMF branch and its output weights fold into one matrix-vector
+    product, and the rest of the MLP runs as batched matmuls over the candidate items.
+
+    Built from ncf.model_weights, so that only loading the model needs tensorflow.
+
+    With n_clusters, the items are also grouped by k-means on their precomputed vectors. Then
+    recommend(..., nprobe=n) scores the cluster centroids first, and scores exactly only the items of the
+    n best clusters.
+    """
+
+    def __init__(self, weights, n_clusters=None, seed=0):
+        (first_kernel, first_bias), self.mlp = weights['mlp'][0], weights['mlp'][1:]
+        output_kernel, output_bias = weights['output']
+        emb_dim = weights['user_mlp'].shape[1]
+        gmf_dim = weights['user_gmf'].shape[1]
+
+        # _mlp concatenates [user, item] and _neuCF [gmf, mlp]
+        self.user_gmf = weights['user_gmf']
+        self.user_mlp = weights['user_mlp']
+        self.user_kernel = first_kernel[:emb_dim]
+        self.first_bias = first_bias
+        self.item_gmf = weights['item_gmf']
+        self.item_hidden = weights['item_mlp'] @ first_kernel[emb_dim:]
+        self.output_gmf = output_kernel[:gmf_dim, 0]
+        self.output_mlp = output_kernel[gmf_dim:, 0]
+        self.output_bias = output_bias[0]
+
+        self.cluster_items = None
+        if n_clusters:
+            self.build_index(n_clusters, seed=seed)
+
+    @property
+    def n_item(self):
+        return self.item_gmf.shape[0]
+
+    def fingerprint(self):
+        """ sha256 of every weight the scores depend on, equal for recommenders that score alike """
+        digest = hashlib.sha256()
+        arrays = [self.user_gmf, self.user_mlp, self.user_kernel, self.first_bias, self.item_gmf, self.item_hidden,
+                  self.output_gmf, self.output_mlp, self.output_bias] + [w for layer in self.mlp for w in layer]
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update('{}{}'.format(array.dtype, array.shape).encode())
+            digest.update(array.data)
+        return digest.hexdigest()
+
+    def _user(self, user_id):
+        """ per request user side, the GMF query vector and the user half of the first MLP layer """
+        query = self.user_gmf[user_id] * self.output_gmf
+        hidden = self.user_mlp[user_id] @ self.user_kernel + self.first_bias
+        return query, hidden
+
+    def _mlp_logits(self, hidden, item_hidden):
+        """ MLP branch share of the output logits for a batch of items """
+        mlp = item_hidden + hidden
+        np.maximum(mlp, 0.0, out=mlp)
+        for kernel, bias in self.mlp:
+            mlp = mlp @ kernel
+            mlp += bias
+            np.maximum(mlp, 0.0, out=mlp)
+        return mlp @ self.output_mlp
+
+    def _logits(self, query, hidden, item_gmf, item_hidden):
+        """ output layer logits for a batch of items """
+        return item_gmf @ query + self._mlp_logits(hidden, item_hidden) + self.output_bias
+
+    def _chunk_logits(self, query, hidden, items):
+        """ (item ids, logits) chunk by chunk, all items by default """
+        if items is None:
+            for start in range(0, self.n_item, SCORE_CHUNK):
+                chunk = slice(start, min(start + SCORE_CHUNK, self.n_item))
+                yield np.arange(chunk.start, chunk.stop), self._logits(
+                    query, hidden, self.item_gmf[chunk], self.item_hidden[chunk])
+        else:
+            for start in range(0, len(items), SCORE_CHUNK):
+                chunk = items[start:start + SCORE_CHUNK]
+                yield chunk, self._logits(query, hidden, self.item_gmf[chunk], self.item_hidden[chunk])
+
+    def score(self, user_id, items=None):
+        """ predicted ratings of a user for items, all items by default, as the model predicts them """
+        query, hidden = self._user(user_id)
+        items = None if items is None else np.asarray(items)
+        return _sigmoid(np.concatenate([logits for _, logits in self._chunk_logits(query, hidden, items)]))
+
+    def score_users(self, user_ids, items=None):
+        """ predicted ratings of users x items, all items by default, the items gathered once for all users """
+        user_ids = np.asarray(user_ids)
+        if items is None:
+            item_gmf, item_hidden = self.item_gmf, self.item_hidden
+        else:
+            items = np.asarray(items)
+            item_gmf, item_hidden = self.item_gmf[items], self.item_hidden[items]
+
+        # the GMF branch of every pair in one matmul, the MLP branch user by user
+        logits = (self.user_gmf[user_ids] * self.output_gmf) @ item_gmf.T + self.output_bias
+        hidden = self.user_mlp[user_ids] @ self.user_kernel + self.first_bias
+        for row in range(len(user_ids)):
+            for start in range(0, item_gmf.shape[0], SCORE_CHUNK):
+                logits[row, start:start + SCORE_CHUNK] += self._mlp_logits(
+                    hidden[row], item_hidden[start:start + SCORE_CHUNK])
+
+        return _sigmoid(logits)
+
+    def build_index(self, n_clusters, iterations=INDEX_ITERATIONS, sample=INDEX_SAMPLE, seed=0):
+        """ approximate index, k-means clusters of the items' [GMF, first MLP layer] vectors """
+        rng = np.random.default_rng(seed)
+        points = np.hstack([self.item_gmf, self.item_hidden])
+        fit_points = points[rng.choice(self.n_item, sample, replace=False)] if sample < self.n_item else points
+
+        centroids = _kmeans(fit_points, n_clusters, iterations, rng)
+        assignment = _nearest(points, centroids)
+
+        # items sorted by cluster, cluster c holding cluster_items[cluster_starts[c]:cluster_starts[c + 1]]
+        self.cluster_items = np.argsort(assignment, kind='stable')
+        self.cluster_starts = np.searchsorted(assignment[self.cluster_items], np.arange(n_clusters + 1))
+        self.centroid_gmf = centroids[:, :self.item_gmf.shape[1]]
+        self.centroid_hidden = centroids[:, self.item_gmf.shape[1]:]
+
+    def _probe(self, query, hidden, nprobe):
+        """ items of the nprobe clusters whose centroids score best """
+        clusters = _top_k(self._logits(query, hidden, self.centroid_gmf, self.centroid_hidden), nprobe)
+        return np.concatenate([self.cluster_items[self.cluster_starts[c]:self.cluster_starts[c + 1]]
+                               for c in clusters])
+
+    def recommend(self, user_id, k=10, items=None, exclude=None, nprobe=None):
+        """ k best items and their predicted ratings, among items or all items, approximate with nprobe """
+        query, hidden = self._user(user_id)
+        if items is not None:
+            items = np.asarray(items)
+        elif nprobe:
+            if self.cluster_items is None:
+                raise ValueError('nprobe needs an index, build one with n_clusters or build_index')
+            items = self._probe(query, hidden, nprobe)
+
+        best_items = np.empty(0, dtype=np.int64)
+        best_logits = np.empty(0, dtype=self.item_gmf.dtype)
+        for chunk, logits in self._chunk_logits(query, hidden, items):
+            if exclude is not None:
+                logits = np.where(np.isin(chunk, exclude), -np.inf, logits)
+            top = _top_k(logits, k)
+            best_items = np.concatenate([best_items, chunk[top]])
+            best_logits = np.concatenate([best_logits, logits[top]])
+            top = _top_k(best_logits, k)
+            best_items, best_logits = best_items[top], best_logits[top]
+
+        keep = np.isfinite(best_logits)
+        return best_items[keep], _sigmoid(best_logits[keep])
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='top-k recommendations from a trained ncf model')
+
+    parser.add_argument('--model_dir', type=str, required=True,
+                        help='saved one-hot or embedding model, a SavedModel directory or an .h5 file')
+    parser.add_argument('--user_ids', type=int, nargs='+', required=True)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n_clusters', type=int, default=None,
+                        help='build an approximate index of this many clusters, for large catalogs')
+    parser.add_argument('--nprobe', type=int, default=None,
+                        help='clusters scored exactly per request, with --n_clusters')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import tensorflow as tf
+    from ncf import model_weights
+
+    args = _parse_args()
+
+    ncf_model = tf.keras.models.load_model(args.model_dir, compile=False)
+    recommender = TopKRecommender(model_weights(ncf_model), args.n_clusters)
+    for user_id in args.user_ids:
+        items, scores = recommender.recommend(user_id, args.k, nprobe=args.nprobe)
+        print(json.dumps({'user_id': user_id, 'items': items.tolist(), 'scores': scores.tolist()}))
@@ -4,34 +4,52 @@
 
 import QuantLib as ql
 
-from ql_common import construct_date
+from ql_common import MARKET_DATA_CACHE, construct_date, set_evaluation_date
 
 
 def evaluate_american_option(input_dict):
 
     tparams = input_dict["tradeParameters"]
 
-    # Option Construction
     todaysDate = construct_date(tparams["evaluationDate"])
-    ql.Settings.instance().evaluationDate = todaysDate
+    set_evaluation_date(todaysDate)
+
+    # Market Data
+    marketData = MARKET_DATA_CACHE.get(todaysDate, tparams)
+
+    option = build_american_option(input_dict, marketData)
+
+    value = option.NPV()
+    return value
+
+
+def build_american_option(input_dict, marketData):
+    """
+    Constructs an American put with its pricing engine on the given market objects
+
+    The option keeps observing the market objects, so it is repriced by
+    calling NPV() again after changing them.
 
+    Args:
+        dict: input_dict, option in the batch_processor input format
+        dict: marketData, with the process as returned by MarketDataCache.get
+
+    Returns:
+        ql.VanillaOption
+
+    """
+
+    tparams = input_dict["tradeParameters"]
+
+    # Option Construction
+    todaysDate = construct_date(tparams["evaluationDate"])
     exercise = ql.AmericanExercise(todaysDate, construct_date(tparams["exerciseDate"]))
     payoff = ql.PlainVanillaPayoff(ql.Option.Put, tparams["payoff"])
 
     option = ql.VanillaOption(payoff, exercise)
 
     # Market Data
-    underlying = ql.SimpleQuote(tparams["underlying"])
-    dividendYield = ql.FlatForward(todaysDate, tparams["dividendYield"], ql.Actual365Fixed())
-    volatility = ql.BlackConstantVol(todaysDate, ql.TARGET(), tparams["volatility"], ql.Actual365Fixed())
-    riskFreeRate = ql.FlatForward(todaysDate, tparams["riskFreeRate"], ql.Actual365Fixed())
-
-    process = ql.BlackScholesMertonProcess(
-        ql.QuoteHandle(underlying),
-        ql.YieldTermStructureHandle(dividendYield),
-        ql.YieldTermStructureHandle(riskFreeRate),
-        ql.BlackVolTermStructureHandle(volatility),
-    )
+    process = marketData["process"]
 
     if input_dict["engineName"] == "BaroneAdesiWhaleyApproximationEngine":
         option.setPricingEngine(ql.BaroneAdesiWhaleyApproximationEngine(process))
@@ -52,5 +70,4 @@ def evaluate_american_option(input_dict):
     else:
         raise Exception("Unimplemented engineName [{}]".format(input_dict["engineName"]))
 
-    value = option.NPV()
-    return value
+    return option
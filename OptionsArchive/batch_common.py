@@ -0,0 +1,212 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import datetime
+import math
+
+import numpy as np
+
+TRADE_FIELDS = ["underlying", "payoff", "dividendYield", "riskFreeRate", "volatility"]
+
+
+def normal_cdf(x):
+    """
+    Vectorized cumulative standard normal distribution
+
+    Uses the double precision algorithm of Hart (1968) as given by
+    G. West, "Better approximations to cumulative normal functions", so that
+    results agree with QuantLib's CumulativeNormalDistribution to ~1e-15.
+
+    Args:
+        np.ndarray: x
+
+    Returns:
+        np.ndarray: N(x)
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    xabs = np.abs(x)
+    exponential = np.exp(-0.5 * xabs * xabs)
+
+    build = 3.52624965998911e-02 * xabs + 0.700383064443688
+    build = build * xabs + 6.37396220353165
+    build = build * xabs + 33.912866078383
+    build = build * xabs + 112.079291497871
+    build = build * xabs + 221.213596169931
+    build = build * xabs + 220.206867912376
+    numerator = exponential * build
+    build = 8.83883476483184e-02 * xabs + 1.75566716318264
+    build = build * xabs + 16.064177579207
+    build = build * xabs + 86.7807322029461
+    build = build * xabs + 296.564248779674
+    build = build * xabs + 637.333633378831
+    build = build * xabs + 793.826512519948
+    build = build * xabs + 440.413735824752
+    near = numerator / build
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        build = xabs + 0.65
+        build = xabs + 4.0 / build
+        build = xabs + 3.0 / build
+        build = xabs + 2.0 / build
+        build = xabs + 1.0 / build
+        far = exponential / build / 2.506628274631
+
+    tail = np.where(xabs < 7.07106781186547, near, far)
+    tail = np.where(xabs > 37.0, 0.0, tail)
+    return np.where(x > 0.0, 1.0 - tail, tail)
+
+
+def inverse_normal_cdf(p):
+    """
+    Vectorized inverse of the cumulative standard normal distribution
+
+    Acklam's rational approximation followed by one Halley step against
+    normal_cdf, which brings it to full double precision.
+
+    Args:
+        np.ndarray: p, probabilities in (0, 1)
+
+    Returns:
+        np.ndarray: x such that N(x) = p
+
+    """
+
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+
+    p = np.asarray(p, dtype=np.float64)
+    tail = np.minimum(p, 1.0 - p)
+
+    q = np.sqrt(-2.0 * np.log(tail))
+    x_tail = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+        ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.0)
+    x_tail = np.where(p < 0.5, x_tail, -x_tail)
+
+    q = p - 0.5
+    r = q * q
+    x_central = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+        (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1.0)
+
+    x = np.where(tail < 0.02425, x_tail, x_central)
+
+    e = normal_cdf(x) - p
+    u = e * np.sqrt(2.0 * np.pi) * np.exp(0.5 * x * x)
+    return x - u / (1.0 + 0.5 * x * u)
+
+
+def sobol_uniforms(n, shift=0):
+    """
+    First n points of the one-dimensional Sobol sequence, digitally shifted
+
+    In one dimension the Sobol sequence is the base 2 van der Corput sequence,
+    generated here in Gray code order. XOR-ing every point with a random
+    32 bit shift gives an independent randomization of the same point set.
+
+    Args:
+        int: n
+        int: shift, 32 bit digital shift
+
+    Returns:
+        np.ndarray: points in (0, 1)
+
+    """
+
+    index = np.arange(n, dtype=np.uint32)
+    x = index ^ (index >> np.uint32(1))
+
+    # reverse the 32 bits
+    x = ((x >> np.uint32(1)) & np.uint32(0x55555555)) | ((x & np.uint32(0x55555555)) << np.uint32(1))
+    x = ((x >> np.uint32(2)) & np.uint32(0x33333333)) | ((x & np.uint32(0x33333333)) << np.uint32(2))
+    x = ((x >> np.uint32(4)) & np.uint32(0x0F0F0F0F)) | ((x & np.uint32(0x0F0F0F0F)) << np.uint32(4))
+    x = ((x >> np.uint32(8)) & np.uint32(0x00FF00FF)) | ((x & np.uint32(0x00FF00FF)) << np.uint32(8))
+    x = (x >> np.uint32(16)) | (x << np.uint32(16))
+
+    x ^= np.uint32(shift)
+    return (x.astype(np.float64) + 0.5) / 4294967296.0
+
+
+def parse_date(date_string):
+    """
+    Converts string to datetime.date, accepting the same inputs as construct_date
+
+    Args:
+        string: date_string. Example: "31 12 1999"
+
+    Returns:
+        datetime.date
+
+    """
+
+    day, month, year = [int(x) for x in date_string.split(" ")]
+
+    # ql.Date only covers this range, anything outside must fail the same way
+    if not 1901 <= year <= 2199:
+        raise ValueError("year {} outside of QuantLib date range".format(year))
+
+    return datetime.date(year, month, day)
+
+
+def year_fraction(start_string, end_string):
+    """
+    Actual/365 (Fixed) year fraction between two date strings
+
+    Args:
+        string: start_string. Example: "31 12 1999"
+        string: end_string. Example: "31 12 2000"
+
+    Returns:
+        float: year fraction
+
+    """
+
+    return (parse_date(end_string) - parse_date(start_string)).days / 365.0
+
+
+def trade_arrays(input_dicts, fields=TRADE_FIELDS):
+    """
+    Extracts the flat-market trade parameters of a group of options into arrays
+
+    Options whose parameters are missing, malformed or outside of what the
+    closed-form and lattice pricers support (expired, non-positive spot,
+    strike or volatility) are left out, so that the caller can send them
+    down the per-option QuantLib path instead.
+
+    Args:
+        list: input_dicts, options in the batch_processor input format
+        list: fields, trade parameters to extract, all of TRADE_FIELDS by default
+
+    Returns:
+        tuple: (list of accepted positions in input_dicts, dict of np.ndarray
+        keyed by trade parameter name plus "maturity")
+
+    """
+
+    accepted = []
+    rows = []
+    for position, input_dict in enumerate(input_dicts):
+        try:
+            tparams = input_dict["tradeParameters"]
+            row = [float(tparams[field]) for field in fields]
+            row.append(year_fraction(tparams["evaluationDate"], tparams["exerciseDate"]))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+
+        positive = [x for field, x in zip(fields + ["maturity"], row)
+                    if field in ["underlying", "payoff", "volatility", "maturity"]]
+        if not all(math.isfinite(x) for x in row) or min(positive) <= 0.0:
+            continue
+
+        accepted.append(position)
+        rows.append(row)
+
+    columns = np.array(rows, dtype=np.float64).reshape(len(rows), len(fields) + 1)
+    arrays = {field: columns[:, i] for i, field in enumerate(fields + ["maturity"])}
+    return accepted, arrays
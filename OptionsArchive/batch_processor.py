@@ -1,15 +1,91 @@
 import boto3
 import argparse
+import contextlib
 import json
 import logging
+import os
+import time
 import traceback
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import columnar
+from cost_model import balance, estimate_cost
+from engine_selection import AUTO, resolve_option
+from metrics import Metrics
+from ql_common import MARKET_DATA_CACHE
+from result_cache import QUANTLIB, VECTORIZED, ResultCache, is_cacheable, option_key
+from result_stream import FLUSH_RESULTS, JsonLinesResultWriter, S3MultipartUpload
+from risk import load_scenarios, price_scenarios
 from european_options import evaluate_european_option
 from american_options import evaluate_american_option
+from european_batch import evaluate_european_options_analytic, evaluate_european_options_mc
+from binomial_batch import evaluate_american_options_binomial, evaluate_european_options_binomial
+from fd_batch import evaluate_american_options_fd, evaluate_european_options_fd
 
-def evaluate_option(option):
+# vectorized pricers, keyed by (exercise, engineName). Each takes a list of
+# options and returns a list of values with None for options it can't handle,
+# which are then priced one by one through evaluate_option
+BATCH_PRICERS = {
+    ("European", "AnalyticEuropeanEngine"): evaluate_european_options_analytic,
+    ("European", "BinomialVanillaEngine"): evaluate_european_options_binomial,
+    ("European", "MCEuropeanEngine"): evaluate_european_options_mc,
+    ("European", "FdBlackScholesVanillaEngine"): evaluate_european_options_fd,
+    ("American", "BinomialVanillaEngine"): evaluate_american_options_binomial,
+    ("American", "FdBlackScholesVanillaEngine"): evaluate_american_options_fd,
+}
+
+# pool tasks per worker, so that a worker that drew cheap options can pick up
+# more work while the expensive FD/MC tasks are still running elsewhere
+TASKS_PER_WORKER = 4
+
+
+def _cache_key(option, pricer=QUANTLIB):
+    try:
+        return option_key(option, pricer) if is_cacheable(option) else None
+    except Exception:
+        return None
+
+
+def evaluate_option(option, cache=None, metrics=None):
+    """
+    Prices one option, looking it up in a ResultCache first when one is given
+
+    Args:
+        dict: option in the batch_processor input format
+        ResultCache: cache, or None to always price
+        Metrics: metrics, records the option's wall and CPU time when given
+
+    Returns:
+        float: option value, or a string describing the error
+
+    """
+
+    if metrics is not None:
+        start = time.perf_counter()
+        cpuStart = time.process_time()
+
+    key = _cache_key(option) if cache is not None else None
+    if key is not None:
+        value = cache.get(key)
+        if value is not None:
+            if metrics is not None:
+                metrics.record(option, time.perf_counter() - start, time.process_time() - cpuStart, cache_hit=True)
+            return value
+
+    value = _evaluate_option(option)
+    if key is not None and not isinstance(value, str):
+        cache.put(key, value)
+
+    if metrics is not None:
+        metrics.record(option, time.perf_counter() - start, time.process_time() - cpuStart,
+                       error=isinstance(value, str))
+    return value
+
+
+def _evaluate_option(option):
     print("evaluating " + str(option))
     try:
+        option, _ = resolve_option(option)
         if option["exercise"] == "European":
             return evaluate_european_option(option)
         elif option["exercise"] == "American":
@@ -22,8 +98,270 @@ def evaluate_option(option):
         return f"Error in processing option [{option}] error: [{e}] trace: [{traceback.format_exc()}]"
 
 
+def _batch_key(option):
+    try:
+        key = (option["exercise"], option["engineName"])
+    except (KeyError, TypeError):
+        return None
+    return key if key in BATCH_PRICERS else None
+
+
+def evaluate_batches(portfolio, positions, results, on_result=None, metrics=None):
+    """
+    Prices every option that has a vectorized pricer, group by group
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        list: positions, positions in portfolio to price
+        list: results, filled in place at the positions that were priced
+        function: on_result(position, value), called for every option priced
+        Metrics: metrics, records every group's time, shared by the options it priced
+
+    Returns:
+        list: positions in portfolio that still have to be priced one by one
+
+    """
+
+    groups = {}
+    pending = []
+    for i in positions:
+        key = _batch_key(portfolio[i])
+        if key is None:
+            pending.append(i)
+        else:
+            groups.setdefault(key, []).append(i)
+
+    for key, indices in groups.items():
+        print("evaluating {} options with the {} {} batch pricer".format(len(indices), *key))
+        start = time.perf_counter()
+        cpuStart = time.process_time()
+        try:
+            values = BATCH_PRICERS[key]([portfolio[i] for i in indices])
+        except Exception as e:
+            print(e)
+            values = [None] * len(indices)
+
+        if metrics is not None:
+            metrics.record_batch([portfolio[i] for i, value in zip(indices, values) if value is not None],
+                                 time.perf_counter() - start, time.process_time() - cpuStart)
+
+        for i, value in zip(indices, values):
+            if value is None:
+                pending.append(i)
+            else:
+                results[i] = value
+                if on_result is not None:
+                    on_result(i, value)
+
+    return sorted(pending)
+
+
+def _evaluate_by_date(portfolio, positions, results, on_result=None, metrics=None):
+    """
+    Prices options one by one, one evaluation date at a time
+
+    Every change of the global QuantLib evaluation date notifies all of its
+    observers, and the pricing modules only assign it when it changes, so
+    bucketing by date pays for that once per date instead of once per option.
+    Results are written back by position, so the output order is unchanged.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        list: positions, positions in portfolio to price
+        list: results, filled in place at positions
+        function: on_result(position, value), called for every option priced
+        Metrics: metrics, records every option's time when given
+
+    """
+
+    buckets = {}
+    for i in positions:
+        try:
+            evaluationDate = str(portfolio[i]["tradeParameters"]["evaluationDate"])
+        except Exception:
+            # priced in its own bucket, fails in evaluate_option as before
+            evaluationDate = None
+        buckets.setdefault(evaluationDate, []).append(i)
+
+    for bucket in buckets.values():
+        for i in bucket:
+            results[i] = evaluate_option(portfolio[i], metrics=metrics)
+            if on_result is not None:
+                on_result(i, results[i])
+
+
+def _init_worker():
+    # import QuantLib once per worker process, every task after that runs warm
+    import QuantLib as ql
+    ql.Settings.instance().evaluationDate
+
+
+def _evaluate_options(options, collect_metrics=False):
+    results = [None] * len(options)
+    metrics = Metrics() if collect_metrics else None
+    _evaluate_by_date(options, list(range(len(options))), results, metrics=metrics)
+    return results, metrics
+
+
+def worker_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+
+def evaluate_in_pool(portfolio, positions, results, workers, executor=None, on_result=None, metrics=None):
+    """
+    Prices options one by one on a pool of worker processes
+
+    Options are packed into cost-balanced tasks using the engine cost model,
+    and the most expensive tasks are submitted first.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        list: positions, positions in portfolio to price
+        list: results, filled in place at positions
+        int: workers, number of worker processes
+        ProcessPoolExecutor: executor, a running worker_pool to use instead
+            of starting one for this call
+        function: on_result(position, value), called for every option as its task completes
+        Metrics: metrics, merged with the timings recorded by the workers
+
+    """
+
+    # what is left here is priced through QuantLib, whatever its engine
+    costs = [estimate_cost(portfolio[i], vectorize=False) for i in positions]
+    tasks = [[positions[k] for k in task] for task in balance(costs, workers * TASKS_PER_WORKER)]
+
+    with contextlib.nullcontext(executor) if executor is not None else worker_pool(workers) as executor:
+        futures = {
+            executor.submit(_evaluate_options, [portfolio[i] for i in task], metrics is not None): task
+            for task in tasks
+        }
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                values, taskMetrics = future.result()
+                if metrics is not None:
+                    metrics.merge(taskMetrics)
+            except Exception as e:
+                print(e)
+                values = [
+                    f"Error in processing option [{portfolio[i]}] error: [{e}] trace: [{traceback.format_exc()}]"
+                    for i in task
+                ]
+            for i, value in zip(task, values):
+                results[i] = value
+                if on_result is not None:
+                    on_result(i, value)
+
+
+def resolve_engines(portfolio):
+    """
+    Replaces engineName "Auto" by the engine selected for every option, printing the choices
+
+    Options whose selection fails are left as they are, evaluate_option
+    then reports the error for them.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+
+    Returns:
+        list: options
+
+    """
+
+    resolved = []
+    for i, option in enumerate(portfolio):
+        try:
+            selected, error = resolve_option(option)
+        except Exception:
+            selected, error = option, None
+
+        if selected is not option:
+            print("option {}: {} selected {} {}, expected error {}".format(
+                i, AUTO, selected["engineName"], selected["engineParameters"], error))
+        resolved.append(selected)
+
+    return resolved
+
+
+def price_portfolio(portfolio, vectorize=True, workers=1, bucket_dates=True, cache=None, executor=None,
+                    on_result=None, metrics=None):
+    """
+    Prices a portfolio, returning values or error strings in input order
+
+    Args:
+        list: portfolio, options in the batch_processor input format, engineName "Auto" is resolved first
+        bool: vectorize, use the vectorized pricers where available
+        int: workers, number of processes for options priced one by one
+        bool: bucket_dates, price options one by one grouped by evaluation date
+        ResultCache: cache, or None to price every option
+        ProcessPoolExecutor: executor, a running worker_pool kept across calls
+        function: on_result(position, value), called as soon as each option's
+            result is known, in completion rather than input order
+        Metrics: metrics, records the time, engine and cache hits of every option
+
+    Returns:
+        list: results
+
+    """
+
+    portfolio = resolve_engines(portfolio)
+    results = [None] * len(portfolio)
+    pending = list(range(len(portfolio)))
+
+    # a vectorized run takes the vectorized pricer's value or QuantLib's, which
+    # it falls back to, a QuantLib run only ever gets QuantLib's values
+    keys = {}
+    if cache is not None:
+        for i in pending:
+            pricers = [VECTORIZED, QUANTLIB] if vectorize and _batch_key(portfolio[i]) else [QUANTLIB]
+            candidates = [key for key in (_cache_key(portfolio[i], pricer) for pricer in pricers) if key is not None]
+            if candidates:
+                keys[i] = candidates
+        for i, value in zip(keys, cache.get_first(list(keys.values()))):
+            if value is not None:
+                results[i] = value
+                if metrics is not None:
+                    metrics.record(portfolio[i], 0.0, 0.0, cache_hit=True)
+                if on_result is not None:
+                    on_result(i, results[i])
+        pending = [i for i in pending if results[i] is None]
+
+    priced = pending
+    vectorized = set()
+    if vectorize:
+        pending = evaluate_batches(portfolio, pending, results, on_result, metrics)
+        vectorized = set(priced) - set(pending)
+
+    if workers > 1 and len(pending) > 1:
+        evaluate_in_pool(portfolio, pending, results, workers, executor, on_result, metrics)
+    elif bucket_dates:
+        _evaluate_by_date(portfolio, pending, results, on_result, metrics)
+    else:
+        for i in pending:
+            results[i] = evaluate_option(portfolio[i], metrics=metrics)
+            if on_result is not None:
+                on_result(i, results[i])
+
+    if cache is not None:
+        # stored under the key of the pricer that actually priced the option
+        cache.put_many([(_cache_key(portfolio[i], VECTORIZED if i in vectorized else QUANTLIB), results[i])
+                        for i in priced if i in keys and not isinstance(results[i], str)])
+
+    return results
+
+
 def lambda_handler(event, context):
-    results = [evaluate_option(opt) for opt in event]
+    # {"portfolio": [...], "scenarios": [...]} asks for a scenario x trade matrix
+    if isinstance(event, dict) and "scenarios" in event:
+        scenarios = load_scenarios(event["scenarios"])
+        results = price_scenarios(event["portfolio"], scenarios)
+        logging.info(results)
+        return {
+            "scenarios": scenarios,
+            "results": results
+        }
+
+    results = price_portfolio(event)
     logging.info(results)
     return {
         "results": results
@@ -35,25 +373,110 @@ if __name__ == "__main__":
     parser.add_argument("--InputFile", type=str, required=True)
     parser.add_argument("--BucketName", type=str, required=True)
     parser.add_argument("--OutputFolder", type=str, required=True)
+    parser.add_argument("--NoBatchPricing", action="store_true",
+                        help="price every option through QuantLib, one by one")
+    parser.add_argument("--ResultCache", type=str, default=os.environ.get("RESULT_CACHE_PATH"),
+                        help="SQLite file of previously computed results, reused across runs")
+    parser.add_argument("--ResultCacheMaxAgeDays", type=float, default=7.0)
+    parser.add_argument("--ResultCacheMaxEntries", type=int, default=1000000)
+    parser.add_argument("--NoResultCache", action="store_true",
+                        help="bypass the result cache even when one is configured")
+    parser.add_argument("--Workers", "--workers", type=int, default=1,
+                        help="number of worker processes for options priced one by one")
+    parser.add_argument("--OutputFormat", type=str, choices=["json", "arrow", "jsonl"], default=None,
+                        help="results file format, the input file's format by default. jsonl streams every "
+                             "result as it completes, uploaded to S3 part by part")
+    parser.add_argument("--Resume", action="store_true",
+                        help="with jsonl output, skip the options already in the results left by an earlier run")
+    parser.add_argument("--FlushEvery", type=int, default=FLUSH_RESULTS,
+                        help="with jsonl output, results written between flushes")
+    parser.add_argument("--NoMetrics", action="store_true",
+                        help="skip the per-option timings and their <input>.metrics.json sidecar file")
+    parser.add_argument("--EmitEMF", action="store_true",
+                        help="also print the timings as CloudWatch embedded metric format records")
+    parser.add_argument("--RiskScenarios", type=str, default=None,
+                        help="JSON file of scenarios, or of spotShifts/volShifts/rateShifts lists, to reprice the "
+                             "portfolio under, writing a scenario x trade matrix in JSON")
     args = parser.parse_args()
     
     input_file_name = args.InputFile
     bucket = args.BucketName
     output_folder = args.OutputFolder
     single_input_file_name = input_file_name.split("/")[-1]
-    output_file_name = single_input_file_name + '.result.json'
+    output_format = args.OutputFormat or ("arrow" if columnar.is_arrow(input_file_name) else "json")
+    output_file_name = single_input_file_name + '.result.' + output_format
     
+    cache = None
+    if args.ResultCache and not args.NoResultCache:
+        cache = ResultCache(
+            args.ResultCache,
+            max_age=args.ResultCacheMaxAgeDays * 24 * 3600,
+            max_entries=args.ResultCacheMaxEntries,
+        )
+
+    metrics = None if args.NoMetrics else Metrics()
+
     s3 = boto3.client('s3')
     s3.download_file(bucket, input_file_name, single_input_file_name)
 
-    with open(single_input_file_name) as json_file:
-        portfolio = json.load(json_file)
+    if columnar.is_arrow(single_input_file_name):
+        portfolio = columnar.read_portfolio(single_input_file_name)
+    else:
+        with open(single_input_file_name) as json_file:
+            portfolio = json.load(json_file)
 
-        results = lambda_handler(portfolio, None)
+    if args.RiskScenarios:
+        with open(args.RiskScenarios) as json_file:
+            scenarios = load_scenarios(json.load(json_file))
+        output_format = "json"
+        output_file_name = single_input_file_name + '.result.json'
+        results = {
+            "scenarios": scenarios,
+            "results": price_scenarios(portfolio, scenarios)
+        }
+    elif output_format == "jsonl":
+        # results are appended and uploaded as they complete rather than held
+        # until the end, so a job that dies keeps what it had priced
+        result_key = output_folder + '/results/' + output_file_name
+        if args.Resume:
+            S3MultipartUpload.recover(bucket, result_key, output_file_name, s3)
+        writer = JsonLinesResultWriter(output_file_name, resume=args.Resume,
+                                       upload=S3MultipartUpload(bucket, result_key, s3=s3),
+                                       flush_results=args.FlushEvery)
+        remaining = [i for i in range(len(portfolio)) if i not in writer.done]
+        print("pricing {} of {} options, {} already priced".format(len(remaining), len(portfolio), len(writer.done)))
+
+        price_portfolio([portfolio[i] for i in remaining], vectorize=not args.NoBatchPricing, workers=args.Workers,
+                        cache=cache, on_result=lambda k, value: writer.write(remaining[k], value), metrics=metrics)
+        writer.close()
+    else:
+        results = {
+            "results": price_portfolio(portfolio, vectorize=not args.NoBatchPricing, workers=args.Workers,
+                                       cache=cache, metrics=metrics)
+        }
+
+    if output_format != "jsonl":
         print("results")
         print(results)
-        
+    print("market data cache: {}".format(MARKET_DATA_CACHE.stats()))
+    if cache is not None:
+        print("result cache: {}".format(cache.stats()))
+        cache.close()
+
+    if output_format == "arrow":
+        columnar.write_results(results["results"], output_file_name)
+    elif output_format == "json":
         with open(output_file_name, 'w') as outfile:
             json.dump(results, outfile)
 
-        resp = s3.upload_file(output_file_name, bucket, output_folder + '/results/' + output_file_name)
\ No newline at end of file
+    if output_format != "jsonl":
+        resp = s3.upload_file(output_file_name, bucket, output_folder + '/results/' + output_file_name)
+
+    if metrics is not None and metrics.engines:
+        metrics_file_name = single_input_file_name + '.metrics.json'
+        with open(metrics_file_name, 'w') as outfile:
+            json.dump(metrics.summary(), outfile)
+        s3.upload_file(metrics_file_name, bucket, output_folder + '/metrics/' + metrics_file_name)
+        if args.EmitEMF:
+            for record in metrics.emf({"InputFile": input_file_name}):
+                print(json.dumps(record))
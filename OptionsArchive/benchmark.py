@@ -0,0 +1,679 @@
+"""
+Benchmarks for the options batch
+
+Runs synthetic portfolios through batch_processor and prints the timings as
+JSON, so they can be compared across changes.
+
+    python benchmark.py dates --options 2000 --dates 20
+    python benchmark.py trees --options 500 --timeSteps 100
+    python benchmark.py fd --ladders 20 --strikes 50 --gridPoints 100
+    python benchmark.py calibrate --options 100
+    python benchmark.py engines --options 50
+    python benchmark.py risk --options 200 --spotShifts 7
+    python benchmark.py implied --options 20000
+    python benchmark.py worker --chunks 50 --size 10
+    python benchmark.py metrics --options 5000
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import QuantLib as ql
+
+import american_options
+import batch_processor
+import cost_model
+import engine_selection
+import european_options
+import risk
+from binomial_batch import TREES, evaluate_american_options_binomial, evaluate_european_options_binomial
+from european_batch import evaluate_european_options_analytic
+from metrics import Metrics
+from ql_common import MARKET_DATA_CACHE
+
+
+def synthetic_portfolio(n, exercise="European", engineName="AnalyticEuropeanEngine", engineParameters=None,
+                        dates=1, seed=42):
+    """
+    Random plain vanilla options in the batch_processor input format
+
+    Args:
+        int: n, number of options
+        string: exercise, "European" or "American"
+        string: engineName
+        dict: engineParameters
+        int: dates, number of distinct evaluation dates, mixed in random order
+        int: seed
+
+    Returns:
+        list: options
+
+    """
+
+    rng = random.Random(seed)
+    first = datetime.date(2021, 1, 4)
+    evaluationDates = [first + datetime.timedelta(days=d) for d in range(dates)]
+
+    portfolio = []
+    for _ in range(n):
+        evaluationDate = rng.choice(evaluationDates)
+        exerciseDate = evaluationDate + datetime.timedelta(days=rng.randint(30, 3 * 365))
+        portfolio.append({
+            "exercise": exercise,
+            "engineName": engineName,
+            "engineParameters": dict(engineParameters or {}),
+            "tradeParameters": {
+                "evaluationDate": "{} {} {}".format(evaluationDate.day, evaluationDate.month, evaluationDate.year),
+                "exerciseDate": "{} {} {}".format(exerciseDate.day, exerciseDate.month, exerciseDate.year),
+                "payoff": round(rng.uniform(70.0, 130.0), 2),
+                "underlying": round(rng.uniform(90.0, 110.0), 2),
+                "dividendYield": round(rng.uniform(0.0, 0.04), 4),
+                "volatility": round(rng.uniform(0.1, 0.5), 4),
+                "riskFreeRate": round(rng.uniform(0.0, 0.05), 4),
+            },
+        })
+
+    return portfolio
+
+
+def strike_ladders(ladders, strikes, exercise, engineName, engineParameters, seed=42):
+    """
+    Synthetic options in groups that only differ by strike, spread over +/- 30% of the underlying
+
+    Args:
+        int: ladders, number of distinct markets
+        int: strikes, options per market
+        string: exercise, engineName
+        dict: engineParameters
+        int: seed
+
+    Returns:
+        list: options
+
+    """
+
+    portfolio = []
+    for option in synthetic_portfolio(ladders, exercise, engineName, engineParameters, seed=seed):
+        underlying = option["tradeParameters"]["underlying"]
+        for k in range(strikes):
+            payoff = round(underlying * (0.7 + 0.6 * k / max(1, strikes - 1)), 2)
+            portfolio.append(dict(option, tradeParameters=dict(option["tradeParameters"], payoff=payoff)))
+
+    return portfolio
+
+
+def timed(function, *args, **kwargs):
+    # evaluate_option prints every option, which would dominate the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+
+def benchmark_dates(args):
+    """ per-option pricing of a mixed-date portfolio, in input order vs bucketed by date """
+    portfolio = synthetic_portfolio(args.options, engineName=args.engine, dates=args.dates)
+
+    # curves with a moving reference date observe the evaluation date, like the
+    # term structures a long-lived process accumulates; each of them is notified
+    # on every date change
+    observers = [ql.FlatForward(0, ql.TARGET(), 0.01, ql.Actual365Fixed()) for _ in range(args.observers)]
+
+    rows = []
+    for bucket_dates in (False, True):
+        MARKET_DATA_CACHE.clear()
+        _, seconds = timed(batch_processor.price_portfolio, portfolio, vectorize=False, bucket_dates=bucket_dates)
+        rows.append({
+            "bucketDates": bucket_dates,
+            "options": len(portfolio),
+            "dates": args.dates,
+            "observers": len(observers),
+            "seconds": seconds,
+            "optionsPerSecond": len(portfolio) / seconds,
+        })
+
+    rows[1]["speedup"] = rows[0]["seconds"] / rows[1]["seconds"]
+    return rows
+
+
+def benchmark_trees(args):
+    """ vectorized binomial trees against QuantLib's BinomialVanillaEngine, per tree type, fails past --tolerance """
+    pricers = {"European": evaluate_european_options_binomial, "American": evaluate_american_options_binomial}
+    rows = []
+    for exercise, pricer in pricers.items():
+        for tree in TREES:
+            engineParameters = {"timeSteps": args.timeSteps, "tree": tree}
+            portfolio = synthetic_portfolio(args.options, exercise, "BinomialVanillaEngine", engineParameters)
+
+            # the vectorized pricer itself, price_portfolio would hide the options it leaves to QuantLib
+            vectorized, vectorizedSeconds = timed(pricer, portfolio)
+            reference, referenceSeconds = timed(batch_processor.price_portfolio, portfolio, vectorize=False)
+
+            unpriced = sum(1 for value in vectorized if value is None)
+            errors = [abs(v - r) for v, r in zip(vectorized, reference) if v is not None]
+            rows.append({
+                "exercise": exercise,
+                "tree": tree,
+                "timeSteps": args.timeSteps,
+                "options": len(portfolio),
+                "unpriced": unpriced,
+                "maxAbsError": max(errors, default=None),
+                "vectorizedSeconds": vectorizedSeconds,
+                "quantlibSeconds": referenceSeconds,
+                "speedup": referenceSeconds / vectorizedSeconds,
+                "passed": not unpriced and max(errors) <= args.tolerance,
+            })
+
+    return rows
+
+
+def benchmark_fd(args):
+    """ strike-ladder finite differences against per-option FdBlackScholesVanillaEngine solves """
+    rows = []
+    for exercise in ["European", "American"]:
+        engineParameters = {"timeSteps": args.timeSteps, "gridPoints": args.gridPoints}
+        portfolio = strike_ladders(args.ladders, args.strikes, exercise, "FdBlackScholesVanillaEngine",
+                                   engineParameters)
+        strikes = [option["tradeParameters"]["payoff"] for option in portfolio]
+
+        vectorized, vectorizedSeconds = timed(batch_processor.price_portfolio, portfolio)
+        reference, referenceSeconds = timed(batch_processor.price_portfolio, portfolio, vectorize=False)
+
+        row = {
+            "exercise": exercise,
+            "timeSteps": args.timeSteps,
+            "gridPoints": args.gridPoints,
+            "options": len(portfolio),
+            "ladders": args.ladders,
+            "maxErrorPerStrike": max(abs(v - r) / k for v, r, k in zip(vectorized, reference, strikes)),
+            "vectorizedSeconds": vectorizedSeconds,
+            "quantlibSeconds": referenceSeconds,
+            "speedup": referenceSeconds / vectorizedSeconds,
+        }
+
+        if exercise == "European":
+            # both against the closed form, the ladder should not add to the discretization error
+            exact = evaluate_european_options_analytic(portfolio)
+            row["ladderErrorPerStrike"] = max(abs(v - e) / k for v, e, k in zip(vectorized, exact, strikes))
+            row["quantlibErrorPerStrike"] = max(abs(r - e) / k for r, e, k in zip(reference, exact, strikes))
+
+        rows.append(row)
+
+    return rows
+
+
+# (exercise, engineName, engineParameters at increasing sizes) timed by calibrate
+CALIBRATION_ENGINES = [
+    ("European", "AnalyticEuropeanEngine", [{}]),
+    ("European", "AnalyticHestonEngine", [{}]),
+    ("European", "COSHestonEngine", [{}]),
+    ("European", "IntegralEngine", [{}]),
+    ("American", "BaroneAdesiWhaleyApproximationEngine", [{}]),
+    ("American", "BjerksundStenslandApproximationEngine", [{}]),
+    ("American", "FdBlackScholesVanillaEngine", [{"timeSteps": n, "gridPoints": n} for n in [50, 100, 200]]),
+    ("American", "BinomialVanillaEngine", [{"timeSteps": n, "tree": "CRR"} for n in [50, 100, 200]]),
+    ("European", "BinomialVanillaEngine", [{"timeSteps": n, "tree": "CRR"} for n in [50, 100, 200]]),
+    ("European", "MCEuropeanEngine", [
+        {"random_source": "lowdiscrepancy", "timeSteps": 1, "requiredSamples": n} for n in [1000, 4000, 16000]
+    ]),
+    ("European", "MCEuropeanEngine", [
+        {"random_source": "pseudorandom", "timeSteps": 1, "requiredTolerance": t, "seed": 1} for t in [0.2, 0.1, 0.05]
+    ]),
+]
+
+
+def _fit_cost(sizes, costs, base=1.0):
+    # cost = base + perUnit * size ** exponent, fitted in log-log space; for
+    # QuantLib the one unit of base is building the option and its market
+    # data, as for the analytic engine, a vectorized batch shares that
+    sizes = np.asarray(sizes, dtype=np.float64)
+    costs = np.asarray(costs, dtype=np.float64)
+    if len(sizes) == 1 or sizes.max() == 0.0:
+        return {"base": max(float(costs.mean()), base), "perUnit": 0.0, "exponent": 1.0}
+
+    used = (sizes > 0.0) & (costs > base)
+    exponent, logPerUnit = np.polyfit(np.log(sizes[used]), np.log(costs[used] - base), 1)
+    return {"base": base, "perUnit": float(np.exp(logPerUnit)), "exponent": float(exponent)}
+
+
+def benchmark_calibrate(args):
+    """ times every engine as batch_processor prices it and writes the cost table used by cost_model """
+    rows = []
+    for exercise, engineName, sizes in CALIBRATION_ENGINES:
+        for engineParameters in sizes:
+            portfolio = synthetic_portfolio(args.options, exercise, engineName, engineParameters)
+            MARKET_DATA_CACHE.clear()
+            for option in portfolio:
+                _, seconds = timed(batch_processor.evaluate_option, option)
+                rows.append({
+                    "key": cost_model._cost_key(option),
+                    "size": cost_model._size(option),
+                    "seconds": seconds,
+                })
+
+            # options with a vectorized pricer are priced in batches by
+            # evaluate_batches, each costs its share of its batch's time
+            if not cost_model._vectorized(portfolio[0]):
+                continue
+            portfolio = synthetic_portfolio(args.batchOptions, exercise, engineName, engineParameters)
+            results = [None] * len(portfolio)
+            pending, seconds = timed(batch_processor.evaluate_batches, portfolio, list(range(len(portfolio))),
+                                     results)
+            if pending:
+                raise Exception("{} {} {}: {} options left to QuantLib".format(
+                    exercise, engineName, engineParameters, len(pending)))
+            rows.append({
+                "key": cost_model._cost_key(portfolio[0], vectorize=True),
+                "size": float(np.mean([cost_model._size(option) for option in portfolio])),
+                "seconds": seconds / len(portfolio),
+            })
+
+    unitSeconds = float(np.mean([row["seconds"] for row in rows if row["key"] == "AnalyticEuropeanEngine"]))
+    engines = {}
+    for key in sorted(set(row["key"] for row in rows)):
+        sizes = [row["size"] for row in rows if row["key"] == key]
+        costs = [row["seconds"] / unitSeconds for row in rows if row["key"] == key]
+        engines[key] = _fit_cost(sizes, costs, 0.0 if key.startswith(cost_model.VECTORIZED_PREFIX) else 1.0)
+
+    table = {"unitSeconds": unitSeconds, "engines": engines}
+    with open(args.output, "w") as f:
+        json.dump(table, f, indent=2, sort_keys=True)
+
+    # how well the fitted table predicts the timings it was fitted to
+    errors = {}
+    for key in engines:
+        keyRows = [row for row in rows if row["key"] == key]
+        cost = engines[key]
+        predicted = [(cost["base"] + cost["perUnit"] * row["size"] ** cost["exponent"]) * unitSeconds
+                     for row in keyRows]
+        errors[key] = {
+            "seconds": sum(row["seconds"] for row in keyRows),
+            "predictedSeconds": sum(predicted),
+        }
+
+    return {"output": args.output, "table": table, "totals": errors}
+
+
+# QuantLib's trees, including those binomial_batch leaves to QuantLib
+ALL_TREES = TREES + ["LR", "Joshi4"]
+
+# (exercise, engineName, engineParameters) of every setting the engines suite times
+ENGINE_SETTINGS = (
+    [("European", engineName, {}) for engineName in
+     ["AnalyticEuropeanEngine", "AnalyticHestonEngine", "COSHestonEngine", "IntegralEngine"]]
+    + [("American", engineName, {}) for engineName in
+       ["BaroneAdesiWhaleyApproximationEngine", "BjerksundStenslandApproximationEngine"]]
+    + [(exercise, "FdBlackScholesVanillaEngine", {"timeSteps": n, "gridPoints": n})
+       for exercise in ["European", "American"] for n in [25, 50, 100, 200, 400]]
+    + [(exercise, "BinomialVanillaEngine", {"timeSteps": n, "tree": tree})
+       for exercise in ["European", "American"] for tree in ALL_TREES for n in [25, 100, 400]]
+    + [("European", "MCEuropeanEngine", {"random_source": "lowdiscrepancy", "timeSteps": 1, "requiredSamples": n})
+       for n in [1024, 4096, 16384, 65536]]
+    + [("European", "MCEuropeanEngine",
+        {"random_source": "pseudorandom", "timeSteps": 1, "requiredTolerance": t, "seed": 42})
+       for t in [0.2, 0.1, 0.05]]
+)
+
+# the Heston engines price ql_common's Heston model, whose variance stays at 0.1 ** 2
+HESTON_ENGINES = ["AnalyticHestonEngine", "COSHestonEngine"]
+HESTON_VOLATILITY = 0.1
+
+
+def reference_values(portfolio, referenceSize):
+    """
+    High accuracy values of a portfolio, to measure the engines against
+
+    European options are priced in closed form, at the Heston model's constant
+    volatility for the Heston engines. American options, which have no closed
+    form, are priced by QuantLib's finite differences on a referenceSize x
+    referenceSize grid.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        int: referenceSize
+
+    Returns:
+        list: values
+
+    """
+
+    if portfolio[0]["exercise"] == "European":
+        if portfolio[0]["engineName"] in HESTON_ENGINES:
+            portfolio = [
+                dict(option, tradeParameters=dict(option["tradeParameters"], volatility=HESTON_VOLATILITY))
+                for option in portfolio
+            ]
+        return evaluate_european_options_analytic(portfolio)
+
+    engineParameters = {"timeSteps": referenceSize, "gridPoints": referenceSize}
+    return [
+        american_options.evaluate_american_option(
+            dict(option, engineName="FdBlackScholesVanillaEngine", engineParameters=engineParameters)
+        )
+        for option in portfolio
+    ]
+
+
+def _mark_frontier(rows):
+    # a setting is on the frontier when no other setting for the same exercise
+    # is both faster and more accurate
+    for row in rows:
+        row["frontier"] = not any(
+            other is not row
+            and other["exercise"] == row["exercise"]
+            and other["latencyMean"] <= row["latencyMean"]
+            and other["rmsError"] <= row["rmsError"]
+            and (other["latencyMean"] < row["latencyMean"] or other["rmsError"] < row["rmsError"])
+            for other in rows
+        )
+
+
+def benchmark_engines(args):
+    """ latency, throughput and error against a high accuracy reference for every engine and setting """
+    references = {}
+    rows = []
+    for exercise, engineName, engineParameters in ENGINE_SETTINGS:
+        if args.engine and engineName not in args.engine:
+            continue
+
+        portfolio = synthetic_portfolio(args.options, exercise, engineName, engineParameters, seed=args.seed)
+        referenceKey = (exercise, engineName in HESTON_ENGINES)
+        if referenceKey not in references:
+            references[referenceKey] = reference_values(portfolio, args.referenceSize)
+        reference = references[referenceKey]
+
+        MARKET_DATA_CACHE.clear()
+        values = []
+        latencies = []
+        for option in portfolio:
+            value, seconds = timed(batch_processor.evaluate_option, option)
+            values.append(value)
+            latencies.append(seconds)
+
+        failed = sum(1 for value in values if isinstance(value, str))
+        errors = np.array([v - r for v, r in zip(values, reference) if not isinstance(v, str)])
+        strikes = np.array([o["tradeParameters"]["payoff"] for o, v in zip(portfolio, values) if not isinstance(v, str)])
+        latencies = np.array(latencies)
+
+        row = {
+            "exercise": exercise,
+            "engineName": engineName,
+            "engineParameters": engineParameters,
+            "options": len(portfolio),
+            "failed": failed,
+            "latencyMean": latencies.mean(),
+            "latencyP50": np.percentile(latencies, 50),
+            "latencyP95": np.percentile(latencies, 95),
+            "optionsPerSecond": len(portfolio) / latencies.sum(),
+            "maxAbsError": np.abs(errors).max() if len(errors) else None,
+            "rmsError": np.sqrt(np.mean(errors ** 2)) if len(errors) else None,
+            "maxErrorPerStrike": np.abs(errors / strikes).max() if len(errors) else None,
+        }
+
+        # the vectorized path batch_processor takes by default, where there is one
+        if (exercise, engineName) in batch_processor.BATCH_PRICERS:
+            vectorized, seconds = timed(batch_processor.price_portfolio, portfolio)
+            row["vectorizedOptionsPerSecond"] = len(portfolio) / seconds
+            row["vectorizedMaxAbsError"] = max(abs(v - r) for v, r in zip(vectorized, reference))
+
+        rows.append({k: float(v) if isinstance(v, np.floating) else v for k, v in row.items()})
+        print(json.dumps(rows[-1]), file=sys.stderr)
+
+    _mark_frontier([row for row in rows if row["rmsError"] is not None])
+
+    table = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "QuantLib": ql.__version__,
+        "numpy": np.__version__,
+        "options": args.options,
+        "seed": args.seed,
+        "referenceSize": args.referenceSize,
+        "rows": rows,
+    }
+    with open(args.output, "w") as f:
+        json.dump(table, f, indent=2)
+
+    return [
+        {k: row[k] for k in ["exercise", "engineName", "engineParameters", "latencyMean", "rmsError", "frontier"]
+         if k in row}
+        for row in rows
+    ]
+
+
+# (exercise, engineName, engineParameters) repriced by the risk benchmark
+RISK_ENGINES = [
+    ("European", "AnalyticEuropeanEngine", {}),
+    ("European", "AnalyticHestonEngine", {}),
+    ("American", "BjerksundStenslandApproximationEngine", {}),
+    ("American", "BinomialVanillaEngine", {"timeSteps": 100, "tree": "CRR"}),
+    ("American", "FdBlackScholesVanillaEngine", {"timeSteps": 100, "gridPoints": 100}),
+]
+
+
+def shifted_portfolio(portfolio, scenario):
+    shifted = json.loads(json.dumps(portfolio))
+    for option in shifted:
+        tparams = option["tradeParameters"]
+        tparams["underlying"] *= 1.0 + scenario["spotShift"]
+        tparams["volatility"] += scenario["volShift"]
+        tparams["riskFreeRate"] += scenario["rateShift"]
+    return shifted
+
+
+def benchmark_risk(args):
+    """ scenario repricing on reused QuantLib objects against rebuilding every option per scenario """
+    width = 0.01 * (args.spotShifts // 2)
+    spotShifts = np.linspace(-width, width, args.spotShifts).tolist() if args.spotShifts > 1 else []
+    scenarios = risk.scenario_ladder(spotShifts, [-0.01, 0.01], [0.0001])
+
+    rows = []
+    for exercise, engineName, engineParameters in RISK_ENGINES:
+        portfolio = synthetic_portfolio(args.options, exercise, engineName, engineParameters, dates=args.dates)
+
+        matrix, riskSeconds = timed(risk.price_scenarios, portfolio, scenarios)
+        rebuilt, rebuildSeconds = timed(
+            lambda: [batch_processor.price_portfolio(shifted_portfolio(portfolio, scenario), vectorize=False)
+                     for scenario in scenarios]
+        )
+
+        rows.append({
+            "exercise": exercise,
+            "engineName": engineName,
+            "engineParameters": engineParameters,
+            "options": len(portfolio),
+            "scenarios": len(scenarios),
+            "maxDifference": max(abs(a - b) for row, rebuiltRow in zip(matrix, rebuilt)
+                                 for a, b in zip(row, rebuiltRow)),
+            "riskSeconds": riskSeconds,
+            "rebuildSeconds": rebuildSeconds,
+            "speedup": rebuildSeconds / riskSeconds,
+        })
+
+    return rows
+
+
+def benchmark_implied(args):
+    """ batched implied volatilities against QuantLib's impliedVolatility one quote at a time """
+    portfolio = synthetic_portfolio(args.options, dates=args.dates)
+    prices = evaluate_european_options_analytic(portfolio)
+    quotes = [dict(option, tradeParameters={field: value for field, value in option["tradeParameters"].items()
+                                            if field != "volatility"}) for option in portfolio]
+
+    vectorized, vectorizedSeconds = timed(european_options.implied_volatilities, quotes, prices)
+    sample = min(args.quantlibOptions, len(quotes))
+    reference, referenceSeconds = timed(
+        lambda: [european_options.implied_volatility_quantlib(quote, price)
+                 for quote, price in zip(quotes[:sample], prices[:sample])]
+    )
+
+    # deep in the money quotes barely depend on volatility, compare prices rather than volatilities
+    repriced = evaluate_european_options_analytic([
+        dict(option, tradeParameters=dict(option["tradeParameters"], volatility=volatility))
+        for option, volatility in zip(portfolio, vectorized)
+    ])
+
+    return {
+        "options": len(quotes),
+        "errors": sum(isinstance(volatility, str) for volatility in vectorized),
+        "maxPriceError": max(abs(r - p) for r, p in zip(repriced, prices)),
+        "maxDifferenceToQuantLib": max(abs(v - r) for v, r in zip(vectorized, reference)),
+        "vectorizedSeconds": vectorizedSeconds,
+        "quantlibSecondsPerOption": referenceSeconds / sample,
+        "speedup": referenceSeconds / sample / (vectorizedSeconds / len(quotes)),
+    }
+
+
+def _write_chunks(directory, chunks, size):
+    portfolio = synthetic_portfolio(chunks * size, dates=max(1, chunks // 5))
+    for i in range(chunks):
+        with open(os.path.join(directory, "portfolio.json_{}.json".format(i)), "w") as outfile:
+            json.dump(portfolio[i * size:(i + 1) * size], outfile)
+
+
+def _run_worker_process(directory, *flags):
+    command = [sys.executable, "worker.py", "--WatchDirectory", directory] + list(flags)
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def benchmark_worker(args):
+    """ one process per chunk, as AWS Batch jobs run, against one warm worker pricing every chunk """
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        fresh = os.path.join(directory, "fresh")
+        warm = os.path.join(directory, "warm")
+        for path in [fresh, warm]:
+            os.makedirs(path)
+            _write_chunks(path, args.chunks, args.size)
+
+        start = time.perf_counter()
+        for _ in range(args.chunks):
+            _run_worker_process(fresh, "--MaxChunks", "1")
+        freshSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _run_worker_process(warm, "--MaxChunks", str(args.chunks))
+        warmSeconds = time.perf_counter() - start
+
+        for name, seconds, path in [("process per chunk", freshSeconds, fresh), ("warm worker", warmSeconds, warm)]:
+            rows.append({
+                "mode": name,
+                "chunks": len(os.listdir(os.path.join(path, "results"))),
+                "optionsPerChunk": args.size,
+                "seconds": seconds,
+                "secondsPerChunk": seconds / args.chunks,
+            })
+
+    rows[1]["speedup"] = rows[0]["seconds"] / rows[1]["seconds"]
+    return rows
+
+
+def benchmark_metrics(args):
+    """ price_portfolio with and without per-option metrics, on an engine cheap enough to show their cost """
+    portfolio = synthetic_portfolio(args.options, args.exercise, args.engine, dates=args.dates)
+
+    seconds = {"off": [], "on": []}
+    for _ in range(args.repeats):
+        for mode in seconds:
+            metrics = Metrics() if mode == "on" else None
+            _, elapsed = timed(batch_processor.price_portfolio, portfolio, metrics=metrics)
+            seconds[mode].append(elapsed)
+
+    off, on = min(seconds["off"]), min(seconds["on"])
+    return {
+        "engineName": args.engine,
+        "options": len(portfolio),
+        "secondsWithout": off,
+        "secondsWith": on,
+        "overheadPerOptionSeconds": (on - off) / len(portfolio),
+        "overhead": on / off - 1.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    dates_parser = subparsers.add_parser("dates", help=benchmark_dates.__doc__)
+    dates_parser.add_argument("--options", type=int, default=2000)
+    dates_parser.add_argument("--dates", type=int, default=20)
+    dates_parser.add_argument("--observers", type=int, default=0)
+    dates_parser.add_argument("--engine", type=str, default="AnalyticEuropeanEngine")
+    dates_parser.set_defaults(run=benchmark_dates)
+
+    trees_parser = subparsers.add_parser("trees", help=benchmark_trees.__doc__)
+    trees_parser.add_argument("--options", type=int, default=500)
+    trees_parser.add_argument("--timeSteps", type=int, default=100)
+    trees_parser.add_argument("--tolerance", type=float, default=1e-8)
+    trees_parser.set_defaults(run=benchmark_trees)
+
+    fd_parser = subparsers.add_parser("fd", help=benchmark_fd.__doc__)
+    fd_parser.add_argument("--ladders", type=int, default=20)
+    fd_parser.add_argument("--strikes", type=int, default=50)
+    fd_parser.add_argument("--timeSteps", type=int, default=100)
+    fd_parser.add_argument("--gridPoints", type=int, default=100)
+    fd_parser.set_defaults(run=benchmark_fd)
+
+    calibrate_parser = subparsers.add_parser("calibrate", help=benchmark_calibrate.__doc__)
+    calibrate_parser.add_argument("--options", type=int, default=100)
+    calibrate_parser.add_argument("--batchOptions", type=int, default=1000,
+                                  help="options per batch timed for the engines with a vectorized pricer")
+    calibrate_parser.add_argument("--output", type=str, default=cost_model.COST_TABLE_PATH)
+    calibrate_parser.set_defaults(run=benchmark_calibrate)
+
+    engines_parser = subparsers.add_parser("engines", help=benchmark_engines.__doc__)
+    engines_parser.add_argument("--options", type=int, default=50)
+    engines_parser.add_argument("--seed", type=int, default=42)
+    engines_parser.add_argument("--referenceSize", type=int, default=1000,
+                                help="time steps and grid points of the American reference")
+    engines_parser.add_argument("--engine", type=str, action="append",
+                                help="only time this engineName, can be repeated")
+    engines_parser.add_argument("--output", type=str, default=engine_selection.ENGINE_TABLE_PATH)
+    engines_parser.set_defaults(run=benchmark_engines)
+
+    risk_parser = subparsers.add_parser("risk", help=benchmark_risk.__doc__)
+    risk_parser.add_argument("--options", type=int, default=200)
+    risk_parser.add_argument("--dates", type=int, default=1)
+    risk_parser.add_argument("--spotShifts", type=int, default=7,
+                             help="spot shifts 1% apart around the base, times two volatility and one rate shift")
+    risk_parser.set_defaults(run=benchmark_risk)
+
+    implied_parser = subparsers.add_parser("implied", help=benchmark_implied.__doc__)
+    implied_parser.add_argument("--options", type=int, default=20000)
+    implied_parser.add_argument("--dates", type=int, default=5)
+    implied_parser.add_argument("--quantlibOptions", type=int, default=2000,
+                                help="quotes solved through QuantLib for the comparison")
+    implied_parser.set_defaults(run=benchmark_implied)
+
+    worker_parser = subparsers.add_parser("worker", help=benchmark_worker.__doc__)
+    worker_parser.add_argument("--chunks", type=int, default=50)
+    worker_parser.add_argument("--size", type=int, default=10)
+    worker_parser.set_defaults(run=benchmark_worker)
+
+    metrics_parser = subparsers.add_parser("metrics", help=benchmark_metrics.__doc__)
+    metrics_parser.add_argument("--options", type=int, default=5000)
+    metrics_parser.add_argument("--dates", type=int, default=5)
+    metrics_parser.add_argument("--exercise", type=str, default="American")
+    metrics_parser.add_argument("--engine", type=str, default="BaroneAdesiWhaleyApproximationEngine")
+    metrics_parser.add_argument("--repeats", type=int, default=5)
+    metrics_parser.set_defaults(run=benchmark_metrics)
+
+    args = parser.parse_args()
+    rows = args.run(args)
+    print(json.dumps(rows, indent=2))
+
+    # accuracy checks, such as trees, fail the run when a row did not pass
+    if isinstance(rows, list) and any(isinstance(row, dict) and row.get("passed") is False for row in rows):
+        sys.exit(1)
@@ -0,0 +1,218 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import numpy as np
+
+from batch_common import trade_arrays
+from european_batch import CALL, PUT
+
+# trees that don't depend on the strike, the others ("LR", "Joshi4") are left
+# to QuantLib's BinomialVanillaEngine
+TREES = ["JR", "CRR", "EQP", "Trigeorgis", "Tian"]
+
+# upper bound on the number of tree nodes held in memory at once
+MAX_NODES = 65536
+
+
+def tree_parameters(tree, dt, dividendYield, riskFreeRate, volatility):
+    """
+    Per-step parameters of QuantLib's binomial trees on a flat BSM process
+
+    The log of the underlying at node j of step i is
+    log(underlying) + i * base + j * jump.
+
+    Args:
+        string: tree, one of TREES
+        np.ndarray: dt, dividendYield, riskFreeRate, volatility
+
+    Returns:
+        tuple: (base, jump, pu) as np.ndarray
+
+    """
+
+    drift = (riskFreeRate - dividendYield - 0.5 * volatility * volatility) * dt
+    variance = volatility * volatility * dt
+
+    if tree in ["JR", "EQP"]:
+        if tree == "JR":
+            up = np.sqrt(variance)
+        else:
+            up = -0.5 * drift + 0.5 * np.sqrt(4.0 * variance - 3.0 * drift * drift)
+        return drift - up, 2.0 * up, np.full_like(dt, 0.5)
+
+    elif tree in ["CRR", "Trigeorgis"]:
+        if tree == "CRR":
+            dx = np.sqrt(variance)
+        else:
+            dx = np.sqrt(variance + drift * drift)
+        return -dx, 2.0 * dx, 0.5 + 0.5 * drift / dx
+
+    elif tree == "Tian":
+        q = np.exp(variance)
+        r = np.exp(drift) * np.sqrt(q)
+        root = np.sqrt(q * q + 2.0 * q - 3.0)
+        up = 0.5 * r * q * (q + 1.0 + root)
+        down = 0.5 * r * q * (q + 1.0 - root)
+        return np.log(down), np.log(up) - np.log(down), (r - down) / (up - down)
+
+    raise Exception("Unimplemented tree [{}]".format(tree))
+
+
+def binomial_tree(option_type, american, tree, timeSteps, underlying, payoff, dividendYield, riskFreeRate,
+                  volatility, maturity):
+    """
+    Prices arrays of vanilla options by stepping all their trees back together
+
+    Reproduces QuantLib's BinomialVanillaEngine node by node: every option's
+    tree is a row of a 2-D array of node values that is rolled back one time
+    step at a time, with the early exercise condition applied at every step.
+    European options skip the rollback and take the binomial expectation of
+    the payoff directly.
+
+    Args:
+        float: option_type, CALL (1.0) or PUT (-1.0)
+        bool: american, apply early exercise
+        string: tree, one of TREES
+        int: timeSteps, shared by all options
+        np.ndarray: underlying, payoff (strike), dividendYield, riskFreeRate,
+            volatility, maturity (year fraction)
+
+    Returns:
+        np.ndarray: option values, NaN where the tree has negative probabilities
+            or the arithmetic overflows
+
+    """
+
+    # extreme inputs overflow or take the log of zero, the non-finite values
+    # that result are masked out below rather than warned about
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        dt = maturity / timeSteps
+        base, jump, pu = tree_parameters(tree, dt, dividendYield, riskFreeRate, volatility)
+        negative = (pu < 0.0) | (pu > 1.0)
+        discount = np.exp(-riskFreeRate * dt)
+
+        strike = payoff[:, None]
+        nodes = np.arange(timeSteps + 1, dtype=np.float64)
+        logPrices = np.log(underlying)[:, None] + timeSteps * base[:, None] + nodes * jump[:, None]
+        prices = np.exp(logPrices)
+        intrinsic = np.maximum(option_type * (prices - strike), 0.0)
+
+        if not american:
+            # without early exercise the rollback collapses to the discounted
+            # binomial expectation of the payoff at maturity, a payoff that is
+            # zero at every node gives log(0) = -inf and a value of exactly 0
+            logWeights = (
+                _log_binomial_coefficients(timeSteps)
+                + nodes * np.log(pu)[:, None]
+                + (timeSteps - nodes) * np.log(1.0 - pu)[:, None]
+            )
+            values = np.exp(timeSteps * np.log(discount) + np.log(np.sum(intrinsic * np.exp(logWeights), axis=1)))
+            values[negative | ~np.isfinite(values)] = np.nan
+            return values
+
+        # QuantLib's American lattice starts one step early, at (timeSteps - 1) * dt,
+        # whenever timeSteps * dt rounds to less than the maturity
+        early = dt * timeSteps < maturity
+
+        # discounting folded into the branch probabilities, and every step done
+        # in place on shrinking views to keep the node arrays in cache
+        puDiscounted = (pu * discount)[:, None]
+        pdDiscounted = ((1.0 - pu) * discount)[:, None]
+        stepBack = np.exp(-base)[:, None]
+        values = intrinsic
+        exercise = np.empty_like(values)
+        for step in range(timeSteps - 1, -1, -1):
+            upper = values[:, 1:] * puDiscounted
+            values = values[:, :-1]
+            values *= pdDiscounted
+            values += upper
+
+            # node j of step i sits one base step below node j of step i + 1
+            prices = prices[:, :-1]
+            prices *= stepBack
+            exerciseNow = exercise[:, :step + 1]
+            if option_type == CALL:
+                np.subtract(prices, strike, out=exerciseNow)
+            else:
+                np.subtract(strike, prices, out=exerciseNow)
+
+            if step == timeSteps - 1:
+                values[early] = np.maximum(exerciseNow[early], 0.0)
+            np.maximum(values, exerciseNow, out=values)
+
+        values = values[:, 0].copy()
+        values[negative | ~np.isfinite(values)] = np.nan
+        return values
+
+
+def _log_binomial_coefficients(n):
+    k = np.arange(1, n + 1, dtype=np.float64)
+    return np.concatenate([[0.0], np.cumsum(np.log(n - k + 1.0) - np.log(k))])
+
+
+def _evaluate_options_binomial(input_dicts, option_type, american):
+    groups = {}
+    for position, input_dict in enumerate(input_dicts):
+        try:
+            timeSteps = input_dict["engineParameters"]["timeSteps"]
+            tree = input_dict["engineParameters"]["tree"]
+        except (KeyError, TypeError):
+            continue
+        if isinstance(timeSteps, int) and timeSteps >= 2 and tree in TREES:
+            groups.setdefault((tree, timeSteps), []).append(position)
+
+    results = [None] * len(input_dicts)
+    for (tree, timeSteps), positions in groups.items():
+        chunk = max(1, MAX_NODES // (timeSteps + 1))
+        for start in range(0, len(positions), chunk):
+            chunkPositions = positions[start:start + chunk]
+            accepted, arrays = trade_arrays([input_dicts[p] for p in chunkPositions])
+            values = binomial_tree(
+                option_type,
+                american,
+                tree,
+                timeSteps,
+                arrays["underlying"],
+                arrays["payoff"],
+                arrays["dividendYield"],
+                arrays["riskFreeRate"],
+                arrays["volatility"],
+                arrays["maturity"],
+            )
+            for k, value in zip(accepted, values.tolist()):
+                # left to QuantLib, which reports the error if there is one
+                if np.isfinite(value):
+                    results[chunkPositions[k]] = value
+
+    return results
+
+
+def evaluate_american_options_binomial(input_dicts):
+    """
+    Prices a group of American BinomialVanillaEngine options, as american_options does (puts)
+
+    Args:
+        list: input_dicts, options in the batch_processor input format
+
+    Returns:
+        list: option values, None for options that must be priced one by one
+
+    """
+
+    return _evaluate_options_binomial(input_dicts, PUT, True)
+
+
+def evaluate_european_options_binomial(input_dicts):
+    """
+    Prices a group of European BinomialVanillaEngine options, as european_options does (calls)
+
+    Args:
+        list: input_dicts, options in the batch_processor input format
+
+    Returns:
+        list: option values, None for options that must be priced one by one
+
+    """
+
+    return _evaluate_options_binomial(input_dicts, CALL, False)
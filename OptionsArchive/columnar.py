@@ -0,0 +1,277 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import json
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from batch_common import TRADE_FIELDS
+
+# file extension of the Arrow IPC stream format, portfolios and results in any
+# other file are JSON
+ARROW_EXTENSION = ".arrow"
+
+# rows per record batch written
+BATCH_ROWS = 65536
+
+DATE_FIELDS = ["evaluationDate", "exerciseDate"]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for the {} format".format(ARROW_EXTENSION))
+
+
+def is_arrow(path):
+    return path.endswith(ARROW_EXTENSION)
+
+
+def portfolio_schema():
+    """
+    Arrow schema of a portfolio
+
+    Numeric trade parameters are float64 columns, the repetitive string fields
+    are dictionary encoded, and engineParameters is kept as its JSON text.
+    Options that don't fit these columns (missing or non-numeric trade
+    parameters, extra keys) are carried whole in the "option" JSON column so
+    that they still reach evaluate_option and fail there as they would in JSON.
+
+    Returns:
+        pa.Schema
+
+    """
+
+    _require_pyarrow()
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [("exercise", categorical), ("engineName", categorical), ("engineParameters", categorical)]
+        + [(field, categorical) for field in DATE_FIELDS]
+        + [(field, pa.float64()) for field in TRADE_FIELDS]
+        + [("option", pa.string())]
+    )
+
+
+def _fits_columns(option):
+    try:
+        tparams = option["tradeParameters"]
+        return (
+            set(option) <= {"exercise", "engineName", "engineParameters", "tradeParameters"}
+            and set(tparams) == set(DATE_FIELDS + TRADE_FIELDS)
+            and isinstance(option["exercise"], str)
+            and isinstance(option["engineName"], str)
+            and isinstance(option.get("engineParameters", {}), dict)
+            and all(isinstance(tparams[field], str) for field in DATE_FIELDS)
+            and all(type(tparams[field]) in (int, float) for field in TRADE_FIELDS)
+        )
+    except (KeyError, TypeError):
+        return False
+
+
+def portfolio_batch(options):
+    """
+    Converts options in the batch_processor input format to an Arrow record batch
+
+    Args:
+        list: options
+
+    Returns:
+        pa.RecordBatch
+
+    """
+
+    schema = portfolio_schema()
+    columns = {name: [] for name in schema.names}
+    for option in options:
+        if _fits_columns(option):
+            tparams = option["tradeParameters"]
+            columns["exercise"].append(option["exercise"])
+            columns["engineName"].append(option["engineName"])
+            columns["engineParameters"].append(json.dumps(option.get("engineParameters", {}), sort_keys=True))
+            for field in DATE_FIELDS + TRADE_FIELDS:
+                columns[field].append(tparams[field])
+            columns["option"].append(None)
+        else:
+            for name in schema.names[:-1]:
+                columns[name].append(None)
+            columns["option"].append(json.dumps(option))
+
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[field.name], type=field.type) for field in schema], schema=schema
+    )
+
+
+def write_portfolio(options, sink):
+    """
+    Writes options as an Arrow IPC stream
+
+    Args:
+        iterable: options in the batch_processor input format
+        sink: path or writable binary file-like object
+
+    """
+
+    schema = portfolio_schema()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        batch = []
+        for option in options:
+            batch.append(option)
+            if len(batch) == BATCH_ROWS:
+                writer.write_batch(portfolio_batch(batch))
+                batch = []
+        if batch:
+            writer.write_batch(portfolio_batch(batch))
+
+
+def portfolio_bytes(options):
+    """
+    Serializes options to an Arrow IPC stream in memory
+
+    Args:
+        list: options in the batch_processor input format
+
+    Returns:
+        bytes
+
+    """
+
+    sink = pa.BufferOutputStream()
+    write_portfolio(options, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def _column_list(column):
+    # to_pylist on dictionary arrays builds every string again, going through
+    # the indices shares one string per distinct value
+    if pa.types.is_dictionary(column.type):
+        values = column.dictionary.to_pylist() + [None]
+        indices = column.indices.fill_null(len(values) - 1)
+        return [values[i] for i in indices.to_numpy(zero_copy_only=False).tolist()]
+    if pa.types.is_floating(column.type) and column.null_count == 0:
+        return column.to_numpy().tolist()
+    return column.to_pylist()
+
+
+def batch_options(batch):
+    """
+    Converts a portfolio record batch back to options in the batch_processor input format
+
+    Args:
+        pa.RecordBatch
+
+    Returns:
+        list: options
+
+    """
+
+    columns = {name: _column_list(batch.column(name)) for name in batch.schema.names}
+    engineParameters = {}
+    options = []
+    for row in range(batch.num_rows):
+        if columns["option"][row] is not None:
+            options.append(json.loads(columns["option"][row]))
+            continue
+
+        # one dict per distinct engineParameters string, copied per option as
+        # callers may modify them
+        text = columns["engineParameters"][row]
+        if text not in engineParameters:
+            engineParameters[text] = json.loads(text)
+
+        tradeParameters = {field: columns[field][row] for field in DATE_FIELDS + TRADE_FIELDS}
+        options.append({
+            "exercise": columns["exercise"][row],
+            "engineName": columns["engineName"][row],
+            "engineParameters": dict(engineParameters[text]),
+            "tradeParameters": tradeParameters,
+        })
+
+    return options
+
+
+def _open_stream(source):
+    _require_pyarrow()
+    if isinstance(source, str):
+        # memory mapped, record batches reference the file without copying
+        source = pa.memory_map(source)
+    elif not isinstance(source, (pa.NativeFile, pa.Buffer)):
+        source = pa.PythonFile(source, mode="r")
+    return pa.ipc.open_stream(source)
+
+
+def iter_portfolio(source):
+    """
+    Yields the options of an Arrow IPC portfolio one record batch at a time
+
+    Args:
+        source: path, or readable binary file-like object such as an S3 StreamingBody
+
+    Yields:
+        dict: option in the batch_processor input format
+
+    """
+
+    for batch in _open_stream(source):
+        yield from batch_options(batch)
+
+
+def read_portfolio(source):
+    return list(iter_portfolio(source))
+
+
+def read_table(source):
+    """
+    Reads an Arrow IPC portfolio or result file as a pa.Table, without copying when given a path
+
+    Args:
+        source: path, or readable binary file-like object
+
+    Returns:
+        pa.Table
+
+    """
+
+    return _open_stream(source).read_all()
+
+
+def write_results(results, sink):
+    """
+    Writes price_portfolio results as an Arrow IPC stream
+
+    Values go to a float64 "value" column and error strings to an "error"
+    column, each null where the other is set.
+
+    Args:
+        list: results, values or error strings
+        sink: path or writable binary file-like object
+
+    """
+
+    _require_pyarrow()
+    errors = [result if isinstance(result, str) else None for result in results]
+    values = [None if isinstance(result, str) else result for result in results]
+    table = pa.table({"value": pa.array(values, type=pa.float64()), "error": pa.array(errors, type=pa.string())})
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=BATCH_ROWS)
+
+
+def read_results(source):
+    """
+    Reads results written by write_results
+
+    Args:
+        source: path, or readable binary file-like object
+
+    Returns:
+        list: values or error strings
+
+    """
+
+    table = read_table(source)
+    return [
+        error if error is not None else value
+        for value, error in zip(table.column("value").to_pylist(), table.column("error").to_pylist())
+    ]
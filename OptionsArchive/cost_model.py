@@ -0,0 +1,301 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import heapq
+import json
+import math
+import os
+
+from batch_common import year_fraction
+from binomial_batch import TREES
+from engine_selection import resolve_option
+
+# written by "python benchmark.py calibrate", shipped next to this module
+COST_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cost_table.json")
+
+# cost of an option is base + perUnit * size ** exponent, in units of one
+# AnalyticEuropeanEngine evaluation, with size given by _size and entries keyed
+# by _cost_key, VECTORIZED_PREFIX entries being the per-option share of a
+# vectorized batch. unitSeconds is the time of that unit on the machine the table
+# was calibrated on. These defaults stand in when no calibrated table is available
+DEFAULT_COST_TABLE = {
+    "unitSeconds": 5e-5,
+    "engines": {
+        "AnalyticEuropeanEngine": {"base": 1.0, "perUnit": 0.0, "exponent": 1.0},
+        "AnalyticHestonEngine": {"base": 2.0, "perUnit": 0.0, "exponent": 1.0},
+        "BaroneAdesiWhaleyApproximationEngine": {"base": 1.5, "perUnit": 0.0, "exponent": 1.0},
+        "BjerksundStenslandApproximationEngine": {"base": 1.5, "perUnit": 0.0, "exponent": 1.0},
+        "COSHestonEngine": {"base": 5.0, "perUnit": 0.0, "exponent": 1.0},
+        "IntegralEngine": {"base": 10.0, "perUnit": 0.0, "exponent": 1.0},
+        "FdBlackScholesVanillaEngine": {"base": 1.0, "perUnit": 1.0 / 500.0, "exponent": 1.0},
+        "BinomialVanillaEngine": {"base": 1.0, "perUnit": 1.0 / 2000.0, "exponent": 1.0},
+        "MCEuropeanEngine/lowdiscrepancy": {"base": 1.0, "perUnit": 1.0 / 100.0, "exponent": 1.0},
+        "MCEuropeanEngine/pseudorandom": {"base": 1.0, "perUnit": 1.0 / 100.0, "exponent": 1.0},
+        "vectorized/European/AnalyticEuropeanEngine": {"base": 0.07, "perUnit": 0.0, "exponent": 1.0},
+        "vectorized/European/BinomialVanillaEngine": {"base": 0.1, "perUnit": 0.0, "exponent": 1.0},
+        "vectorized/American/BinomialVanillaEngine": {"base": 0.0, "perUnit": 1.0 / 1500.0, "exponent": 0.75},
+        "vectorized/European/MCEuropeanEngine/lowdiscrepancy": {"base": 30.0, "perUnit": 1.0 / 1000.0,
+                                                                 "exponent": 1.0},
+        "vectorized/European/MCEuropeanEngine/pseudorandom": {"base": 0.0, "perUnit": 1.0 / 3000.0, "exponent": 1.0},
+    },
+}
+
+VECTORIZED_PREFIX = "vectorized/"
+
+# (exercise, engineName) that batch_processor prices with its BATCH_PRICERS.
+# FD options are only batched in strike ladders of options sharing a market,
+# which depends on what else is in the chunk, so they are costed as QuantLib
+# prices them
+VECTORIZED_ENGINES = [
+    ("European", "AnalyticEuropeanEngine"),
+    ("European", "BinomialVanillaEngine"),
+    ("European", "MCEuropeanEngine"),
+    ("American", "BinomialVanillaEngine"),
+]
+
+# paths MCEuropeanEngine draws when neither requiredSamples nor a usable
+# requiredTolerance is given
+DEFAULT_SAMPLES = 50000
+
+# QuantLib's minimum number of paths when running to a tolerance
+MIN_MONTE_CARLO_SAMPLES = 1023
+
+# chunks pack keeps open for later options to fill, and the fraction of the
+# target at which a chunk counts as full
+OPEN_CHUNKS = 16
+FULL_FRACTION = 0.95
+
+
+def load_cost_table(path=COST_TABLE_PATH):
+    """
+    Reads a calibrated cost table, falling back to DEFAULT_COST_TABLE
+
+    Engines missing from the file keep their default costs.
+
+    Args:
+        string: path
+
+    Returns:
+        dict: cost table
+
+    """
+
+    table = {"unitSeconds": DEFAULT_COST_TABLE["unitSeconds"], "engines": dict(DEFAULT_COST_TABLE["engines"])}
+    try:
+        with open(path) as f:
+            calibrated = json.load(f)
+    except (OSError, ValueError):
+        return table
+
+    table["unitSeconds"] = calibrated.get("unitSeconds", table["unitSeconds"])
+    table["engines"].update(calibrated.get("engines", {}))
+    return table
+
+
+COST_TABLE = load_cost_table()
+
+
+def _normal_cdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2.0))
+
+
+def _monte_carlo_samples(option):
+    engineParameters = option["engineParameters"]
+    if engineParameters.get("random_source") != "pseudorandom" or not engineParameters.get("requiredTolerance"):
+        return engineParameters.get("requiredSamples") or DEFAULT_SAMPLES
+
+    # QuantLib adds paths until the standard error of the discounted call
+    # payoff, stdDev(payoff) * discount / sqrt(samples), is within tolerance
+    tparams = option["tradeParameters"]
+    maturity = year_fraction(tparams["evaluationDate"], tparams["exerciseDate"])
+    strike = tparams["payoff"]
+    stdDev = tparams["volatility"] * math.sqrt(maturity)
+    forward = tparams["underlying"] * math.exp((tparams["riskFreeRate"] - tparams["dividendYield"]) * maturity)
+    d1 = math.log(forward / strike) / stdDev + 0.5 * stdDev
+    d2 = d1 - stdDev
+
+    mean = forward * _normal_cdf(d1) - strike * _normal_cdf(d2)
+    meanSquare = (
+        forward * forward * math.exp(stdDev * stdDev) * _normal_cdf(d1 + stdDev)
+        - 2.0 * strike * forward * _normal_cdf(d1)
+        + strike * strike * _normal_cdf(d2)
+    )
+    variance = max(meanSquare - mean * mean, 0.0) * math.exp(-2.0 * tparams["riskFreeRate"] * maturity)
+    return max(MIN_MONTE_CARLO_SAMPLES, variance / engineParameters["requiredTolerance"] ** 2)
+
+
+def _vectorized(option):
+    # whether batch_processor's vectorized pricers take the option, rather
+    # than leave it to be priced one by one through QuantLib
+    if (option["exercise"], option["engineName"]) not in VECTORIZED_ENGINES:
+        return False
+
+    engineParameters = option.get("engineParameters") or {}
+    if option["engineName"] == "BinomialVanillaEngine":
+        timeSteps = engineParameters.get("timeSteps")
+        return engineParameters.get("tree") in TREES and isinstance(timeSteps, int) and timeSteps >= 2
+
+    elif option["engineName"] == "MCEuropeanEngine":
+        if engineParameters.get("random_source") == "pseudorandom":
+            return "seed" in engineParameters and bool(engineParameters.get("requiredTolerance"))
+        return (engineParameters.get("random_source") == "lowdiscrepancy"
+                and bool(engineParameters.get("requiredSamples")))
+
+    return True
+
+
+def _cost_key(option, vectorize=False):
+    # QuantLib's pseudorandom runs to a tolerance keep every sample and scale
+    # differently from fixed-size Sobol runs
+    key = option["engineName"]
+    if key == "MCEuropeanEngine":
+        key += "/" + option["engineParameters"]["random_source"]
+    if vectorize and _vectorized(option):
+        return VECTORIZED_PREFIX + option["exercise"] + "/" + key
+    return key
+
+
+def _size(option):
+    # the work an engine does grows with this
+    engineName = option["engineName"]
+    engineParameters = option.get("engineParameters") or {}
+
+    if engineName == "FdBlackScholesVanillaEngine":
+        return engineParameters["timeSteps"] * engineParameters["gridPoints"]
+
+    elif engineName == "BinomialVanillaEngine":
+        return engineParameters["timeSteps"] ** 2
+
+    elif engineName == "MCEuropeanEngine":
+        return _monte_carlo_samples(option) * engineParameters.get("timeSteps", 1)
+
+    return 0.0
+
+
+def estimate_cost(option, table=None, vectorize=True):
+    """
+    Rough relative cost of pricing one option the way batch_processor prices it
+
+    engineName "Auto" is resolved first, so the engine and parameters costed
+    are the ones batch_processor will price with.
+
+    Args:
+        dict: option in the batch_processor input format
+        dict: table, cost table, COST_TABLE by default
+        bool: vectorize, as for price_portfolio, whether options with a
+            vectorized pricer are costed as their share of a batch rather
+            than as priced one by one through QuantLib
+
+    Returns:
+        float: cost in units of one AnalyticEuropeanEngine evaluation
+
+    """
+
+    try:
+        option, _ = resolve_option(option)
+    except Exception:
+        # the failed selection is reported by evaluate_option
+        return 1.0
+
+    engines = (table or COST_TABLE)["engines"]
+    try:
+        # tables calibrated before the vectorized entries fall back to QuantLib's
+        cost = engines.get(_cost_key(option, vectorize)) or engines[_cost_key(option)]
+        return cost["base"] + cost["perUnit"] * _size(option) ** cost.get("exponent", 1.0)
+
+    except (AttributeError, KeyError, TypeError, ValueError, ZeroDivisionError):
+        # unknown engines and malformed options fail fast in evaluate_option
+        return 1.0
+
+
+def estimate_seconds(option, table=None, vectorize=True):
+    """
+    Estimated time to price one option the way batch_processor prices it
+
+    Args:
+        dict: option in the batch_processor input format
+        dict: table, cost table, COST_TABLE by default
+        bool: vectorize, as for estimate_cost
+
+    Returns:
+        float: seconds
+
+    """
+
+    return estimate_cost(option, table, vectorize) * (table or COST_TABLE)["unitSeconds"]
+
+
+def pack(options, target_seconds, max_options=None, table=None, open_chunks=OPEN_CHUNKS, vectorize=True):
+    """
+    Groups a stream of options into chunks of about target_seconds each
+
+    First fit over a bounded number of open chunks: every option goes to the
+    first open chunk it fits in, and when none has room the fullest open
+    chunk is emitted to make space. Chunks are emitted as soon as they reach
+    FULL_FRACTION of the target, so at most open_chunks partly filled chunks
+    are held in memory, and cheap options fill the gaps left around
+    expensive ones. An option estimated above target_seconds on its own is
+    emitted alone.
+
+    Args:
+        iterable: options in the batch_processor input format
+        float: target_seconds
+        int: max_options, optional cap on the options per chunk
+        dict: table, cost table, COST_TABLE by default
+        int: open_chunks
+        bool: vectorize, whether the chunks are priced with the vectorized
+            pricers, batch_processor's default
+
+    Yields:
+        tuple: (list of options, estimated seconds)
+
+    """
+
+    chunks = []
+    for option in options:
+        seconds = estimate_seconds(option, table, vectorize)
+        if seconds >= target_seconds:
+            yield [option], seconds
+            continue
+
+        for c, chunk in enumerate(chunks):
+            if chunk[1] + seconds <= target_seconds:
+                chunk[0].append(option)
+                chunk[1] += seconds
+                break
+        else:
+            if len(chunks) >= open_chunks:
+                fullest = max(range(len(chunks)), key=lambda k: chunks[k][1])
+                yield tuple(chunks.pop(fullest))
+            c = len(chunks)
+            chunks.append([[option], seconds])
+
+        # close chunks as soon as they are full, so that only partly filled ones are held
+        if chunks[c][1] >= FULL_FRACTION * target_seconds or len(chunks[c][0]) == max_options:
+            yield tuple(chunks.pop(c))
+
+    for chunk in chunks:
+        yield tuple(chunk)
+
+
+def balance(costs, bins):
+    """
+    Longest-processing-time-first assignment of items to a number of bins
+
+    Args:
+        list: costs, one per item
+        int: bins
+
+    Returns:
+        list: lists of item positions, most expensive bin first
+
+    """
+
+    loads = [(0.0, b, []) for b in range(bins)]
+    for position in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, b, items = heapq.heappop(loads)
+        items.append(position)
+        heapq.heappush(loads, (load + costs[position], b, items))
+
+    return [items for load, b, items in sorted(loads, reverse=True) if items]
@@ -0,0 +1,118 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import json
+import os
+
+AUTO = "Auto"
+
+# written by "python benchmark.py engines", shipped next to this module
+ENGINE_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engines.json")
+
+# the Heston engines price a different model than the trade's volatility
+# describes, they are never substituted for a Black-Scholes engine
+EXCLUDED_ENGINES = ["AnalyticHestonEngine", "COSHestonEngine"]
+
+# used when no calibration table is available: exact for European options,
+# and within about 1e-3 for American ones
+DEFAULT_ENGINES = {
+    "European": ("AnalyticEuropeanEngine", {}),
+    "American": ("FdBlackScholesVanillaEngine", {"timeSteps": 400, "gridPoints": 400}),
+}
+
+
+def load_engine_table(path=ENGINE_TABLE_PATH):
+    """
+    Reads the engine rows of a table written by the engines benchmark
+
+    Args:
+        string: path
+
+    Returns:
+        list: rows, empty when there is no table
+
+    """
+
+    try:
+        with open(path) as f:
+            return json.load(f)["rows"]
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+ENGINE_TABLE = load_engine_table()
+
+
+def _seconds(row):
+    # batch_processor prices options with a vectorized pricer in batches
+    if row.get("vectorizedOptionsPerSecond"):
+        return min(row["latencyMean"], 1.0 / row["vectorizedOptionsPerSecond"])
+    return row["latencyMean"]
+
+
+def select_engine(option, table=None):
+    """
+    Picks the cheapest engine expected to price an option within a tolerance
+
+    The tolerance is an absolute error on the option value, taken from
+    engineParameters["tolerance"]. Every setting of the calibration table
+    is expected to be accurate to its measured maxErrorPerStrike times the
+    option's strike. Among the settings for the option's exercise that meet
+    the tolerance, the one with the lowest time per option wins. When none
+    does, the most accurate setting is used.
+
+    Args:
+        dict: option in the batch_processor input format, with engineName "Auto"
+        list: table, engine rows, ENGINE_TABLE by default
+
+    Returns:
+        tuple: (engineName, engineParameters, expected error or None)
+
+    """
+
+    exercise = option["exercise"]
+    tolerance = float(option["engineParameters"]["tolerance"])
+    strike = float(option["tradeParameters"]["payoff"])
+    if exercise not in DEFAULT_ENGINES:
+        raise Exception("Can not select an engine, exercise type is not supported: {}".format(exercise))
+
+    rows = [
+        row for row in (ENGINE_TABLE if table is None else table)
+        if row["exercise"] == exercise
+        and row["engineName"] not in EXCLUDED_ENGINES
+        and not row.get("failed")
+        and row.get("maxErrorPerStrike") is not None
+    ]
+    if not rows:
+        engineName, engineParameters = DEFAULT_ENGINES[exercise]
+        return engineName, dict(engineParameters), None
+
+    accurate = [row for row in rows if row["maxErrorPerStrike"] * strike <= tolerance]
+    if accurate:
+        best = min(accurate, key=_seconds)
+    else:
+        best = min(rows, key=lambda row: row["maxErrorPerStrike"])
+
+    return best["engineName"], dict(best["engineParameters"]), best["maxErrorPerStrike"] * strike
+
+
+def resolve_option(option, table=None):
+    """
+    Replaces engineName "Auto" by the engine select_engine picks
+
+    Args:
+        dict: option in the batch_processor input format
+        list: table, engine rows, ENGINE_TABLE by default
+
+    Returns:
+        tuple: (option with the selected engine, expected error or None),
+        options with another engineName are returned as they are
+
+    """
+
+    if option.get("engineName") != AUTO:
+        return option, None
+
+    engineName, engineParameters, error = select_engine(option, table)
+    return dict(option, engineName=engineName, engineParameters=engineParameters), error
@@ -0,0 +1,397 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import numpy as np
+
+from batch_common import inverse_normal_cdf, normal_cdf, sobol_uniforms, trade_arrays
+
+CALL = 1.0
+PUT = -1.0
+
+# randomized quasi-Monte Carlo replications used for the Sobol error estimate
+SOBOL_REPLICATIONS = 16
+
+# antithetic pairs drawn before checking requiredTolerance, and the cap on
+# how far that is doubled
+MIN_PAIRS = 1 << 12
+MAX_PAIRS = 1 << 22
+
+# volatility bounds and iteration cap of the implied volatility search,
+# QuantLib's VanillaOption.impliedVolatility defaults
+IMPLIED_MIN_VOL = 1.0e-7
+IMPLIED_MAX_VOL = 4.0
+IMPLIED_MAX_ITERATIONS = 100
+
+
+def black_scholes(option_type, underlying, payoff, dividendYield, riskFreeRate, volatility, maturity):
+    """
+    Closed-form Black-Scholes-Merton prices for arrays of plain vanilla options
+
+    Mirrors QuantLib's AnalyticEuropeanEngine on flat curves: continuously
+    compounded rates and a constant Black volatility, all measured in
+    Actual/365 (Fixed) year fractions.
+
+    Args:
+        float or np.ndarray: option_type, CALL (1.0) or PUT (-1.0)
+        np.ndarray: underlying, payoff (strike), dividendYield, riskFreeRate,
+            volatility, maturity (year fraction)
+
+    Returns:
+        np.ndarray: option values
+
+    """
+
+    stdDev = volatility * np.sqrt(maturity)
+    riskFreeDiscount = np.exp(-riskFreeRate * maturity)
+    forward = underlying * np.exp(-dividendYield * maturity) / riskFreeDiscount
+
+    d1 = np.log(forward / payoff) / stdDev + 0.5 * stdDev
+    d2 = d1 - stdDev
+
+    return riskFreeDiscount * option_type * (
+        forward * normal_cdf(option_type * d1) - payoff * normal_cdf(option_type * d2)
+    )
+
+
+def evaluate_european_options_analytic(input_dicts):
+    """
+    Prices a group of AnalyticEuropeanEngine options in one vectorized pass
+
+    Args:
+        list: input_dicts, options in the batch_processor input format
+
+    Returns:
+        list: option values, None for options that must be priced one by one
+
+    """
+
+    accepted, arrays = trade_arrays(input_dicts)
+    values = black_scholes(
+        CALL,
+        arrays["underlying"],
+        arrays["payoff"],
+        arrays["dividendYield"],
+        arrays["riskFreeRate"],
+        arrays["volatility"],
+        arrays["maturity"],
+    )
+
+    results = [None] * len(input_dicts)
+    for position, value in zip(accepted, values.tolist()):
+        results[position] = value
+    return results
+
+
+def _interpolation_step(low, lowError, high, highError, previous, previousError):
+    # Brent's interpolation: the inverse quadratic through both bracket ends
+    # and the previous iterate when their errors are distinct, the secant
+    # through the bracket ends otherwise
+    quadratic = (
+        low * highError * previousError / ((lowError - highError) * (lowError - previousError))
+        + high * lowError * previousError / ((highError - lowError) * (highError - previousError))
+        + previous * lowError * highError / ((previousError - lowError) * (previousError - highError))
+    )
+    secant = low - lowError * (high - low) / (highError - lowError)
+    return np.where(np.isfinite(quadratic), quadratic, secant)
+
+
+def implied_volatility(option_type, price, underlying, payoff, dividendYield, riskFreeRate, maturity,
+                       accuracy=1.0e-8, maxIterations=IMPLIED_MAX_ITERATIONS, minVol=IMPLIED_MIN_VOL,
+                       maxVol=IMPLIED_MAX_VOL):
+    """
+    Black-Scholes-Merton implied volatilities for arrays of plain vanilla option prices
+
+    Every quote is solved at once by a Newton/Brent hybrid: each keeps a
+    bracket [low, high] around its root, narrowed by the sign of the pricing
+    error at every iterate. Whenever the Newton step leaves the bracket or
+    vega vanishes, Brent's method takes over for that iterate: inverse
+    quadratic or secant interpolation, and a bisection when that leaves the
+    bracket too or the bracket did not halve over the last two iterations.
+    Newton starts from the inflection point of the price in volatility
+    (Manaster and Koehler), from which it converges monotonically for most
+    quotes. Quotes stop iterating once their step is below accuracy, and
+    only the unconverged ones are priced at the next iteration.
+
+    Args:
+        float or np.ndarray: option_type, CALL (1.0) or PUT (-1.0)
+        np.ndarray: price, underlying, payoff (strike), dividendYield,
+            riskFreeRate, maturity (year fraction)
+        float: accuracy, on the volatility
+        int: maxIterations
+        float: minVol, maxVol, bounds of the search
+
+    Returns:
+        np.ndarray: implied volatilities, NaN for prices outside of those
+        reached by volatilities in [minVol, maxVol] or not solved within
+        maxIterations
+
+    """
+
+    n = len(price)
+    option_type = np.broadcast_to(np.asarray(option_type, dtype=np.float64), (n,))
+    quotes = [np.broadcast_to(np.asarray(x, dtype=np.float64), (n,))
+              for x in (price, underlying, payoff, dividendYield, riskFreeRate, maturity)]
+    price, underlying, payoff, dividendYield, riskFreeRate, maturity = quotes
+
+    # the bracket of every quote and the pricing errors at its ends
+    low = np.full(n, minVol)
+    high = np.full(n, maxVol)
+    with np.errstate(all="ignore"):
+        lowError = black_scholes(option_type, underlying, payoff, dividendYield, riskFreeRate, low, maturity) - price
+        highError = black_scholes(option_type, underlying, payoff, dividendYield, riskFreeRate, high, maturity) - price
+        solvable = np.isfinite(price) & (lowError <= 0.0) & (highError >= 0.0)
+        logMoneyness = np.log(underlying / payoff) + (riskFreeRate - dividendYield) * maturity
+        volatility = np.clip(np.sqrt(2.0 * np.abs(logMoneyness) / maturity), minVol, maxVol)
+
+    # the iterate before the current one, the third point of the inverse
+    # quadratic, and the bracket widths before the last two iterations
+    previous = np.full(n, np.nan)
+    previousError = np.full(n, np.nan)
+    lastWidth = high - low
+    olderWidth = high - low
+
+    result = np.full(n, np.nan)
+    active = np.flatnonzero(solvable)
+    for _ in range(maxIterations):
+        if active.size == 0:
+            break
+
+        k = active
+        vol = volatility[k]
+        sqrtMaturity = np.sqrt(maturity[k])
+        stdDev = vol * sqrtMaturity
+        d1 = logMoneyness[k] / stdDev + 0.5 * stdDev
+        error = black_scholes(option_type[k], underlying[k], payoff[k], dividendYield[k], riskFreeRate[k], vol,
+                              maturity[k]) - price[k]
+        vega = underlying[k] * np.exp(-dividendYield[k] * maturity[k] - 0.5 * d1 * d1) * sqrtMaturity \
+            / np.sqrt(2.0 * np.pi)
+
+        # prices increase with volatility, the sign of the error tells which side the root is on
+        above = error > 0.0
+        high[k] = np.where(above, vol, high[k])
+        highError[k] = np.where(above, error, highError[k])
+        low[k] = np.where(above, low[k], vol)
+        lowError[k] = np.where(above, lowError[k], error)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = vol - error / vega
+            interpolated = _interpolation_step(low[k], lowError[k], high[k], highError[k], previous[k],
+                                               previousError[k])
+        width = high[k] - low[k]
+        stalled = width > 0.5 * olderWidth[k]
+        bisection = 0.5 * (low[k] + high[k])
+        step = np.where((interpolated > low[k]) & (interpolated < high[k]) & ~stalled, interpolated, bisection)
+        step = np.where(np.isfinite(newton) & (newton > low[k]) & (newton < high[k]), newton, step)
+        # an exact root is also a bracket end, keep it rather than bisect
+        step = np.where(error == 0.0, vol, step)
+
+        previous[k], previousError[k] = vol, error
+        olderWidth[k], lastWidth[k] = lastWidth[k], width
+        volatility[k] = step
+        done = (np.abs(step - vol) < accuracy) | (error == 0.0)
+        result[k[done]] = step[done]
+        active = k[~done]
+
+    return result
+
+
+class TerminalSample:
+    """
+    Antithetic sample of unit-spot terminal values of a flat BSM process
+
+    The terminal values g are sorted once, after which the mean call payoff
+    and its antithetic standard error for any strike k on a unit spot are
+    read from prefix sums in O(log n). Antithetic partners multiply to a
+    constant, g * g' = exp(2 * drift * maturity), which is what lets the
+    pair covariances be summed over sorted values as well.
+
+    """
+
+    def __init__(self, normals, drift, stdDev):
+        terminal = np.exp(drift + stdDev * np.concatenate([normals, -normals]))
+        self.pairs = len(normals)
+        self.partnerProduct = np.exp(2.0 * drift)
+        self.sorted = np.sort(terminal)
+        self.sum = self._suffix(self.sorted)
+        self.sumSquares = self._suffix(self.sorted * self.sorted)
+        self.sumInverse = self._suffix(1.0 / self.sorted)
+
+    @staticmethod
+    def _suffix(values):
+        # suffix[i] = sum of values[i:]
+        return np.concatenate([np.cumsum(values[::-1])[::-1], [0.0]])
+
+    def _range(self, low, high):
+        # count, sum, sum of squares and sum of inverses of values in (low, high)
+        start = np.searchsorted(self.sorted, low, side="right")
+        end = np.searchsorted(self.sorted, high, side="left")
+        end = np.maximum(start, end)
+        return (
+            end - start,
+            self.sum[start] - self.sum[end],
+            self.sumSquares[start] - self.sumSquares[end],
+            self.sumInverse[start] - self.sumInverse[end],
+        )
+
+    def call(self, strike):
+        """
+        Mean call payoff and its standard error, for unit spot and arrays of strikes
+        """
+
+        n = 2 * self.pairs
+        count, total, squares, _ = self._range(strike, np.inf)
+        mean = (total - strike * count) / n
+        meanSquare = (squares - 2.0 * strike * total + strike * strike * count) / n
+
+        # both members of a pair are in the money when k < g < c / k
+        c = self.partnerProduct
+        count, total, _, inverses = self._range(strike, c / strike)
+        crossMean = (c * count - strike * (total + c * inverses) + strike * strike * count) / n
+
+        pairVariance = np.maximum(0.5 * (meanSquare + crossMean) - mean * mean, 0.0)
+        return mean, np.sqrt(pairVariance / self.pairs)
+
+
+def _normals(random_source, seed, pairs, replication=0):
+    if random_source == "pseudorandom":
+        rng = np.random.default_rng(None if seed == 0 else [seed, replication])
+        return rng.standard_normal(pairs)
+
+    # a fixed default shift keeps unseeded Sobol runs reproducible, like QuantLib's
+    shift = np.random.default_rng([seed, replication]).integers(0, 1 << 32)
+    return inverse_normal_cdf(sobol_uniforms(pairs, shift))
+
+
+def monte_carlo_calls(underlying, payoff, riskFreeRate, maturity, dividendYield, volatility, random_source,
+                      seed=0, requiredSamples=None, requiredTolerance=None):
+    """
+    Batched Monte Carlo prices of European calls sharing one flat BSM process
+
+    One antithetic path set is drawn for the process and rescaled to every
+    underlying and strike, the payoff only depends on the terminal value so
+    paths are simulated exactly in a single step. "pseudorandom" draws
+    normals from a seeded PCG64 generator, with seed 0 meaning an unseeded
+    run as in QuantLib. "lowdiscrepancy" uses SOBOL_REPLICATIONS digitally
+    shifted Sobol point sets, whose spread gives the standard error.
+
+    With requiredTolerance the sample is doubled while some option misses
+    it, and every option keeps the value of the first sample that meets its
+    own tolerance. The paths an option is priced from only depend on that
+    option, not on which others share its group, so seeded values are as
+    reproducible as those of options priced one by one.
+
+    Args:
+        np.ndarray: underlying, payoff (strike)
+        float: riskFreeRate, maturity, dividendYield, volatility shared by the group
+        string: random_source, "pseudorandom" or "lowdiscrepancy"
+        int: seed
+        int: requiredSamples, total number of paths, or None
+        float: requiredTolerance, target standard error, or None
+
+    Returns:
+        tuple: (values, standard errors, largest number of paths) with NaN
+        values where requiredTolerance could not be met within MAX_PAIRS
+
+    """
+
+    drift = (riskFreeRate - dividendYield - 0.5 * volatility * volatility) * maturity
+    stdDev = volatility * np.sqrt(maturity)
+    scale = underlying * np.exp(-riskFreeRate * maturity)
+    strike = payoff / underlying
+
+    if random_source == "lowdiscrepancy":
+        pairs = max(1, -(-(requiredSamples or 2 * MIN_PAIRS) // (2 * SOBOL_REPLICATIONS)))
+        means = np.array([
+            TerminalSample(_normals(random_source, seed, pairs, r), drift, stdDev).call(strike)[0]
+            for r in range(SOBOL_REPLICATIONS)
+        ])
+        errors = means.std(axis=0, ddof=1) / np.sqrt(SOBOL_REPLICATIONS)
+        return scale * means.mean(axis=0), scale * errors, 2 * pairs * SOBOL_REPLICATIONS
+
+    if requiredSamples:
+        normals = _normals(random_source, seed, max(1, requiredSamples // 2))
+        mean, error = TerminalSample(normals, drift, stdDev).call(strike)
+        return scale * mean, scale * error, 2 * len(normals)
+
+    # double the sample until every option meets the tolerance, pricing
+    # only the options that have not met it yet on the larger samples
+    values = np.full(len(strike), np.nan)
+    errors = np.full(len(strike), np.nan)
+    pending = np.arange(len(strike))
+    normals = _normals(random_source, seed, MIN_PAIRS)
+    while True:
+        mean, error = TerminalSample(normals, drift, stdDev).call(strike[pending])
+        errors[pending] = scale[pending] * error
+        converged = errors[pending] <= requiredTolerance
+        values[pending[converged]] = scale[pending[converged]] * mean[converged]
+        pending = pending[~converged]
+        if not len(pending) or len(normals) >= MAX_PAIRS:
+            break
+        normals = np.concatenate([normals, _normals(random_source, seed, len(normals), len(normals))])
+
+    return values, errors, 2 * len(normals)
+
+
+def evaluate_european_options_mc(input_dicts):
+    """
+    Prices a group of MCEuropeanEngine options, one path set per market
+
+    Options sharing time to maturity, rates, volatility and Monte Carlo
+    settings are priced from the same paths, whatever their underlying and
+    strike. The largest standard error of every path set is printed.
+
+    Only the options european_options accepts are priced: pseudorandom ones
+    need a seed, 0 drawing fresh paths as in QuantLib, and a
+    requiredTolerance.
+
+    Args:
+        list: input_dicts, options in the batch_processor input format
+
+    Returns:
+        list: option values, None for options that must be priced one by one
+
+    """
+
+    accepted, arrays = trade_arrays(input_dicts)
+
+    groups = {}
+    for k, position in enumerate(accepted):
+        try:
+            engineParameters = input_dicts[position]["engineParameters"]
+            random_source = engineParameters["random_source"]
+            if random_source == "pseudorandom":
+                # as in european_options, which reads both and never requiredSamples
+                settings = (random_source, int(engineParameters["seed"]), None,
+                            float(engineParameters["requiredTolerance"]))
+            elif random_source == "lowdiscrepancy":
+                settings = (random_source, int(engineParameters.get("seed", 0)),
+                            int(engineParameters["requiredSamples"]), None)
+            else:
+                continue
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        market = tuple(arrays[field][k] for field in ["riskFreeRate", "maturity", "dividendYield", "volatility"])
+        groups.setdefault(market + settings, []).append(k)
+
+    results = [None] * len(input_dicts)
+    for key, members in groups.items():
+        members = np.array(members)
+        random_source, seed, requiredSamples, requiredTolerance = key[4:]
+        values, errors, samples = monte_carlo_calls(
+            arrays["underlying"][members],
+            arrays["payoff"][members],
+            *key[:4],
+            random_source,
+            seed=seed,
+            requiredSamples=requiredSamples,
+            requiredTolerance=requiredTolerance,
+        )
+        print("MC path set {}: {} options, {} paths, max standard error {}".format(
+            key, len(members), samples, errors.max()))
+
+        for k, value in zip(members, values.tolist()):
+            if not np.isnan(value):
+                results[accepted[k]] = value
+
+    return results
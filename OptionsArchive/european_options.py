@@ -2,36 +2,66 @@
 # SPDX-License-Identifier: Apache-2.0
 # Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
 
+import traceback
+
+import numpy as np
 import QuantLib as ql
 
-from ql_common import construct_date, init_heston_model
+from batch_common import TRADE_FIELDS, trade_arrays
+from european_batch import CALL, IMPLIED_MAX_ITERATIONS, IMPLIED_MAX_VOL, IMPLIED_MIN_VOL, implied_volatility
+from ql_common import MARKET_DATA_CACHE, construct_date, init_heston_model, set_evaluation_date
+
+# volatility of the market objects used by the QuantLib fallback for quotes
+# without one, impliedVolatility replaces it by its own search
+PLACEHOLDER_VOLATILITY = 0.2
 
 
 def evaluate_european_option(input_dict):
 
     tparams = input_dict["tradeParameters"]
 
-    # Option Construction
     todaysDate = construct_date(tparams["evaluationDate"])
-    ql.Settings.instance().evaluationDate = todaysDate
+    set_evaluation_date(todaysDate)
+
+    # Market Data
+    marketData = MARKET_DATA_CACHE.get(todaysDate, tparams)
+
+    option = build_european_option(input_dict, marketData)
+
+    value = option.NPV()
+    return value
+
 
+def build_european_option(input_dict, marketData):
+    """
+    Constructs a European call with its pricing engine on the given market objects
+
+    The option keeps observing the market objects, so it is repriced by
+    calling NPV() again after changing them.
+
+    Args:
+        dict: input_dict, option in the batch_processor input format
+        dict: marketData, underlying, dividendYield, riskFreeRate and process,
+            as returned by MarketDataCache.get
+
+    Returns:
+        ql.VanillaOption
+
+    """
+
+    tparams = input_dict["tradeParameters"]
+
+    # Option Construction
     exercise = ql.EuropeanExercise(construct_date(tparams["exerciseDate"]))
     payoff = ql.PlainVanillaPayoff(ql.Option.Call, tparams["payoff"])
 
     option = ql.VanillaOption(payoff, exercise)
 
     # Market Data
-    underlying = ql.SimpleQuote(tparams["underlying"])
-    dividendYield = ql.FlatForward(todaysDate, tparams["dividendYield"], ql.Actual365Fixed())
-    volatility = ql.BlackConstantVol(todaysDate, ql.TARGET(), tparams["volatility"], ql.Actual365Fixed())
-    riskFreeRate = ql.FlatForward(todaysDate, tparams["riskFreeRate"], ql.Actual365Fixed())
-
-    process = ql.BlackScholesMertonProcess(
-        ql.QuoteHandle(underlying),
-        ql.YieldTermStructureHandle(dividendYield),
-        ql.YieldTermStructureHandle(riskFreeRate),
-        ql.BlackVolTermStructureHandle(volatility),
-    )
+    underlying = marketData["underlying"]
+    dividendYield = marketData["dividendYield"]
+    riskFreeRate = marketData["riskFreeRate"]
+    process = marketData["process"]
 
     hestonModel = init_heston_model(input_dict, riskFreeRate, dividendYield, underlying)
 
@@ -86,5 +116,95 @@ def evaluate_european_option(input_dict):
     else:
         raise Exception("Unimplemented engineName [{}]".format(input_dict["engineName"]))
 
-    value = option.NPV()
-    return value
+    return option
+
+
+def implied_volatility_quantlib(input_dict, price, accuracy=1.0e-8, maxEvaluations=IMPLIED_MAX_ITERATIONS,
+                                minVol=IMPLIED_MIN_VOL, maxVol=IMPLIED_MAX_VOL):
+    """
+    Implied volatility of a European call quote from QuantLib's VanillaOption.impliedVolatility
+
+    Args:
+        dict: input_dict, option in the batch_processor input format, its
+            volatility is not needed
+        float: price
+        float: accuracy, on the volatility
+        int: maxEvaluations
+        float: minVol, maxVol, bounds of the search
+
+    Returns:
+        float: implied volatility
+
+    """
+
+    tparams = input_dict["tradeParameters"]
+
+    todaysDate = construct_date(tparams["evaluationDate"])
+    set_evaluation_date(todaysDate)
+
+    marketData = MARKET_DATA_CACHE.get(todaysDate, dict({"volatility": PLACEHOLDER_VOLATILITY}, **tparams))
+
+    exercise = ql.EuropeanExercise(construct_date(tparams["exerciseDate"]))
+    payoff = ql.PlainVanillaPayoff(ql.Option.Call, tparams["payoff"])
+    option = ql.VanillaOption(payoff, exercise)
+
+    return option.impliedVolatility(float(price), marketData["process"], accuracy, maxEvaluations, minVol, maxVol)
+
+
+def implied_volatilities(input_dicts, prices, accuracy=1.0e-8, maxIterations=IMPLIED_MAX_ITERATIONS,
+                         minVol=IMPLIED_MIN_VOL, maxVol=IMPLIED_MAX_VOL):
+    """
+    Implied volatilities of a batch of European call quotes
+
+    The inverse of evaluate_european_option with AnalyticEuropeanEngine: the
+    quotes with flat-market trade parameters are solved together by
+    european_batch.implied_volatility, and the ones it leaves unsolved go
+    through QuantLib's impliedVolatility one by one.
+
+    Args:
+        list: input_dicts, options in the batch_processor input format, their
+            volatility and engine are not needed
+        list: prices, one quoted price per option
+        float: accuracy, on the volatility
+        int: maxIterations
+        float: minVol, maxVol, bounds of the search
+
+    Returns:
+        list: implied volatilities, or strings describing the error for
+        quotes that QuantLib could not solve either
+
+    """
+
+    prices = np.asarray(prices, dtype=np.float64)
+    accepted, arrays = trade_arrays(input_dicts, [field for field in TRADE_FIELDS if field != "volatility"])
+    volatilities = implied_volatility(
+        CALL,
+        prices[accepted],
+        arrays["underlying"],
+        arrays["payoff"],
+        arrays["dividendYield"],
+        arrays["riskFreeRate"],
+        arrays["maturity"],
+        accuracy,
+        maxIterations,
+        minVol,
+        maxVol,
+    )
+
+    results = [None] * len(input_dicts)
+    for position, volatility in zip(accepted, volatilities.tolist()):
+        if not np.isnan(volatility):
+            results[position] = volatility
+
+    for position, result in enumerate(results):
+        if result is not None:
+            continue
+        try:
+            results[position] = implied_volatility_quantlib(input_dicts[position], prices[position], accuracy,
+                                                            maxIterations, minVol, maxVol)
+        except Exception as e:
+            print(e)
+            results[position] = f"Error in processing option [{input_dicts[position]}] error: [{e}] " \
+                                f"trace: [{traceback.format_exc()}]"
+
+    return results
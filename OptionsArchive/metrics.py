@@ -0,0 +1,191 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import heapq
+import itertools
+import math
+import time
+
+import numpy as np
+
+# upper edges of the wall time histogram buckets, four per decade from 1us to 1000s
+HISTOGRAM_EDGES = [10.0 ** (k / 4.0) for k in range(-24, 13)]
+
+PERCENTILES = [50, 90, 99]
+
+# slowest options kept with their full description
+SLOWEST_OPTIONS = 10
+
+# namespace of the CloudWatch embedded metric format records
+EMF_NAMESPACE = "OptionsArchive"
+
+# CloudWatch accepts at most 100 distinct values per metric in one record
+EMF_MAX_VALUES = 100
+
+
+def _engine_key(option):
+    try:
+        return str(option["exercise"]), str(option["engineName"])
+    except (KeyError, TypeError):
+        return "unknown", "unknown"
+
+
+class Metrics:
+    """
+    Per-option timings of a portfolio, aggregated by exercise and engine
+
+    Recording an option appends its wall and CPU seconds to the lists of
+    its engine and bumps a few counters, about a microsecond per option, so
+    it is meant to stay on. Percentiles and histograms are only computed by
+    summary(). Options priced together by a vectorized pricer are recorded
+    with an equal share of their group's time.
+
+    """
+
+    def __init__(self, slowest=SLOWEST_OPTIONS):
+        self.engines = {}
+        self.slowest = []
+        self.slowest_size = slowest
+        self.counter = itertools.count()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def _engine(self, option):
+        key = _engine_key(option)
+        engine = self.engines.get(key)
+        if engine is None:
+            engine = self.engines[key] = {"wall": [], "cpu": [], "errors": 0, "cacheHits": 0, "batched": 0}
+        return engine
+
+    def record(self, option, wall, cpu, cache_hit=False, error=False, batched=False):
+        engine = self._engine(option)
+        engine["wall"].append(wall)
+        engine["cpu"].append(cpu)
+        engine["errors"] += error
+        engine["cacheHits"] += cache_hit
+        engine["batched"] += batched
+
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, (wall, next(self.counter), option))
+        elif wall > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (wall, next(self.counter), option))
+
+    def record_batch(self, options, wall, cpu):
+        if options:
+            for option in options:
+                self.record(option, wall / len(options), cpu / len(options), batched=True)
+
+    def merge(self, other):
+        for key, engine in other.engines.items():
+            mine = self.engines.setdefault(key, {"wall": [], "cpu": [], "errors": 0, "cacheHits": 0, "batched": 0})
+            for field in ["wall", "cpu"]:
+                mine[field].extend(engine[field])
+            for field in ["errors", "cacheHits", "batched"]:
+                mine[field] += engine[field]
+        for wall, _, option in other.slowest:
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, (wall, next(self.counter), option))
+            elif wall > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (wall, next(self.counter), option))
+
+    def summary(self):
+        """
+        Counts, totals, percentiles and wall time histograms per engine
+
+        Returns:
+            dict: JSON serializable summary
+
+        """
+
+        engines = []
+        for (exercise, engineName), engine in sorted(self.engines.items()):
+            wall = np.array(engine["wall"])
+            counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES, wall), minlength=len(HISTOGRAM_EDGES) + 1)
+            row = {
+                "exercise": exercise,
+                "engineName": engineName,
+                "options": len(wall),
+                "errors": engine["errors"],
+                "cacheHits": engine["cacheHits"],
+                "batched": engine["batched"],
+                "wallSeconds": float(wall.sum()),
+                "cpuSeconds": float(np.sum(engine["cpu"])),
+                "maxWallSeconds": float(wall.max()) if len(wall) else 0.0,
+                # [upper edge in seconds, options], only the buckets that are used
+                "histogram": [
+                    [HISTOGRAM_EDGES[k] if k < len(HISTOGRAM_EDGES) else math.inf, int(count)]
+                    for k, count in enumerate(counts) if count
+                ],
+            }
+            for percentile, value in zip(PERCENTILES, np.percentile(wall, PERCENTILES) if len(wall) else
+                                         [0.0] * len(PERCENTILES)):
+                row["p{}WallSeconds".format(percentile)] = float(value)
+            engines.append(row)
+
+        engines.sort(key=lambda row: row["wallSeconds"], reverse=True)
+        return {
+            "options": sum(row["options"] for row in engines),
+            "wallSeconds": time.perf_counter() - self.wall_start,
+            "cpuSeconds": time.process_time() - self.cpu_start,
+            "engines": engines,
+            "slowest": [{"wallSeconds": wall, "option": option} for wall, _, option in sorted(self.slowest,
+                                                                                             reverse=True)],
+        }
+
+    def emf(self, properties=None, namespace=EMF_NAMESPACE):
+        """
+        CloudWatch embedded metric format records, one per engine
+
+        Printed to a log stream that CloudWatch Logs extracts metrics from
+        (Lambda, or the CloudWatch agent), each record becomes Options,
+        Errors, CacheHits and CpuSeconds metrics and a WallSeconds
+        distribution, with Exercise and Engine dimensions.
+
+        Args:
+            dict: properties, extra fields attached to every record, e.g. the chunk name
+            string: namespace
+
+        Returns:
+            list: records, JSON serializable
+
+        """
+
+        timestamp = int(time.time() * 1000)
+        records = []
+        for (exercise, engineName), engine in sorted(self.engines.items()):
+            # the histogram buckets as a distribution, their geometric centres as values
+            counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES, engine["wall"]),
+                                 minlength=len(HISTOGRAM_EDGES) + 1)
+            edges = [HISTOGRAM_EDGES[0] / 10.0 ** 0.25] + HISTOGRAM_EDGES + [HISTOGRAM_EDGES[-1] * 10.0 ** 0.25]
+            used = np.flatnonzero(counts)[:EMF_MAX_VALUES]
+
+            record = dict(properties or {})
+            record.update({
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": namespace,
+                        "Dimensions": [["Exercise", "Engine"]],
+                        "Metrics": [
+                            {"Name": "Options", "Unit": "Count"},
+                            {"Name": "Errors", "Unit": "Count"},
+                            {"Name": "CacheHits", "Unit": "Count"},
+                            {"Name": "CpuSeconds", "Unit": "Seconds"},
+                            {"Name": "WallSeconds", "Unit": "Seconds"},
+                        ],
+                    }],
+                },
+                "Exercise": exercise,
+                "Engine": engineName,
+                "Options": len(engine["wall"]),
+                "Errors": engine["errors"],
+                "CacheHits": engine["cacheHits"],
+                "CpuSeconds": float(np.sum(engine["cpu"])),
+                "WallSeconds": {
+                    "Values": [math.sqrt(edges[k] * edges[k + 1]) for k in used.tolist()],
+                    "Counts": counts[used].tolist(),
+                },
+            })
+            records.append(record)
+        return records
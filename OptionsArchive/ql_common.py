@@ -2,6 +2,9 @@
 # SPDX-License-Identifier: Apache-2.0
 # Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
 
+import time
+from collections import OrderedDict
+
 import QuantLib as ql
 
 
@@ -28,6 +31,22 @@ def construct_date(date_string):
     return ql_date
 
 
+def set_evaluation_date(todaysDate):
+    """
+    Sets the global evaluation date, skipping the assignment when unchanged
+
+    Every assignment notifies all observers of the evaluation date, so
+    pricing options sorted by date only pays for it once per date.
+
+    Args:
+        ql.Date: todaysDate
+
+    """
+
+    if ql.Settings.instance().evaluationDate != todaysDate:
+        ql.Settings.instance().evaluationDate = todaysDate
+
+
 def init_heston_model(option_dict, riskFreeRate, dividendYield, underlying):
     """
     Converts string to ql.Date object
@@ -56,3 +75,96 @@ def init_heston_model(option_dict, riskFreeRate, dividendYield, underlying):
         return hestonModel
     else:
         return None
+
+
+class MarketDataCache:
+    """
+    Bounded LRU cache of flat Black-Scholes market objects
+
+    Entries are keyed by the evaluation date and the flat market parameters,
+    so every option sharing them reuses the same SimpleQuote, FlatForward
+    curves, BlackConstantVol and BlackScholesMertonProcess. The objects are
+    never mutated after construction, which keeps sharing them safe.
+
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def get(self, todaysDate, tparams):
+        """
+        Returns the market objects for an option, building them on a miss
+
+        Args:
+            ql.Date: todaysDate, the evaluation date
+            dict: tparams, the option's tradeParameters
+
+        Returns:
+            dict: underlying, dividendYield, volatility, riskFreeRate, process
+
+        """
+
+        key = (
+            todaysDate.serialNumber(),
+            float(tparams["underlying"]),
+            float(tparams["dividendYield"]),
+            float(tparams["volatility"]),
+            float(tparams["riskFreeRate"]),
+        )
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.seconds_saved += entry["seconds"]
+            return entry
+
+        start = time.perf_counter()
+        underlying = ql.SimpleQuote(key[1])
+        dividendYield = ql.FlatForward(todaysDate, key[2], ql.Actual365Fixed())
+        volatility = ql.BlackConstantVol(todaysDate, ql.TARGET(), key[3], ql.Actual365Fixed())
+        riskFreeRate = ql.FlatForward(todaysDate, key[4], ql.Actual365Fixed())
+
+        process = ql.BlackScholesMertonProcess(
+            ql.QuoteHandle(underlying),
+            ql.YieldTermStructureHandle(dividendYield),
+            ql.YieldTermStructureHandle(riskFreeRate),
+            ql.BlackVolTermStructureHandle(volatility),
+        )
+
+        entry = {
+            "underlying": underlying,
+            "dividendYield": dividendYield,
+            "volatility": volatility,
+            "riskFreeRate": riskFreeRate,
+            "process": process,
+            "seconds": time.perf_counter() - start,
+        }
+
+        self.misses += 1
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "secondsSaved": self.seconds_saved,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+
+# shared by european_options and american_options
+MARKET_DATA_CACHE = MarketDataCache()
@@ -0,0 +1,199 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import hashlib
+import json
+import sqlite3
+import time
+
+import QuantLib as ql
+
+# engines whose result depends on the random numbers drawn
+MONTE_CARLO_ENGINES = ["MCEuropeanEngine"]
+
+# how a value was priced, the vectorized pricers do not reproduce QuantLib's
+# numbers exactly: their FD grids, trees and Monte Carlo paths differ
+QUANTLIB = "QuantLib"
+VECTORIZED = "vectorized"
+
+
+def _canonical(value):
+    # 100 and 100.0 describe the same trade, json would tell them apart
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def option_key(option, pricer=QUANTLIB):
+    """
+    Content hash of everything that determines an option's value
+
+    Args:
+        dict: option in the batch_processor input format
+        string: pricer, QUANTLIB or VECTORIZED, whichever prices the option
+
+    Returns:
+        string: hex digest
+
+    """
+
+    content = {
+        "QuantLib": ql.__version__,
+        "pricer": pricer,
+        "exercise": option["exercise"],
+        "engineName": option["engineName"],
+        "engineParameters": _canonical(option.get("engineParameters") or {}),
+        "tradeParameters": _canonical(option["tradeParameters"]),
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(option):
+    """
+    Whether pricing the option twice is guaranteed to give the same value
+
+    Low discrepancy Monte Carlo always draws the same Sobol points, pseudorandom
+    results are only deterministic when a fixed, non-zero seed is given,
+    QuantLib seeds from the clock otherwise.
+
+    Args:
+        dict: option in the batch_processor input format
+
+    Returns:
+        bool
+
+    """
+
+    try:
+        if option["engineName"] not in MONTE_CARLO_ENGINES:
+            return True
+        engineParameters = option.get("engineParameters") or {}
+        if engineParameters.get("random_source") == "lowdiscrepancy":
+            return True
+        seed = engineParameters.get("seed")
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+    return isinstance(seed, int) and not isinstance(seed, bool) and seed != 0
+
+
+class ResultCache:
+    """
+    Persistent store of option values keyed by option_key, backed by SQLite
+
+    Entries older than max_age seconds are ignored and evicted, and once the
+    store holds more than max_entries the oldest entries are evicted first.
+
+    """
+
+    def __init__(self, path, max_age=7 * 24 * 3600, max_entries=1000000):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value REAL NOT NULL, created REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+        self.evict()
+
+    def _select(self, keys):
+        found = {}
+        oldest = time.time() - self.max_age
+        unique = list(set(keys))
+        # stay below SQLite's limit on the number of host parameters
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self.connection.execute(
+                "SELECT key, value FROM results WHERE created >= ? AND key IN ({})".format(",".join("?" * len(batch))),
+                [oldest] + batch,
+            )
+            found.update(rows)
+        return found
+
+    def get_many(self, keys):
+        """
+        Looks up several keys at once
+
+        Args:
+            list: keys
+
+        Returns:
+            dict: value by key, for the keys that were found
+
+        """
+
+        found = self._select(keys)
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get_first(self, candidates):
+        """
+        Looks up several options at once, each under one or more keys
+
+        Args:
+            list: candidates, for every option the keys its value may be
+                stored under, in order of preference
+
+        Returns:
+            list: value of the first key found for every option, None when
+            none is
+
+        """
+
+        found = self._select([key for keys in candidates for key in keys])
+        values = [next((found[key] for key in keys if key in found), None) for keys in candidates]
+
+        self.hits += sum(1 for value in values if value is not None)
+        self.misses += sum(1 for value in values if value is None)
+        return values
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        Stores several values at once
+
+        Args:
+            list: (key, value) pairs
+
+        """
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items],
+            )
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def evict(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age,))
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.evict()
+        self.connection.close()
@@ -0,0 +1,245 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# results written, or seconds passed, between flushes of the JSON Lines file
+FLUSH_RESULTS = 100
+FLUSH_SECONDS = 5.0
+
+# bytes per multipart upload part, S3 needs at least 5 MiB for all but the last
+PART_SIZE = 8 << 20
+
+# suffix of the object holding what an upload has not put in a part yet, and
+# the seconds between its puts, each of which uploads up to PART_SIZE again
+PROGRESS_SUFFIX = ".progress"
+PROGRESS_SECONDS = 5.0
+
+
+def read_results_jsonl(path):
+    """
+    Reads the results of a JSON Lines result file, keyed by position in the portfolio
+
+    A last line cut short by a job that died while writing it is ignored.
+
+    Args:
+        string: path
+
+    Returns:
+        dict: position -> value or error string
+
+    """
+
+    results = {}
+    with open(path, 'rb') as infile:
+        for line in infile:
+            if not line.endswith(b'\n'):
+                break
+            record = json.loads(line)
+            results[record["index"]] = record["result"]
+    return results
+
+
+def _truncate_partial_line(path):
+    # drop the bytes after the last complete line so that appends start clean
+    with open(path, 'rb+') as outfile:
+        data = outfile.read()
+        outfile.truncate(data.rfind(b'\n') + 1)
+
+
+class S3MultipartUpload:
+    """
+    Uploads a growing local file to S3 part by part as it is written
+
+    update() uploads every full PART_SIZE part the file has grown by, and
+    puts the rest, too short for a part, in a <key>.progress object along
+    with its offset in the file, at most every progress_seconds. However
+    small the file, a job that dies only loses what it wrote since then.
+    complete() uploads the remainder as the last part, completes the
+    upload and removes the progress object. An upload that is never
+    completed can be picked up by recover().
+
+    """
+
+    def __init__(self, bucket, key, part_size=PART_SIZE, s3=None, progress_seconds=PROGRESS_SECONDS):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.progress_seconds = progress_seconds
+        self.s3 = s3 or boto3.client('s3')
+        self.upload_id = None
+        self.parts = []
+        self.uploaded = 0
+        # (offset, size) of the progress object last put, and when
+        self.progress = None
+        self.progress_time = None
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.uploaded += len(data)
+
+    def update(self, path):
+        with open(path, 'rb') as infile:
+            infile.seek(self.uploaded)
+            while True:
+                data = infile.read(self.part_size)
+                if len(data) < self.part_size:
+                    break
+                self._upload_part(data)
+
+        now = time.monotonic()
+        if self.progress == (self.uploaded, len(data)):
+            return
+        if self.progress_time is not None and now - self.progress_time < self.progress_seconds:
+            return
+        self.s3.put_object(Bucket=self.bucket, Key=self.key + PROGRESS_SUFFIX, Body=data,
+                           Metadata={"offset": str(self.uploaded)})
+        self.progress = (self.uploaded, len(data))
+        self.progress_time = now
+
+    def _delete_progress(self):
+        if self.progress is not None:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.key + PROGRESS_SUFFIX)
+            self.progress = None
+
+    def complete(self, path):
+        with open(path, 'rb') as infile:
+            infile.seek(self.uploaded)
+            data = infile.read()
+
+        if self.upload_id is None:
+            # small enough that it never needed a multipart upload
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=data)
+        else:
+            if data:
+                self._upload_part(data)
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+            )
+        self._delete_progress()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self._delete_progress()
+
+    @staticmethod
+    def recover(bucket, key, path, s3=None):
+        """
+        Fetches what an earlier job uploaded to key, so that it can be resumed
+
+        Uploads left incomplete by a job that died are completed with the
+        parts they have, or aborted when they have none, the resulting
+        object is downloaded to path and the bytes of the progress object
+        that follow it are appended.
+
+        Args:
+            string: bucket, key
+            string: path, local file to download to
+
+        Returns:
+            bool: whether anything was recovered
+
+        """
+
+        s3 = s3 or boto3.client('s3')
+        uploads = [
+            upload
+            for page in s3.get_paginator('list_multipart_uploads').paginate(Bucket=bucket, Prefix=key)
+            for upload in page.get("Uploads", [])
+        ]
+        for upload in sorted((u for u in uploads if u["Key"] == key), key=lambda u: u["Initiated"]):
+            parts = [
+                part
+                for page in s3.get_paginator('list_parts').paginate(Bucket=bucket, Key=key, UploadId=upload["UploadId"])
+                for part in page.get("Parts", [])
+            ]
+            if parts:
+                s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload["UploadId"], MultipartUpload={
+                    "Parts": [{"ETag": part["ETag"], "PartNumber": part["PartNumber"]} for part in parts]
+                })
+            else:
+                s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload["UploadId"])
+
+        try:
+            s3.download_file(bucket, key, path)
+            size = os.path.getsize(path)
+        except ClientError:
+            size = None
+
+        try:
+            progress = s3.get_object(Bucket=bucket, Key=key + PROGRESS_SUFFIX)
+        except ClientError:
+            return size is not None
+        data = progress["Body"].read()
+        skip = (size or 0) - int(progress["Metadata"]["offset"])
+
+        # the progress object continues the parts its upload had when it was put
+        if 0 <= skip <= len(data):
+            with open(path, 'ab' if size is not None else 'wb') as outfile:
+                outfile.write(data[skip:])
+            return True
+        return size is not None
+
+
+class JsonLinesResultWriter:
+    """
+    Appends results to a JSON Lines file as options complete
+
+    Every line is {"index": position in the portfolio, "result": value or
+    error string}, in completion order. The file is flushed every
+    flush_results results or flush_seconds seconds, and handed to an
+    optional S3MultipartUpload at every flush, so a job that dies loses at
+    most the results since the last flush that reached S3. With resume, an existing file is
+    kept and the positions it already holds are available as done.
+
+    """
+
+    def __init__(self, path, resume=False, upload=None, flush_results=FLUSH_RESULTS, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.upload = upload
+        self.flush_results = flush_results
+        self.flush_seconds = flush_seconds
+
+        self.done = {}
+        if resume and os.path.exists(path):
+            _truncate_partial_line(path)
+            self.done = read_results_jsonl(path)
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, index, result):
+        self.file.write(json.dumps({"index": index, "result": result}) + '\n')
+        self.unflushed += 1
+        if self.unflushed >= self.flush_results or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        if self.upload is not None:
+            self.upload.update(self.path)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.upload is not None:
+            self.upload.complete(self.path)
@@ -0,0 +1,235 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+import itertools
+import traceback
+
+import QuantLib as ql
+
+from american_options import build_american_option
+from engine_selection import resolve_option
+from european_options import build_european_option
+from ql_common import construct_date, set_evaluation_date
+
+BASE_SCENARIO = {"name": "base", "spotShift": 0.0, "volShift": 0.0, "rateShift": 0.0}
+
+
+def scenario_ladder(spotShifts=(), volShifts=(), rateShifts=()):
+    """
+    Every combination of spot, volatility and rate shifts, base scenario first
+
+    Args:
+        list: spotShifts, relative, 0.01 moves the underlying up 1%
+        list: volShifts, absolute, 0.0001 moves the volatility up 1bp
+        list: rateShifts, absolute, 0.0001 moves the risk free rate up 1bp
+
+    Returns:
+        list: scenarios
+
+    """
+
+    scenarios = []
+    for spotShift, volShift, rateShift in itertools.product(
+        [0.0] + [x for x in spotShifts if x != 0.0],
+        [0.0] + [x for x in volShifts if x != 0.0],
+        [0.0] + [x for x in rateShifts if x != 0.0],
+    ):
+        scenarios.append({
+            "name": "spot{:+g}/vol{:+g}/rate{:+g}".format(spotShift, volShift, rateShift),
+            "spotShift": spotShift,
+            "volShift": volShift,
+            "rateShift": rateShift,
+        })
+
+    scenarios[0] = dict(BASE_SCENARIO)
+    return scenarios
+
+
+def load_scenarios(spec):
+    """
+    Scenarios from a list of scenarios, or from a dict of scenario_ladder shifts
+
+    Args:
+        list or dict: spec, e.g. {"spotShifts": [-0.01, 0.01], "volShifts": [0.01]}
+
+    Returns:
+        list: scenarios
+
+    """
+
+    if isinstance(spec, dict):
+        return scenario_ladder(spec.get("spotShifts", ()), spec.get("volShifts", ()), spec.get("rateShifts", ()))
+    return [dict(BASE_SCENARIO, **scenario) for scenario in spec]
+
+
+class ScenarioMarket:
+    """
+    Flat Black-Scholes market objects driven by SimpleQuotes
+
+    Built like the entries of ql_common.MarketDataCache, except that spot,
+    volatility and risk free rate sit behind quotes, so that every option
+    built on the market is repriced under a scenario by setting the quotes
+    rather than by being rebuilt.
+
+    """
+
+    def __init__(self, todaysDate, tparams):
+        self.spot = float(tparams["underlying"])
+        self.vol = float(tparams["volatility"])
+        self.rate = float(tparams["riskFreeRate"])
+
+        self.underlying = ql.SimpleQuote(self.spot)
+        self.volQuote = ql.SimpleQuote(self.vol)
+        self.rateQuote = ql.SimpleQuote(self.rate)
+
+        dividendYield = ql.FlatForward(todaysDate, float(tparams["dividendYield"]), ql.Actual365Fixed())
+        volatility = ql.BlackConstantVol(todaysDate, ql.TARGET(), ql.QuoteHandle(self.volQuote), ql.Actual365Fixed())
+        riskFreeRate = ql.FlatForward(todaysDate, ql.QuoteHandle(self.rateQuote), ql.Actual365Fixed())
+
+        self.marketData = {
+            "underlying": self.underlying,
+            "dividendYield": dividendYield,
+            "volatility": volatility,
+            "riskFreeRate": riskFreeRate,
+            "process": ql.BlackScholesMertonProcess(
+                ql.QuoteHandle(self.underlying),
+                ql.YieldTermStructureHandle(dividendYield),
+                ql.YieldTermStructureHandle(riskFreeRate),
+                ql.BlackVolTermStructureHandle(volatility),
+            ),
+        }
+
+    def apply(self, scenario):
+        self.underlying.setValue(self.spot * (1.0 + scenario.get("spotShift", 0.0)))
+        self.volQuote.setValue(self.vol + scenario.get("volShift", 0.0))
+        self.rateQuote.setValue(self.rate + scenario.get("rateShift", 0.0))
+
+
+def _error(option, e):
+    print(e)
+    return f"Error in processing option [{option}] error: [{e}] trace: [{traceback.format_exc()}]"
+
+
+def _build(input_dict, market):
+    input_dict, _ = resolve_option(input_dict)
+    if input_dict["exercise"] == "European":
+        return build_european_option(input_dict, market.marketData)
+    elif input_dict["exercise"] == "American":
+        return build_american_option(input_dict, market.marketData)
+    else:
+        raise Exception("Can not evaluate, exercise type is not supported: {}".format(input_dict["exercise"]))
+
+
+def price_scenarios(portfolio, scenarios):
+    """
+    Prices every option of a portfolio under every scenario
+
+    Options are grouped by evaluation date. Within a date every option and
+    its pricing engine is built once, on a ScenarioMarket shared with the
+    other options of the same market, and each scenario only sets the market
+    quotes and calls NPV() again.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        list: scenarios, dicts with spotShift, volShift and rateShift
+
+    Returns:
+        list: scenario x trade matrix of values, or strings describing the
+        error for options that could not be priced
+
+    """
+
+    matrix = [[None] * len(portfolio) for _ in scenarios]
+
+    buckets = {}
+    for i, input_dict in enumerate(portfolio):
+        try:
+            date = input_dict["tradeParameters"]["evaluationDate"]
+            buckets.setdefault(str(date), []).append(i)
+        except Exception as e:
+            for row in matrix:
+                row[i] = _error(input_dict, e)
+
+    for positions in buckets.values():
+        markets = {}
+        options = {}
+        for i in positions:
+            input_dict = portfolio[i]
+            print("building " + str(input_dict))
+            try:
+                tparams = input_dict["tradeParameters"]
+                todaysDate = construct_date(tparams["evaluationDate"])
+                set_evaluation_date(todaysDate)
+
+                key = tuple(float(tparams[field]) for field in
+                            ["underlying", "dividendYield", "volatility", "riskFreeRate"])
+                if key not in markets:
+                    markets[key] = ScenarioMarket(todaysDate, tparams)
+                options[i] = _build(input_dict, markets[key])
+            except Exception as e:
+                for row in matrix:
+                    row[i] = _error(input_dict, e)
+
+        for s, scenario in enumerate(scenarios):
+            for market in markets.values():
+                market.apply(scenario)
+            for i, option in options.items():
+                try:
+                    matrix[s][i] = option.NPV()
+                except Exception as e:
+                    matrix[s][i] = _error(portfolio[i], e)
+
+        for market in markets.values():
+            market.apply(BASE_SCENARIO)
+
+    return matrix
+
+
+def greeks(portfolio, spotBump=0.01, volBump=0.01, rateBump=0.0001):
+    """
+    Finite difference delta, gamma, vega and rho of every option
+
+    Central differences over one price_scenarios run of seven scenarios.
+    Vega and rho are per unit of volatility and rate.
+
+    Args:
+        list: portfolio, options in the batch_processor input format
+        float: spotBump, relative
+        float: volBump, rateBump, absolute
+
+    Returns:
+        list: dicts with value, delta, gamma, vega and rho, or error strings
+
+    """
+
+    scenarios = [
+        dict(BASE_SCENARIO),
+        {"name": "spotUp", "spotShift": spotBump},
+        {"name": "spotDown", "spotShift": -spotBump},
+        {"name": "volUp", "volShift": volBump},
+        {"name": "volDown", "volShift": -volBump},
+        {"name": "rateUp", "rateShift": rateBump},
+        {"name": "rateDown", "rateShift": -rateBump},
+    ]
+    matrix = price_scenarios(portfolio, scenarios)
+
+    results = []
+    for i, input_dict in enumerate(portfolio):
+        column = [row[i] for row in matrix]
+        errors = [value for value in column if isinstance(value, str)]
+        if errors:
+            results.append(errors[0])
+            continue
+
+        base, spotUp, spotDown, volUp, volDown, rateUp, rateDown = column
+        h = float(input_dict["tradeParameters"]["underlying"]) * spotBump
+        results.append({
+            "value": base,
+            "delta": (spotUp - spotDown) / (2.0 * h),
+            "gamma": (spotUp - 2.0 * base + spotDown) / (h * h),
+            "vega": (volUp - volDown) / (2.0 * volBump),
+            "rho": (rateUp - rateDown) / (2.0 * rateBump),
+        })
+
+    return results
@@ -1,44 +1,250 @@
+import argparse
+import codecs
 import json
+import os
 import boto3
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import columnar
+from cost_model import pack
 
 s3 = boto3.client('s3')
 
+# estimated QuantLib time per chunk when the event doesn't set target_seconds
+DEFAULT_TARGET_SECONDS = 60.0
+
+# options per chunk when the event doesn't set max_chunk_size. Cheap options
+# would otherwise fill a chunk by the hundred thousand, and pack holds up to
+# OPEN_CHUNKS chunks at once, so this is what bounds the memory of the options
+# being packed
+DEFAULT_MAX_CHUNK_SIZE = 5000
+
+# bytes read from the portfolio at a time
+READ_SIZE = 1 << 20
+
+# concurrent uploads, and bytes of chunks serialized but not yet uploaded,
+# which bound the memory held by the upload side
+UPLOAD_THREADS = 8
+MAX_IN_FLIGHT_BYTES = 64 << 20
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yields the elements of a top level JSON array one at a time
+
+    The stream is read read_size bytes at a time and only the elements not
+    yet yielded are kept, so memory stays bounded by the largest element
+    rather than by the size of the file. Elements must be separated by
+    exactly one comma, anything else raises ValueError.
+
+    Args:
+        stream: binary file-like object with read(size), e.g. an S3 StreamingBody
+        int: read_size
+
+    Yields:
+        parsed array elements
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+    # what may come next: an element, or a separator after an element, and
+    # whether the array may close there
+    expect_element = True
+    may_close = True
+
+    while True:
+        # skip whitespace up to the next element or separator
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('portfolio must be a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                if not may_close:
+                    raise ValueError('portfolio array ends with a separator')
+                return
+            if buffer[position] == ',':
+                if expect_element:
+                    raise ValueError('missing portfolio element before separator')
+                expect_element = True
+                may_close = False
+                position += 1
+                continue
+            if not expect_element:
+                raise ValueError('missing separator between portfolio elements')
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # a number cut by the end of the buffer parses as a shorter one,
+                # only a following separator shows the element is complete
+                if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    yield element
+                    position = end
+                    expect_element = False
+                    may_close = True
+                    continue
+
+        if eof:
+            raise ValueError('unexpected end of portfolio')
+
+        data = stream.read(read_size)
+        eof = not data
+        buffer = buffer[position:] + utf8.decode(data, final=eof)
+        position = 0
+
+
+class ChunkWriter:
+    """
+    Writes chunk files to S3 or to a local directory from a pool of threads
+
+    At most max_in_flight_bytes of serialized chunks are queued or being
+    written at any time, write() blocks until enough of them complete beyond
+    that. A single chunk larger than the limit is written on its own.
+    """
+
+    def __init__(self, bucket, folder, output_format='json', threads=UPLOAD_THREADS,
+                 max_in_flight_bytes=MAX_IN_FLIGHT_BYTES):
+        self.bucket = bucket
+        self.folder = folder
+        self.output_format = output_format
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # future -> size of its body
+        self.in_flight = {}
+
+        if bucket is None:
+            os.makedirs(folder, exist_ok=True)
+
+    def _write(self, name, body):
+        path = self.folder + '/' + name
+        if self.bucket is None:
+            with open(path, 'wb') as outfile:
+                outfile.write(body)
+        else:
+            s3.put_object(Bucket=self.bucket, Key=path, Body=body)
+        print('uploaded: ' + path)
+        return path
+
+    def write(self, name, chunk):
+        if self.output_format == 'arrow':
+            body = columnar.portfolio_bytes(chunk)
+        else:
+            body = json.dumps(chunk).encode('utf-8')
+
+        while self.in_flight and sum(self.in_flight.values()) + len(body) > self.max_in_flight_bytes:
+            done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                del self.in_flight[future]
+                future.result()
+
+        future = self.executor.submit(self._write, name + '.' + self.output_format, body)
+        self.in_flight[future] = len(body)
+        return future
+
+    def close(self):
+        for future in self.in_flight:
+            future.result()
+        self.executor.shutdown()
+
+
+def split_portfolio(stream, writer, target_seconds, max_chunk_size=DEFAULT_MAX_CHUNK_SIZE, prefix='portfolio.json',
+                    arrow=False):
+    """
+    Streams a portfolio into chunk files of about target_seconds of pricing each
+
+    Args:
+        stream: binary file-like object holding the JSON or, when arrow is set,
+            Arrow IPC portfolio
+        ChunkWriter: writer
+        float: target_seconds
+        int: max_chunk_size, cap on the options per chunk, None for no cap
+        string: prefix of the chunk file names
+        bool: arrow
+
+    Returns:
+        list: paths of the chunk files, in the order they were cut
+    """
+
+    options = columnar.iter_portfolio(stream) if arrow else iter_json_array(stream)
+    futures = []
+    try:
+        for i, (chunk, seconds) in enumerate(pack(options, target_seconds, max_chunk_size)):
+            split_file_name = prefix + '_' + str(i)
+            print('{}: {} options, estimated {:.2f}s'.format(split_file_name, len(chunk), seconds))
+            futures.append(writer.write(split_file_name, chunk))
+    finally:
+        writer.close()
+
+    return [future.result() for future in futures]
+
 
 def lambda_handler(event, context):
-    # read parameteres from Step Functions
-    bucket = event['bucket_name']
+    # read parameteres from Step Functions; without a bucket_name the input
+    # file and output folder are local paths
+    bucket = event.get('bucket_name')
     input_file = event['input_file']
     output_folder = event['output_folder']
-    local_file = 'portfolio.json'
+    target_seconds = float(event.get('target_seconds', DEFAULT_TARGET_SECONDS))
+    max_chunk_size = event.get('max_chunk_size', DEFAULT_MAX_CHUNK_SIZE)
+    # chunks are written as JSON or as Arrow IPC streams, which batch_processor reads too
+    output_format = event.get('output_format', 'json')
+    arrow = columnar.is_arrow(input_file)
 
-    print('bucket:' + bucket)
+    print('bucket:' + str(bucket))
     print('input_file:' + input_file)
     print('output_folder:' + output_folder)
+    print('target_seconds:' + str(target_seconds))
+
+    start = time.time()
+    writer = ChunkWriter(bucket, output_folder + '/jobs', output_format)
 
-    # download main file containing the options to be processed
-    s3.download_file(bucket, input_file, '/tmp/' + local_file)
-    files_to_upload = []
-    files_to_upload_full_path = []
-
-    # split the main file in many small files, to allow parallel processing
-    with open('/tmp/' + local_file, 'r') as infile:
-        o = json.load(infile)
-        chunkSize = 10
-        for i in range(0, len(o), chunkSize):
-            split_file_name = local_file + '_' + str(i // chunkSize) + '.json'
-            with open('/tmp/' + split_file_name, 'w') as outfile:
-                json.dump(o[i:i + chunkSize], outfile)
-                files_to_upload.append(split_file_name)
-
-                # upload the splitted files to S3, to be processed by AWS Batch
-    print(files_to_upload)
-    for fl in files_to_upload:
-        print("uploading: " + fl)
-        resp = s3.upload_file('/tmp/' + fl, bucket, output_folder + '/jobs/' + fl)
-
-        files_to_upload_full_path.append(output_folder + '/jobs/' + fl)
-        print(resp)
+    # stream the main file containing the options to be processed, and upload
+    # chunks to be processed by AWS Batch as they are cut
+    if bucket is None:
+        with open(input_file, 'rb') as stream:
+            files_to_upload_full_path = split_portfolio(stream, writer, target_seconds, max_chunk_size, arrow=arrow)
+    else:
+        stream = s3.get_object(Bucket=bucket, Key=input_file)['Body']
+        try:
+            files_to_upload_full_path = split_portfolio(stream, writer, target_seconds, max_chunk_size, arrow=arrow)
+        finally:
+            stream.close()
+
+    print('{} chunks in {:.1f}s'.format(len(files_to_upload_full_path), time.time() - start))
 
     # return a list containing the splitted files to be processed
-    return files_to_upload_full_path
\ No newline at end of file
+    return files_to_upload_full_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--InputFile", type=str, required=True)
+    parser.add_argument("--OutputFolder", type=str, required=True)
+    parser.add_argument("--BucketName", type=str, default=None)
+    parser.add_argument("--TargetSeconds", type=float, default=DEFAULT_TARGET_SECONDS)
+    parser.add_argument("--MaxChunkSize", type=int, default=DEFAULT_MAX_CHUNK_SIZE)
+    parser.add_argument("--OutputFormat", type=str, choices=["json", "arrow"], default="json")
+    args = parser.parse_args()
+
+    print(json.dumps(lambda_handler({
+        "bucket_name": args.BucketName,
+        "input_file": args.InputFile,
+        "output_folder": args.OutputFolder,
+        "target_seconds": args.TargetSeconds,
+        "max_chunk_size": args.MaxChunkSize,
+        "output_format": args.OutputFormat,
+    }, None), indent=2))
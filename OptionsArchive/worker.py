@@ -0,0 +1,396 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 https://aws.amazon.com/apache-2-0/
+
+"""
+Long-running batch_processor worker
+
+Instead of a fresh batch_processor.py process per chunk, which pays for the
+interpreter, the QuantLib import, the boto3 clients and cold caches every
+time, a worker stays up and prices chunk after chunk as their keys arrive on
+an SQS queue, or as chunk files are dropped into a local directory. The
+market data cache, the result cache and the process pool stay warm between
+chunks, and each chunk's results are written as soon as it is priced.
+
+    python worker.py --QueueUrl <url> --BucketName <bucket> --OutputFolder <folder>
+    python worker.py --WatchDirectory <directory>
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+import traceback
+
+import boto3
+from botocore.exceptions import ClientError
+
+import columnar
+from batch_processor import price_portfolio, worker_pool
+from metrics import Metrics
+from ql_common import MARKET_DATA_CACHE
+from result_cache import ResultCache
+
+# longest SQS long poll, and the local directory's polling interval
+SQS_WAIT_SECONDS = 20
+POLL_SECONDS = 0.5
+
+# chunks received per SQS request
+SQS_BATCH = 1
+
+# seconds a received message stays hidden from other workers, extended every
+# third of it for as long as its chunk is being priced. Chunks are cut to about
+# a minute of pricing, twice SQS's default visibility timeout
+VISIBILITY_TIMEOUT = 120
+
+# deliveries of a chunk's message before a chunk that keeps failing is given
+# up on, rather than retried by a warm worker forever
+MAX_RECEIVES = 5
+
+
+class SqsSource:
+    """
+    Chunks named by SQS messages, read from and written to S3
+
+    A message body is either a chunk key or a JSON object with
+    "input_file" and optionally "bucket_name" and "output_folder", the
+    worker's own bucket and output folder are used for missing fields.
+    Results go to <output_folder>/results/<chunk>.result.<format> and
+    timings to <output_folder>/metrics/, as batch_processor.py writes them.
+    A message is deleted once its results are written, so a chunk whose
+    worker dies is delivered again after the visibility timeout, which
+    keep_alive() extends while the chunk is being priced. A chunk that fails
+    comes back the same way, until its message has been received
+    max_receives times. Messages that don't name a chunk, and those of
+    chunks that failed that often, are moved to the dead letter queue when
+    one is given, and deleted otherwise.
+
+    """
+
+    def __init__(self, queue_url, bucket=None, output_folder=None, result_queue_url=None,
+                 wait_seconds=SQS_WAIT_SECONDS, visibility_timeout=VISIBILITY_TIMEOUT, dead_letter_queue_url=None,
+                 max_receives=MAX_RECEIVES):
+        self.queue_url = queue_url
+        self.bucket = bucket
+        self.output_folder = output_folder
+        self.result_queue_url = result_queue_url
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter_queue_url = dead_letter_queue_url
+        self.max_receives = max_receives
+        self.sqs = boto3.client('sqs')
+        self.s3 = boto3.client('s3')
+
+    def _job(self, message):
+        try:
+            body = json.loads(message["Body"])
+        except ValueError:
+            body = message["Body"]
+        if not isinstance(body, dict):
+            body = {"input_file": str(body)}
+
+        job = {
+            "bucket_name": body.get("bucket_name", self.bucket),
+            "input_file": body.get("input_file"),
+            "output_folder": body.get("output_folder", self.output_folder),
+            "receipt": message["ReceiptHandle"],
+            "body": message["Body"],
+            "receive_count": int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1)),
+        }
+        for field in ["bucket_name", "input_file", "output_folder"]:
+            if not isinstance(job[field], str) or not job[field]:
+                raise ValueError("message has no {}".format(field))
+        return job
+
+    def _reject(self, body, receipt, error):
+        print("rejected message {}: {}".format(body, error))
+        if self.dead_letter_queue_url:
+            self.sqs.send_message(QueueUrl=self.dead_letter_queue_url, MessageBody=body)
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+    def receive(self):
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=SQS_BATCH, WaitTimeSeconds=self.wait_seconds,
+            VisibilityTimeout=self.visibility_timeout, AttributeNames=["ApproximateReceiveCount"]
+        )
+
+        jobs = []
+        for message in response.get("Messages", []):
+            # a malformed message would otherwise come back after every visibility timeout
+            try:
+                jobs.append(self._job(message))
+            except Exception as e:
+                self._reject(message["Body"], message["ReceiptHandle"], e)
+        return jobs
+
+    @contextlib.contextmanager
+    def keep_alive(self, job):
+        """ keeps the job's message hidden from other workers while the block runs """
+        stop = threading.Event()
+
+        def extend():
+            while not stop.wait(self.visibility_timeout / 3.0):
+                try:
+                    self.sqs.change_message_visibility(
+                        QueueUrl=self.queue_url, ReceiptHandle=job["receipt"], VisibilityTimeout=self.visibility_timeout
+                    )
+                except ClientError as e:
+                    print("could not extend the visibility of {}: {}".format(job["input_file"], e))
+
+        heartbeat = threading.Thread(target=extend, daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def read(self, job):
+        return self.s3.get_object(Bucket=job["bucket_name"], Key=job["input_file"])["Body"].read()
+
+    def write(self, job, name, body, folder='results'):
+        key = job["output_folder"] + '/' + folder + '/' + name
+        self.s3.put_object(Bucket=job["bucket_name"], Key=key, Body=body)
+        if self.result_queue_url and folder == 'results':
+            self.sqs.send_message(QueueUrl=self.result_queue_url, MessageBody=json.dumps({
+                "bucket_name": job["bucket_name"],
+                "input_file": job["input_file"],
+                "result_file": key,
+            }))
+        return key
+
+    def done(self, job):
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=job["receipt"])
+
+    def failed(self, job):
+        # leave the message to come back after its visibility timeout, unless
+        # the chunk has already failed that often
+        if job["receive_count"] >= self.max_receives:
+            self._reject(job["body"], job["receipt"], "failed {} times".format(job["receive_count"]))
+
+
+class DirectorySource:
+    """
+    Local stand-in for the queue: chunk files dropped into a directory
+
+    A chunk is claimed by renaming it into <directory>/processing, which is
+    atomic, so several workers can share one directory. Results are written
+    to <directory>/results and the chunk is moved to <directory>/done, or
+    to <directory>/failed when it could not be read or its results written.
+    Writers should create chunk files elsewhere, or under a name ending in
+    ".tmp", and rename them into the directory once complete.
+
+    """
+
+    def __init__(self, directory, poll_seconds=POLL_SECONDS):
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        for sub in ["processing", "results", "metrics", "done", "failed"]:
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    def receive(self):
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            claimed = os.path.join(self.directory, "processing", name)
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # taken by another worker
+                continue
+            return [{"input_file": claimed, "name": name}]
+
+        time.sleep(self.poll_seconds)
+        return []
+
+    def read(self, job):
+        with open(job["input_file"], 'rb') as infile:
+            return infile.read()
+
+    def write(self, job, name, body, folder='results'):
+        path = os.path.join(self.directory, folder, name)
+        with open(path + ".tmp", 'wb') as outfile:
+            outfile.write(body)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def keep_alive(self, job):
+        # a claimed chunk stays claimed
+        return contextlib.nullcontext()
+
+    def done(self, job):
+        os.replace(job["input_file"], os.path.join(self.directory, "done", job["name"]))
+
+    def failed(self, job):
+        os.replace(job["input_file"], os.path.join(self.directory, "failed", job["name"]))
+
+
+def load_portfolio(name, body):
+    if columnar.is_arrow(name):
+        return columnar.read_portfolio(io.BytesIO(body))
+    return json.loads(body)
+
+
+def dump_results(results, output_format):
+    if output_format == "arrow":
+        sink = io.BytesIO()
+        columnar.write_results(results, sink)
+        return sink.getvalue()
+    return json.dumps({"results": results}).encode('utf-8')
+
+
+def process_chunk(source, job, output_format=None, collect_metrics=True, emit_emf=False, **pricing):
+    """
+    Prices one chunk from a source and writes its results back to it
+
+    Args:
+        source: SqsSource or DirectorySource
+        dict: job, as returned by source.receive()
+        string: output_format, "json" or "arrow", the chunk's format by default
+        bool: collect_metrics, also write the chunk's per-option timings
+            to metrics/<chunk>.metrics.json next to results/
+        bool: emit_emf, print the timings as CloudWatch embedded metric format records
+        pricing: keyword arguments of price_portfolio
+
+    Returns:
+        string: where the results were written
+
+    """
+
+    name = job["input_file"].split("/")[-1]
+    portfolio = load_portfolio(name, source.read(job))
+    metrics = Metrics() if collect_metrics else None
+    results = price_portfolio(portfolio, metrics=metrics, **pricing)
+
+    output_format = output_format or ("arrow" if columnar.is_arrow(name) else "json")
+    path = source.write(job, name + '.result.' + output_format, dump_results(results, output_format))
+
+    if metrics is not None and metrics.engines:
+        source.write(job, name + '.metrics.json', json.dumps(metrics.summary()).encode('utf-8'), 'metrics')
+        if emit_emf:
+            for record in metrics.emf({"InputFile": job["input_file"]}):
+                print(json.dumps(record))
+    return path
+
+
+def run_worker(source, output_format=None, vectorize=True, workers=1, cache=None, max_chunks=None,
+               max_idle_seconds=None, collect_metrics=True, emit_emf=False):
+    """
+    Prices chunks from a source until stopped
+
+    Args:
+        source: SqsSource or DirectorySource
+        string: output_format, "json" or "arrow", each chunk's format by default
+        bool: vectorize, int: workers, ResultCache: cache, as for price_portfolio
+        int: max_chunks, stop after this many chunks, never by default
+        float: max_idle_seconds, stop after receiving nothing for this long,
+            never by default
+        bool: collect_metrics, emit_emf, as for process_chunk
+
+    Returns:
+        int: chunks processed
+
+    """
+
+    executor = worker_pool(workers) if workers > 1 else None
+    processed = 0
+    idle_since = time.monotonic()
+
+    try:
+        while max_chunks is None or processed < max_chunks:
+            jobs = source.receive()
+            if not jobs:
+                if max_idle_seconds is not None and time.monotonic() - idle_since >= max_idle_seconds:
+                    break
+                continue
+
+            for job in jobs:
+                start = time.perf_counter()
+                try:
+                    with source.keep_alive(job):
+                        path = process_chunk(source, job, output_format, collect_metrics, emit_emf,
+                                             vectorize=vectorize, workers=workers, cache=cache, executor=executor)
+                except Exception as e:
+                    print("chunk {} failed: {} {}".format(job["input_file"], e, traceback.format_exc()))
+                    source.failed(job)
+                else:
+                    source.done(job)
+                    print("chunk {} -> {} in {:.3f}s".format(job["input_file"], path, time.perf_counter() - start))
+                processed += 1
+            idle_since = time.monotonic()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("market data cache: {}".format(MARKET_DATA_CACHE.stats()))
+    if cache is not None:
+        print("result cache: {}".format(cache.stats()))
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--QueueUrl", type=str, default=None,
+                        help="SQS queue of chunk keys to price")
+    parser.add_argument("--WatchDirectory", type=str, default=None,
+                        help="local directory of chunk files to price, instead of a queue")
+    parser.add_argument("--BucketName", type=str, default=None)
+    parser.add_argument("--OutputFolder", type=str, default=None)
+    parser.add_argument("--ResultQueueUrl", type=str, default=None,
+                        help="SQS queue notified of every result file written")
+    parser.add_argument("--DeadLetterQueueUrl", type=str, default=None,
+                        help="SQS queue that messages naming no chunk, or whose chunk keeps failing, are moved to, "
+                             "they are deleted otherwise")
+    parser.add_argument("--MaxReceives", type=int, default=MAX_RECEIVES,
+                        help="deliveries of a chunk's message before a failing chunk is given up on")
+    parser.add_argument("--VisibilityTimeout", type=int, default=VISIBILITY_TIMEOUT,
+                        help="seconds a chunk's message stays hidden, extended while the chunk is priced")
+    parser.add_argument("--NoBatchPricing", action="store_true",
+                        help="price every option through QuantLib, one by one")
+    parser.add_argument("--ResultCache", type=str, default=os.environ.get("RESULT_CACHE_PATH"),
+                        help="SQLite file of previously computed results, reused across runs")
+    parser.add_argument("--ResultCacheMaxAgeDays", type=float, default=7.0)
+    parser.add_argument("--ResultCacheMaxEntries", type=int, default=1000000)
+    parser.add_argument("--NoResultCache", action="store_true",
+                        help="bypass the result cache even when one is configured")
+    parser.add_argument("--Workers", "--workers", type=int, default=1,
+                        help="number of worker processes for options priced one by one")
+    parser.add_argument("--OutputFormat", type=str, choices=["json", "arrow"], default=None,
+                        help="results file format, each chunk's format by default")
+    parser.add_argument("--NoMetrics", action="store_true",
+                        help="skip the per-option timings and their <chunk>.metrics.json sidecar files")
+    parser.add_argument("--EmitEMF", action="store_true",
+                        help="also print the timings as CloudWatch embedded metric format records")
+    parser.add_argument("--MaxChunks", type=int, default=None)
+    parser.add_argument("--MaxIdleSeconds", type=float, default=None)
+    args = parser.parse_args()
+
+    if (args.QueueUrl is None) == (args.WatchDirectory is None):
+        parser.error("exactly one of --QueueUrl and --WatchDirectory is required")
+
+    if args.QueueUrl is not None:
+        chunk_source = SqsSource(args.QueueUrl, args.BucketName, args.OutputFolder, args.ResultQueueUrl,
+                                 visibility_timeout=args.VisibilityTimeout,
+                                 dead_letter_queue_url=args.DeadLetterQueueUrl, max_receives=args.MaxReceives)
+    else:
+        chunk_source = DirectorySource(args.WatchDirectory)
+
+    cache = None
+    if args.ResultCache and not args.NoResultCache:
+        cache = ResultCache(
+            args.ResultCache,
+            max_age=args.ResultCacheMaxAgeDays * 24 * 3600,
+            max_entries=args.ResultCacheMaxEntries,
+        )
+
+    try:
+        run_worker(chunk_source, args.OutputFormat, vectorize=not args.NoBatchPricing, workers=args.Workers,
+                   cache=cache, max_chunks=args.MaxChunks, max_idle_seconds=args.MaxIdleSeconds,
+                   collect_metrics=not args.NoMetrics, emit_emf=args.EmitEMF)
+    finally:
+        if cache is not None:
+            cache.close()